@@ -0,0 +1,101 @@
+"""
+对比航班搜索的两种后端在不同数据量下的耗时：SQLite（逐行读取并构建字典）与内存列式存储（NumPy 向量化过滤）。
+
+在临时目录中按给定的行数生成合成的 flights 表，并建好与迁移脚本相同的航班索引，
+对同一组查询分别用两种后端调用 search_flights，输出平均耗时和返回的行数（两种后端的结果必须完全相同）。
+
+用法: python -m benchmarks.bench_flight_columns [行数 ...]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from tools.flights_tools import search_flights
+from utils.db_migrations import MIGRATIONS
+from utils.db_pool import close_pool
+from utils.flight_columns import get_flight_columns, invalidate_flight_columns
+
+AIRPORTS = ["SHA", "PEK", "CDG", "LHR", "MUC", "BSL", "ZRH", "GVA", "FRA", "AMS", "HKG", "NRT"]
+START = datetime(2026, 10, 1)
+DAYS = 30
+
+# (说明, search_flights 的参数)：统计类的大结果集查询，以及 Agent 平时使用的小结果集查询
+QUERIES = [
+    ("某机场一周内的全部航班", {"departure_airport": "SHA", "start_time": "2026-10-05", "end_time": "2026-10-12",
+                      "limit": 10 ** 9}),
+    ("一周内的全部航班", {"start_time": "2026-10-05", "end_time": "2026-10-12", "limit": 10 ** 9}),
+    ("某航线一天内前 20 个", {"departure_airport": "CDG", "arrival_airport": "BSL", "start_time": "2026-10-08",
+                        "end_time": "2026-10-09", "limit": 20}),
+    ("某航线全部航班", {"departure_airport": "MUC", "arrival_airport": "LHR", "limit": 10 ** 9}),
+]
+
+
+def build_flights(path: str, rows: int):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE flights ("flight_id" INTEGER, "flight_no" TEXT, "scheduled_departure" TEXT, '
+        '"scheduled_arrival" TEXT, "departure_airport" TEXT, "arrival_airport" TEXT, "status" TEXT, '
+        '"aircraft_code" TEXT, "actual_departure" TEXT, "actual_arrival" TEXT)'
+    )
+    rnd = random.Random(42)
+    batch = []
+    for i in range(1, rows + 1):
+        departure_airport, arrival_airport = rnd.sample(AIRPORTS, 2)
+        departure = START + timedelta(seconds=rnd.randrange(DAYS * 86400))
+        arrival = departure + timedelta(minutes=rnd.randrange(60, 720))
+        batch.append((i, f"LX{i:04d}", f"{departure:%Y-%m-%d %H:%M:%S}.000000-04:00",
+                      f"{arrival:%Y-%m-%d %H:%M:%S}.000000-04:00", departure_airport, arrival_airport,
+                      "Scheduled", "320", None, None))
+        if len(batch) == 100000:
+            conn.executemany("INSERT INTO flights VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany("INSERT INTO flights VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    # 与迁移脚本中相同的航班索引，SQLite 后端按它们执行查询
+    for _, _, steps in MIGRATIONS:
+        for step in steps:
+            if isinstance(step, str) and step.startswith("CREATE INDEX") and " ON flights " in step:
+                conn.execute(step)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def timed(params: dict, config: dict, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = search_flights.func(**params, config=config)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def run(rows: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "flights.sqlite")
+        build_flights(path, rows)
+        sqlite_config = {"configurable": {"db_path": path}}
+        columnar_config = {"configurable": {"db_path": path, "flight_search_backend": "columnar"}}
+
+        start = time.perf_counter()
+        get_flight_columns(path)
+        print(f"\n{rows} 行，构建列式存储耗时 {time.perf_counter() - start:.2f} 秒")
+        print(f"{'查询':>14} | {'行数':>8} | {'SQLite ms':>10} | {'列式 ms':>10} | 加速比")
+        for name, params in QUERIES:
+            sqlite_ms, sqlite_rows = timed(params, sqlite_config, repeat)
+            columnar_ms, columnar_rows = timed(params, columnar_config, repeat)
+            assert sqlite_rows == columnar_rows, f"{name}: 两种后端的结果不一致"
+            print(f"{name:>14} | {len(sqlite_rows):>8} | {sqlite_ms:>10.2f} | {columnar_ms:>10.2f} | "
+                  f"{sqlite_ms / columnar_ms:>5.1f}x")
+        close_pool(path)
+        invalidate_flight_columns(path)
+
+
+def main(sizes: list[int], repeat: int = 5):
+    for rows in sizes:
+        run(rows, repeat)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,96 @@
+"""
+对比酒店搜索在 LIKE '%x%' 和 FTS5 全文索引两种方式下的查询耗时。
+
+在临时目录中生成一个合成的 hotels 表（默认 100 万行），建好 FTS5 索引后，
+对同一组查询分别用两种 SQL 执行若干次，输出平均耗时。
+
+用法: python -m benchmarks.bench_fts_search [行数]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from utils.fts import build_search_query, create_fts_indexes
+
+CITIES = ["Basel", "Zurich", "Lucerne", "Bern", "Geneva", "Lausanne", "Lugano", "Shanghai", "Beijing", "Chengdu",
+          "Hangzhou", "Guangzhou", "Shenzhen", "Paris", "London", "Berlin", "Munich", "Vienna", "Prague", "Milan"]
+BRANDS = ["Hilton", "Marriott", "Hyatt", "Radisson", "Sheraton", "Novotel", "Ibis", "Mercure", "Holiday Inn",
+          "Four Seasons", "Ritz Carlton", "Westin", "Kempinski", "Mandarin Oriental", "Peninsula"]
+SUFFIXES = ["Hotel", "Resort", "Suites", "Inn", "Lodge", "Residence", "Palace", "Garden", "Tower", "Plaza"]
+
+# (location, name) 组合，覆盖高选择性和低选择性的查询
+QUERIES = [
+    ("Basel", "Hilton"),
+    ("Zurich", None),
+    (None, "Mandarin"),
+    ("Lugano", "Four Seasons Palace"),
+    ("Shanghai", "Ibis"),
+]
+
+
+def build_catalog(path: str, rows: int):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE hotels ("id" INTEGER, "name" TEXT, "location" TEXT, "price_tier" TEXT, '
+        '"checkin_date" TEXT, "checkout_date" TEXT, "booked" INTEGER)'
+    )
+    rnd = random.Random(42)
+    batch = []
+    for i in range(1, rows + 1):
+        city = rnd.choice(CITIES)
+        name = f"{rnd.choice(BRANDS)} {city} {rnd.choice(SUFFIXES)} {i}"
+        batch.append((i, name, city, "Midscale", "2024-04-02", "2024-04-20", 0))
+        if len(batch) == 100000:
+            conn.executemany("INSERT INTO hotels VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany("INSERT INTO hotels VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    return conn
+
+
+def like_query(location, name):
+    query = "SELECT * FROM hotels WHERE 1=1"
+    params = []
+    if location:
+        query += " AND location LIKE ?"
+        params.append(f"%{location}%")
+    if name:
+        query += " AND name LIKE ?"
+        params.append(f"%{name}%")
+    return query, params
+
+
+def timed(conn, query, params, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        count = len(conn.execute(query, params).fetchall())
+    return (time.perf_counter() - start) / repeat * 1000, count
+
+
+def main(rows: int = 1_000_000, repeat: int = 5):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.sqlite")
+        start = time.perf_counter()
+        conn = build_catalog(path, rows)
+        print(f"生成 {rows} 行合成数据耗时 {time.perf_counter() - start:.1f} 秒")
+
+        start = time.perf_counter()
+        create_fts_indexes(conn, ["hotels"])
+        conn.commit()
+        print(f"建立 FTS5 索引耗时 {time.perf_counter() - start:.1f} 秒\n")
+
+        print(f"{'location':>10} {'name':>20} | {'LIKE ms':>10} {'行数':>8} | {'FTS5 ms':>10} {'行数':>8} | 加速比")
+        for location, name in QUERIES:
+            like_ms, like_rows = timed(conn, *like_query(location, name), repeat)
+            fts_ms, fts_rows = timed(conn, *build_search_query(conn, "hotels", {"location": location, "name": name}),
+                                     repeat)
+            print(f"{str(location):>10} {str(name):>20} | {like_ms:>10.2f} {like_rows:>8} | "
+                  f"{fts_ms:>10.2f} {fts_rows:>8} | {like_ms / fts_ms:>5.1f}x")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
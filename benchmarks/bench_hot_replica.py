@@ -0,0 +1,92 @@
+"""
+对比 search_* 工具使用的查询在磁盘数据库和内存热副本上的延迟。
+
+在一份独立的数据库快照上，对同一组查询（按ID查酒店、酒店全文检索、按航线查航班）分别通过磁盘连接池和热副本执行，
+输出每类查询的 p50/p99 延迟（微秒）。可以选择同时启动一个线程不停地预订/取消酒店，观察写入（以及同步到副本的增量）对读延迟的影响。
+
+用法（在 core 目录下运行，和其它脚本一样通过 ../travel2.sqlite 构建快照）:
+    PYTHONPATH=.. python -m benchmarks.bench_hot_replica [每类查询的次数] [--with-writes]
+"""
+import random
+import sys
+import threading
+import time
+
+from tools.flights_tools import _flights_query
+from tools.hotels_tools import book_hotel, cancel_hotel
+from utils.db_snapshot import create_snapshot
+from utils.fts import build_search_query
+from utils.hot_replica import close_hot_replica, enable_hot_replica, search_reader
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def _workloads(db_path: str) -> dict:
+    """生成每类查询的 (表名, SQL, 参数) 列表，磁盘和副本使用完全相同的查询。"""
+    rnd = random.Random(42)
+    with search_reader(db_path, "hotels") as conn:
+        hotel_ids = [row[0] for row in conn.execute("SELECT id FROM hotels")]
+        locations = [row[0] for row in conn.execute("SELECT DISTINCT location FROM hotels")]
+        routes = conn.execute("SELECT DISTINCT departure_airport, arrival_airport FROM flights").fetchall()
+        fts = [build_search_query(conn, "hotels", {"location": location}) for location in locations]
+    return {
+        "酒店按ID": [("hotels", "SELECT * FROM hotels WHERE id = ?", [rnd.choice(hotel_ids)]) for _ in range(100)],
+        "酒店检索": [("hotels", query, params) for query, params in fts],
+        "航线航班": [("flights", *_flights_query(*rnd.choice(routes), limit=20)) for _ in range(100)],
+    }
+
+
+def _measure(db_path: str, workloads: dict, repeat: int) -> dict:
+    results = {}
+    for name, queries in workloads.items():
+        latencies = []
+        for i in range(repeat):
+            table, query, params = queries[i % len(queries)]
+            start = time.perf_counter()
+            with search_reader(db_path, table) as conn:
+                conn.execute(query, params).fetchall()
+            latencies.append(time.perf_counter() - start)
+        results[name] = latencies
+    return results
+
+
+def _write_loop(config: dict, stop: threading.Event, counter: list):
+    rnd = random.Random(7)
+    while not stop.is_set():
+        hotel_id = rnd.randint(1, 200)
+        book_hotel.func(hotel_id, config=config)
+        cancel_hotel.func(hotel_id, config=config)
+        counter[0] += 2
+
+
+def run(mode: str, db_path: str, workloads: dict, repeat: int, with_writes: bool):
+    stop, counter = threading.Event(), [0]
+    writer = threading.Thread(target=_write_loop, args=({"configurable": {"db_path": db_path}}, stop, counter))
+    if with_writes:
+        writer.start()
+    results = _measure(db_path, workloads, repeat)
+    if with_writes:
+        stop.set()
+        writer.join()
+    for name, latencies in results.items():
+        print(f"{mode:>6} | {name:>6} | {_percentile(latencies, 0.5) * 1e6:>8.1f} "
+              f"{_percentile(latencies, 0.99) * 1e6:>8.1f} | {counter[0]:>6}")
+
+
+def main(repeat: int = 5000, with_writes: bool = False):
+    with create_snapshot("bench_hot_replica") as snapshot:
+        workloads = _workloads(snapshot.path)
+        print(f"每类查询 {repeat} 次{'，同时后台预订/取消酒店' if with_writes else ''}\n")
+        print(f"{'数据源':>6} | {'查询':>6} | {'p50 us':>8} {'p99 us':>8} | {'写入次数':>6}")
+        run("disk", snapshot.path, workloads, repeat, with_writes)
+        enable_hot_replica(snapshot.path)
+        run("memory", snapshot.path, workloads, repeat, with_writes)
+        close_hot_replica(snapshot.path)
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(int(args[0]) if args else 5000, "--with-writes" in sys.argv)
@@ -0,0 +1,129 @@
+"""
+多个进程同时预订/取消/修改同一批酒店时，对比原来的无条件 UPDATE 与按版本号比较并更新（乐观并发控制）的吞吐量和正确性。
+
+两种写法各自在一份独立的数据库快照上运行：启动若干个进程，每个进程对少量热门酒店随机执行预订、取消和修改日期，
+最后按酒店核对两个不变式：
+- 预订成功次数 - 取消成功次数 = 最终的 booked（不会有两个会话都预订成功同一家酒店）；
+- 成功的修改次数 = 最终的 version（每次报告成功的修改都真正写入了，没有丢失更新）。
+原来的写法不检查当前状态，每次都报告成功，第一个不变式会被破坏；它也不维护版本号，不核对第二个不变式。
+
+用法（在 core 目录下运行，和其它脚本一样通过 ../travel2.sqlite 构建快照）:
+    PYTHONPATH=.. python -m benchmarks.bench_optimistic_booking [进程数] [每个进程的操作数] [酒店数]
+"""
+import multiprocessing
+import random
+import sqlite3
+import sys
+import time
+
+from utils.db_pool import get_pool
+from utils.db_snapshot import create_snapshot
+from utils.optimistic import UPDATED, optimistic_stats, optimistic_update, set_booked, set_values
+
+# 原来的工具中执行的语句：不检查当前状态，只要行存在就报告成功
+LEGACY_STATEMENTS = {
+    "book": ("UPDATE hotels SET booked = 1 WHERE id = ?", ()),
+    "cancel": ("UPDATE hotels SET booked = 0 WHERE id = ?", ()),
+    "update": ("UPDATE hotels SET checkin_date = ? WHERE id = ?", ("2026-10-20",)),
+}
+
+
+def _legacy(db_path: str, action: str, hotel_id: int) -> bool:
+    sql, values = LEGACY_STATEMENTS[action]
+    with get_pool(db_path).writer() as conn:
+        return conn.execute(sql, (*values, hotel_id)).rowcount > 0
+
+
+def _optimistic(db_path: str, action: str, hotel_id: int) -> bool:
+    change = {
+        "book": set_booked(1),
+        "cancel": set_booked(0),
+        "update": set_values(checkin_date="2026-10-20", checkout_date="2026-10-22"),
+    }[action]
+    return optimistic_update(db_path, "hotels", hotel_id, change) == UPDATED
+
+
+def _worker(mode: str, db_path: str, hotel_ids: list, operations: int, seed: int, barrier, results):
+    run_one = _legacy if mode == "legacy" else _optimistic
+    rnd = random.Random(seed)
+    counts = {hotel_id: {"book": 0, "cancel": 0, "update": 0} for hotel_id in hotel_ids}
+    latencies = []
+    barrier.wait()
+    for _ in range(operations):
+        hotel_id = rnd.choice(hotel_ids)
+        action = rnd.choices(("book", "cancel", "update"), weights=(45, 45, 10))[0]
+        start = time.perf_counter()
+        if run_one(db_path, action, hotel_id):
+            counts[hotel_id][action] += 1
+        latencies.append(time.perf_counter() - start)
+    results.put((counts, latencies, optimistic_stats.snapshot()))
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(mode: str, processes: int, operations: int, hotels: int):
+    with create_snapshot(f"bench_optimistic_booking_{mode}") as snapshot:
+        conn = sqlite3.connect(snapshot.path)
+        hotel_ids = [row[0] for row in conn.execute("SELECT id FROM hotels ORDER BY id LIMIT ?", (hotels,))]
+        conn.execute(f"UPDATE hotels SET booked = 0 WHERE id IN ({', '.join('?' for _ in hotel_ids)})", hotel_ids)
+        initial_versions = dict(conn.execute("SELECT id, version FROM hotels"))
+        conn.commit()
+        conn.close()
+
+        barrier = multiprocessing.Barrier(processes + 1)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_worker, args=(mode, snapshot.path, hotel_ids, operations, i, barrier, results)
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        totals = {hotel_id: {"book": 0, "cancel": 0, "update": 0} for hotel_id in hotel_ids}
+        latencies, conflicts, exhausted = [], 0, 0
+        for _ in workers:
+            counts, worker_latencies, stats = results.get()
+            for hotel_id, actions in counts.items():
+                for action, count in actions.items():
+                    totals[hotel_id][action] += count
+            latencies.extend(worker_latencies)
+            conflicts += stats["conflicts"]
+            exhausted += stats["exhausted"]
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            worker.join()
+
+        conn = sqlite3.connect(snapshot.path)
+        final = {row[0]: row[1:] for row in conn.execute("SELECT id, booked, version FROM hotels")}
+        conn.close()
+
+    double_bookings = sum(
+        1 for hotel_id, actions in totals.items() if actions["book"] - actions["cancel"] != final[hotel_id][0]
+    )
+    lost_updates = 0
+    if mode != "legacy":
+        lost_updates = sum(
+            sum(actions.values()) - (final[hotel_id][1] - initial_versions[hotel_id])
+            for hotel_id, actions in totals.items()
+        )
+    print(f"{mode:>10} | {len(latencies):>6} | {_percentile(latencies, 0.5) * 1000:>7.2f} "
+          f"{_percentile(latencies, 0.99) * 1000:>7.2f} | {len(latencies) / elapsed:>7.0f} | "
+          f"{conflicts:>6} {exhausted:>6} | {double_bookings:>10} {lost_updates:>8}")
+
+
+def main(processes: int = 8, operations: int = 500, hotels: int = 10):
+    print(f"{processes} 个进程，每个进程 {operations} 次操作，争抢 {hotels} 家酒店\n")
+    print(f"{'写法':>10} | {'次数':>6} | {'p50 ms':>7} {'p99 ms':>7} | {'次/秒':>7} | "
+          f"{'版本冲突':>6} {'重试用完':>6} | {'状态不一致的酒店':>10} {'丢失更新':>8}")
+    for mode in ("legacy", "optimistic"):
+        run(mode, processes, operations, hotels)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -0,0 +1,126 @@
+"""
+对比改签在多个进程同时写库时的延迟：原来的"先查三次、再更新"的写法，与单条 UPDATE ... WHERE EXISTS ... RETURNING 的写法。
+
+两种写法各自在一份独立的数据库快照上运行：启动若干个进程，每个进程依次对不同的机票执行改签，
+记录每次操作的耗时，最后输出 p50/p95/p99/最大延迟和吞吐量。
+
+用法（在 core 目录下运行，和其它脚本一样通过 ../travel2.sqlite 构建快照）:
+    PYTHONPATH=.. python -m benchmarks.bench_ticket_writes [进程数] [每个进程的操作数]
+"""
+import multiprocessing
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from utils.db_pool import DEFAULT_PRAGMAS
+from utils.db_snapshot import create_snapshot
+
+
+def legacy_update_ticket(conn: sqlite3.Connection, ticket_no: str, new_flight_id: int, passenger_id: str) -> str:
+    """原来的实现：四条语句分别校验和更新，校验发生在事务之外。"""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT departure_airport, arrival_airport, scheduled_departure FROM flights WHERE flight_id = ?",
+        (new_flight_id,),
+    )
+    new_flight = cursor.fetchone()
+    if not new_flight:
+        return "提供的新的航班 ID 无效。"
+    departure_time = datetime.strptime(new_flight[2], "%Y-%m-%d %H:%M:%S.%f%z")
+    if (departure_time - datetime.now(tz=departure_time.tzinfo)).total_seconds() < 3 * 3600:
+        return "不允许重新安排到距离当前时间少于 3 小时的航班。"
+    cursor.execute("SELECT flight_id FROM ticket_flights WHERE ticket_no = ?", (ticket_no,))
+    if not cursor.fetchone():
+        return "未找到给定机票号码的现有机票。"
+    cursor.execute("SELECT * FROM tickets WHERE ticket_no = ? AND passenger_id = ?", (ticket_no, passenger_id))
+    if not cursor.fetchone():
+        return "不是机票的拥有者。"
+    cursor.execute("UPDATE ticket_flights SET flight_id = ? WHERE ticket_no = ?", (new_flight_id, ticket_no))
+    conn.commit()
+    return "机票已成功更新为新的航班。"
+
+
+def _worker(mode: str, db_path: str, jobs: list, barrier, results):
+    latencies = []
+    failures = 0
+    if mode == "legacy":
+        conn = sqlite3.connect(db_path)
+        for name, value in DEFAULT_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+    else:
+        from tools.flights_tools import update_ticket_to_new_flight
+
+    barrier.wait()
+    for ticket_no, passenger_id, new_flight_id in jobs:
+        start = time.perf_counter()
+        try:
+            if mode == "legacy":
+                message = legacy_update_ticket(conn, ticket_no, new_flight_id, passenger_id)
+            else:
+                # 直接调用工具包装的函数，不计入 LangChain 的调用开销，和 legacy 在同一层面比较
+                message = update_ticket_to_new_flight.func(
+                    ticket_no, new_flight_id, config={"configurable": {"passenger_id": passenger_id, "db_path": db_path}}
+                )
+            if not message.startswith("机票已成功"):
+                failures += 1
+        except sqlite3.OperationalError:
+            # database is locked 之类的错误也计入失败
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    results.put((latencies, failures))
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(mode: str, processes: int, operations: int):
+    with create_snapshot(f"bench_ticket_writes_{mode}") as snapshot:
+        conn = sqlite3.connect(snapshot.path)
+        tickets = conn.execute(
+            "SELECT t.ticket_no, t.passenger_id FROM tickets t JOIN ticket_flights tf ON tf.ticket_no = t.ticket_no "
+            "LIMIT ?",
+            (processes * operations,),
+        ).fetchall()
+        flights = [row[0] for row in conn.execute(
+            "SELECT flight_id FROM flights WHERE julianday(scheduled_departure) - julianday('now') > 1 LIMIT 100"
+        )]
+        conn.close()
+        jobs = [(ticket_no, passenger_id, flights[i % len(flights)]) for i, (ticket_no, passenger_id) in
+                enumerate(tickets)]
+
+        barrier = multiprocessing.Barrier(processes + 1)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_worker, args=(mode, snapshot.path, jobs[i::processes], barrier, results))
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        latencies, failures = [], 0
+        for _ in workers:
+            worker_latencies, worker_failures = results.get()
+            latencies.extend(worker_latencies)
+            failures += worker_failures
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            worker.join()
+
+    print(f"{mode:>8} | {len(latencies):>6} | {_percentile(latencies, 0.5) * 1000:>8.2f} "
+          f"{_percentile(latencies, 0.95) * 1000:>8.2f} {_percentile(latencies, 0.99) * 1000:>8.2f} "
+          f"{max(latencies) * 1000:>8.2f} | {len(latencies) / elapsed:>8.0f} | {failures:>4}")
+
+
+def main(processes: int = 8, operations: int = 200):
+    print(f"{processes} 个进程，每个进程 {operations} 次改签\n")
+    print(f"{'写法':>8} | {'次数':>6} | {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} | {'次/秒':>8} | 失败")
+    for mode in ("legacy", "atomic"):
+        run(mode, processes, operations)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
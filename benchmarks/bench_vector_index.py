@@ -0,0 +1,88 @@
+"""
+对比向量索引各后端（精确检索的 float32/int8 存储、IVF 的不同 nprobe、安装了 hnswlib 时的 HNSW）的建索引耗时、
+查询延迟、单次查询的峰值内存（tracemalloc 统计的 NumPy 临时数组）和 recall@k。
+
+生成一组带簇结构的归一化随机向量模拟文档（真实的文本向量同样是聚成若干主题的），查询向量是随机文档加噪声。
+以精确检索的结果为标准答案，recall@k = 各后端返回的前 k 个文档中属于标准答案的比例。
+另外检查每个后端 save() 之后 load_index() 读回的索引与原索引的查询结果是否一致。
+
+用法: python -m benchmarks.bench_vector_index [文档数] [维度] [查询数] [k]
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.vector_index import ExactIndex, HNSWIndex, IVFIndex, hnswlib, load_index
+
+
+def make_vectors(n: int, dim: int, clusters: int, rnd: np.random.Generator) -> np.ndarray:
+    centers = rnd.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rnd.integers(0, clusters, n)] + 2.0 * rnd.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors: np.ndarray, count: int, rnd: np.random.Generator) -> np.ndarray:
+    queries = vectors[rnd.integers(0, len(vectors), count)]
+    queries = queries + 0.5 * rnd.standard_normal(queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(label: str, index, vectors: np.ndarray, queries: np.ndarray, truth: list, k: int):
+    start = time.perf_counter()
+    index.build(vectors)
+    build_seconds = time.perf_counter() - start
+
+    latencies, hits, results = [], 0, []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids, _ = index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids.tolist()) & expected)
+        results.append(ids)
+
+    tracemalloc.start()
+    index.search(queries[0], k)
+    peak_kib = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as directory:
+        index.save(directory)
+        loaded = load_index(directory)
+        same = all(np.array_equal(loaded.search(query, k)[0], ids) for query, ids in zip(queries, results))
+
+    print(f"{label:>16} | {build_seconds:>8.2f} | {_percentile(latencies, 0.5) * 1000:>7.3f} "
+          f"{_percentile(latencies, 0.99) * 1000:>7.3f} | {peak_kib:>9.0f} | {hits / (len(queries) * k):>8.3f} | "
+          f"{'一致' if same else '不一致'}")
+
+
+def main(n: int = 50000, dim: int = 256, queries: int = 200, k: int = 5):
+    rnd = np.random.default_rng(0)
+    vectors = make_vectors(n, dim, clusters=max(1, n // 200), rnd=rnd)
+    query_vectors = make_queries(vectors, queries, rnd)
+    exact = ExactIndex().build(vectors)
+    truth = [set(exact.search(query, k)[0].tolist()) for query in query_vectors]
+
+    print(f"{n} 个 {dim} 维文档，{queries} 次查询，k = {k}\n")
+    print(f"{'后端':>16} | {'建索引 s':>8} | {'p50 ms':>7} {'p99 ms':>7} | {'峰值 KiB':>9} | {f'recall@{k}':>8} | 保存后读回")
+    run("exact 不分块", ExactIndex(chunk_rows=n), vectors, query_vectors, truth, k)
+    run("exact", ExactIndex(), vectors, query_vectors, truth, k)
+    run("exact int8", ExactIndex(quantize="int8"), vectors, query_vectors, truth, k)
+    for nprobe in (1, 4, 16, 64):
+        run(f"ivf nprobe={nprobe}", IVFIndex(nprobe=nprobe), vectors, query_vectors, truth, k)
+    if hnswlib is None:
+        print(f"{'hnsw':>16} | 未安装 hnswlib，跳过（pip install hnswlib）")
+    else:
+        for ef in (32, 128):
+            run(f"hnsw ef={ef}", HNSWIndex(ef=ef), vectors, query_vectors, truth, k)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:5]))
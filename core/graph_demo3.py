@@ -10,10 +10,14 @@ from tools.base_class_tool import ToFlightBookingAssistant, ToBookCarRental, ToH
     ToBookExcursion
 from graph_chat.build_child_graph import build_flight_graph, builder_hotel_graph, build_car_graph, \
     builder_excursion_graph
-from tools.flights_tools import fetch_user_flight_information
+from langchain_core.runnables import RunnableConfig
+from tools.flights_tools import fetch_user_flight_information, user_info_cache, user_info_cache_key
 from graph_chat.state import State
-from utils.init_db import update_dates
+from utils.db_snapshot import create_snapshot
+from utils.hot_replica import enable_hot_replica, DEFAULT_MEMORY_BUDGET
 from tools.tools_handler import create_tool_node_with_fallback, _print_event
+from utils.tool_output import tool_output_stats
+from tools.retriever_vector import query_embedding_cache
 
 """
 各助理的介绍:
@@ -155,7 +159,23 @@ def route_primary_assistant(state: dict):
         return END
 
 
-builder.add_edge(START, 'fetch_user_info')
+def route_start(state: dict, config: RunnableConfig) -> str:
+    """
+    每轮对话的入口。state 中的用户信息和缓存中的一致时（缓存未过期，也没有被改签、退票删除），
+    说明用户的机票没有变化，跳过 fetch_user_info 节点直接进入当前的工作流。
+    :param state: 当前对话状态字典
+    :param config: 运行配置，包含乘客ID和数据库路径
+    :return: 应跳转到的节点名
+    """
+    user_info = state.get("user_info")
+    key = user_info_cache_key(config)
+    if user_info is not None and user_info_cache.peek(key) == user_info:
+        user_info_cache.get(key)  # 跳过节点也算一次缓存命中，计入命中率
+        return route_to_workflow(state)
+    return "fetch_user_info"
+
+
+builder.add_conditional_edges(START, route_start)
 # 没有加path_map的限定，因为state中的dialog_state已经经过了严格的限定（只能是五个选项之一），因此不用担心值出错
 builder.add_conditional_edges("fetch_user_info", route_to_workflow)  # 根据获取用户信息进行路由
 
@@ -204,7 +224,11 @@ graph = builder.compile(
 
 # 生成随机的唯一会话id
 session_id = str(uuid.uuid4())
-update_dates()  # 每次测试的时候：保证数据库是全新的，保证，时间也是最近的时间
+# 每次测试的时候：保证数据库是全新的，保证，时间也是最近的时间
+# 每个会话使用自己独立的数据库快照（从对齐好日期的模板库克隆），并发的会话之间不会互相覆盖数据
+snapshot = create_snapshot(session_id)
+# 把航班、酒店、租车、游览这几张读多写少的参考表加载到内存中，search_* 工具直接从内存读取；预订工具写磁盘并同步增量
+enable_hot_replica(snapshot.path, memory_budget=DEFAULT_MEMORY_BUDGET)
 
 # 配置参数，包含乘客ID和线程ID
 config = {
@@ -213,6 +237,8 @@ config = {
         "passenger_id": "3442 587242",
         # 检查点由session_id访问
         "thread_id": session_id,
+        # 预订工具读写的数据库快照
+        "db_path": snapshot.path,
     }
 }
 
@@ -224,6 +250,10 @@ while True:
     # 退出逻辑，目前只是样本，当用户输入的单词包括 q/exit/quit 时退出，也没有进行中译英
     if question.lower() in ['q', 'exit', 'quit']:
         print('对话结束，拜拜！')
+        print('用户信息缓存：', user_info_cache.stats())
+        print('工具结果压缩：', tool_output_stats.snapshot())
+        print('政策查询向量缓存：', query_embedding_cache.stats())
+        snapshot.close()
         break
     else:
         # 参数：input——对state的初始化更新，config——之前动态定义的配置字典，stream_mode——返回值（events）的格式，具体如下：
@@ -263,3 +293,14 @@ while True:
             # 打印事件详情
             for event in events:
                 _print_event(event, _printed)
+
+        # 本轮查询工具的结果以紧凑表格发给 LLM，输出节省的 token 数
+        turn_stats = tool_output_stats.end_turn()
+        if turn_stats["calls"]:
+            print(f"本轮工具结果压缩：{turn_stats['tokens_before']} -> {turn_stats['tokens_after']} tokens，"
+                  f"节省 {turn_stats['tokens_saved']}")
+        # 政策查询的向量缓存：命中一次就省掉一次远程嵌入请求
+        cache_stats = query_embedding_cache.end_turn()
+        if cache_stats["hits"] + cache_stats["misses"]:
+            print(f"本轮政策查询向量缓存：命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，"
+                  f"节省远程调用 {cache_stats['round_trips_saved']} 次")
@@ -8,16 +8,15 @@ from dwspark.config import Config
 from dwspark.models import ChatModel, ImageUnderstanding, Text2Audio, Audio2Text, EmbeddingModel,Text2Img
 from PIL import Image
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_community.retrievers import BM25Retriever
 from sklearn.metrics.pairwise import cosine_similarity 
-import pickle
-import re
-import time
 import json
 import numpy as np
 from utils.text2video import text2video
+from loader.kb_index import DEFAULT_CACHE_DIR, EMBEDDING_MODEL, KnowledgeBase, extract_cities
+from utils.chunk_embedding_cache import ChunkEmbeddingCache
+from utils.embedding_client import EmbeddingClient
+from utils.reranker import get_reranker, preload_reranker, rerank
 # 日志
 from loguru import logger
 from langchain_community.tools.tavily_search import TavilySearchResults
@@ -48,6 +47,15 @@ TEMP_IMAGE_DIR = "/tmp/sparkai_images/"
 #AUDIO_TEMP_DIR = "/tmp/sparkai_audios/"
 TEMP_AUDIO_DIR = "./static"
 style_options = ["朋友圈", "小红书", "微博", "抖音"]
+# 旅游攻略知识库的离线索引，由 python -m loader.kb_index ingest 建立
+KB_PATH = './kb_index.sqlite'
+# 按内容哈希寻址的文本块向量缓存，与 ingest 共用，多个进程可以同时读写
+chunk_embedding_cache = ChunkEmbeddingCache(DEFAULT_CACHE_DIR, EMBEDDING_MODEL)
+knowledge_base = KnowledgeBase(KB_PATH, chunk_embedding_cache)
+# 星火 embedding 接口的客户端：令牌桶限流、有限并发、失败重试，计算过的向量写入缓存
+embedding_client = EmbeddingClient(EmbeddingModel(config).get_embedding, store=chunk_embedding_cache)
+# 重排模型只加载一次，所有请求共用；启动时在后台加载，第一个问题不需要等待
+preload_reranker()
 
 # 保存图片并获取临时路径
 def save_and_get_temp_url(image):
@@ -132,29 +140,9 @@ def process_audio(audio, history):
     return "无效的音频文件，请上传有效的音频。", history
 
 def extract_cities_from_text(text):
-    # 从文本中提取城市名称，假设使用jieba进行分词和提取地名
-    import jieba.posseg as pseg
-    words = pseg.cut(text)
-    cities = [word for word, flag in words if flag == "ns"]
-    return cities
-
-def find_pdfs_with_city(cities, pdf_directory):
-    matched_pdfs = {}
-    for city in cities:
-        matched_pdfs[city] = []
-        for root, _, files in os.walk(pdf_directory):
-            for file in files:
-                if file.endswith(".pdf") and city in file:
-                    matched_pdfs[city].append(os.path.join(root, file))
-    return matched_pdfs
-
-def get_embedding_pdf(text, pdf_directory):
-    # 从文本中提取城市名称，jieba
-    cities = extract_cities_from_text(text)
-    # 根据城市名称匹配PDF文件
-    city_to_pdfs = find_pdfs_with_city(cities, pdf_directory)
-    return city_to_pdfs
-    
+    # 从文本中提取城市名称，使用jieba进行分词和提取地名（与建索引时识别文件名中地名的方式相同）
+    return extract_cities(text)
+
 def generate_image(prompt):
     logger.info(f'生成图片: {prompt}')
     output_path = './demo.jpg'
@@ -162,105 +150,33 @@ def generate_image(prompt):
     return output_path
 
 
-rerank_path = '../model/rerank_model'
-rerank_model_name = 'BAAI/bge-reranker-large'
-
-def load_rerank_model(model_name=rerank_model_name):
-    """
-    加载重排名模型。
-    pickle 模块是 python 自带的包，可以将 Python 对象进行序列化（serialization） 和反序列化（deserialization）。
-    是将对象转换成一个字节流（byte stream），或将字节流转成为对象。
-
-    操作	函数	描述
-    序列化到文件	    pickle.dump(obj, file)	将对象 obj 序列化后写入文件对象 file。
-    从文件反序列化	obj = pickle.load(file)	从文件对象 file 中读取数据并反序列化为 Python 对象。
-    序列化为字节	    bytes_obj = pickle.dumps(obj)	将对象 obj 序列化为一个字节对象（bytes），而不是直接写入文件。
-    从字节反序列化	obj = pickle.loads(bytes_obj)	将字节对象 bytes_obj 反序列化为 Python 对象。
-
-    参数:
-    - model_name (str): 模型的名称。默认为 'BAAI/bge-reranker-large'。
-    
-    返回:
-    - FlagReranker 实例。
-    
-    异常:
-    - ValueError: 如果模型名称不在批准的模型列表中。
-    - Exception: 如果模型加载过程中发生任何其他错误。
-    """ 
-    if not os.path.exists(rerank_path):
-        os.makedirs(rerank_path, exist_ok=True)
-    rerank_model_path = os.path.join(rerank_path, model_name.split('/')[1] + '.pkl')
-    #print(rerank_model_path)
-    logger.info('Loading rerank model...')
-    if os.path.exists(rerank_model_path):
-        try:
-            with open(rerank_model_path , 'rb') as f:
-                reranker_model = pickle.load(f)
-                logger.info('Rerank model loaded.')
-                return reranker_model
-        except Exception as e:
-            logger.error(f'Failed to load embedding model from {rerank_model_path}') 
-    else:
-        try:
-            os.system('apt install git')
-            os.system('apt install git-lfs')
-            os.system(f'git clone https://code.openxlab.org.cn/answer-qzd/bge_rerank.git {rerank_path}')
-            os.system(f'cd {rerank_path} && git lfs pull')
-            
-            with open(rerank_model_path , 'rb') as f:
-                reranker_model = pickle.load(f)
-                logger.info('Rerank model loaded.')
-                return reranker_model
-                
-        except Exception as e:
-            logger.error(f'Failed to load rerank model: {e}')
-
-#使用重排序模型，重排序，并取指定的前几个内容
-def rerank(reranker, query, contexts, select_num):
-        merge = [[query, context] for context in contexts]
-        scores = reranker.compute_score(merge)
-        sorted_indices = np.argsort(scores)[::-1]
-        return [contexts[i] for i in sorted_indices[:select_num]]
-
 def embedding_make(text_input, pdf_directory):
-    city_to_pdfs = get_embedding_pdf(text_input, pdf_directory)
-    city_list = []
-    for city, pdfs in city_to_pdfs.items():
-        print(f"City: {city}")
-        for pdf in pdfs:
-            city_list.append(pdf)
-    
-    if len(city_list) != 0:
-        # all_pdf_pages = []
-        all_text = ''
-        for city in city_list:
-            from core.loader.pdf_read import FileOperation
-            file_opr = FileOperation()
-            try:
-                text, error = file_opr.read(city)
-            except:
-                continue
-            all_text += text
-            
-        pattern = re.compile(r'[^\u4e00-\u9fff](\n)[^\u4e00-\u9fff]', re.DOTALL)
-        all_text = re.sub(pattern, lambda match: match.group(0).replace('\n', ''), all_text)
-
-        text_spliter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=300) 
-        docs = text_spliter.create_documents([all_text])
-        splits = text_spliter.split_documents(docs)
-        question=text_input
-        
-        retriever = BM25Retriever.from_documents(splits)
-        retriever.k = 20
-        bm25_result = retriever.invoke(question)
-
-        em = EmbeddingModel(config)
-        question_vector = em.get_embedding(question)
-        pdf_vector_list = []
-        for i in range(len(bm25_result)):
-            x = em.get_embedding(bm25_result[i].page_content) 
-            pdf_vector_list.append(x)
-            time.sleep(0.65)
+    # 攻略 PDF 已经由 python -m loader.kb_index ingest 离线解析、切分并建好 BM25 倒排表和向量，这里只做检索
+    if not knowledge_base.exists():
+        return f"知识库索引不存在，请先运行 python -m loader.kb_index ingest {pdf_directory} 建立索引。"
+    cities = extract_cities_from_text(text_input)
+    doc_ids = knowledge_base.documents_for_cities(cities)
+    print(f"City: {cities}")
+
+    if len(doc_ids) != 0:
+        question = text_input
+        bm25_result = knowledge_base.bm25(question, doc_ids, k=20)
+        if not bm25_result:
+            return "知识库中没有找到与问题相关的内容，请换个问法试试！"
+
+        # 问题的向量只缓存在内存中，不写入文本块的磁盘缓存，否则缓存会随一次性的问题无限增长
+        question_vector = embedding_client.embed_one(question, persist=False)
+        # 文本块的向量在建索引时已经计算好，只有还没有计算的才需要请求接口，按接口配额并发计算并写入磁盘缓存
+        chunk_vectors = knowledge_base.embeddings([chunk["id"] for chunk in bm25_result])
+        missing = [chunk for chunk in bm25_result if chunk["id"] not in chunk_vectors]
+        if missing:
+            chunk_vectors.update(zip(
+                [chunk["id"] for chunk in missing], embedding_client.embed_many([chunk["text"] for chunk in missing])
+            ))
+        pdf_vector_list = [chunk_vectors[chunk["id"]] for chunk in bm25_result]
+        client_stats = embedding_client.stats()
+        logger.info(f"embedding 接口调用：累计请求 {client_stats['lookups']} 个向量，实际计算 {client_stats['embedded']} 个，"
+                    f"节省 {client_stats['api_calls_saved_rate']:.0%}")
 
         # 一个新的二维数组，这个新数组有 1 行，并且列数由 NumPy 自动计算得出。反过来同理，N 行 1 列
         # -1 代表“未知的维度”，意思是“这个维度的大小请根据数组的总元素数和其他已知的维度来自动推算”
@@ -273,12 +189,11 @@ def embedding_make(text_input, pdf_directory):
         top_k = 10
         top_k_indices = np.argsort(similarities[0])[-top_k:][::-1]
         for idx in top_k_indices:
-            all_page = splits[idx].page_content
+            all_page = bm25_result[idx]["text"]
             emb_list.append(all_page)
         print(len(emb_list))
 
-        reranker_model = load_rerank_model()
-        documents = rerank(reranker_model, question, emb_list, 3)
+        documents = rerank(get_reranker(), question, emb_list, 3)
         logger.info("After rerank...")
         reranked = []
         for doc in documents:
@@ -3,10 +3,13 @@ from datetime import datetime
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from tools.base_class_tool import CompleteOrEscalate
 from graph_chat.llm_tavily import llm
-from tools.car_tools import search_car_rentals, book_car_rental, update_car_rental, cancel_car_rental
-from tools.flights_tools import search_flights, update_ticket_to_new_flight, cancel_ticket
-from tools.hotels_tools import search_hotels, book_hotel, update_hotel, cancel_hotel
-from tools.trip_tools import search_trip_recommendations, book_excursion, update_excursion, cancel_excursion
+from tools.car_tools import search_car_rentals, book_car_rental, update_car_rental, cancel_car_rental, \
+    book_car_rentals, cancel_car_rentals
+from tools.flights_tools import search_flights, search_flights_page, search_flight_connections, \
+    update_ticket_to_new_flight, cancel_ticket
+from tools.hotels_tools import search_hotels, book_hotel, update_hotel, cancel_hotel, book_hotels, cancel_hotels
+from tools.trip_tools import search_trip_recommendations, book_excursion, update_excursion, cancel_excursion, \
+    book_excursions, cancel_excursions
 
 # 航班预订助手
 flight_booking_prompt = ChatPromptTemplate.from_messages(
@@ -29,7 +32,7 @@ flight_booking_prompt = ChatPromptTemplate.from_messages(
 ).partial(time=datetime.now())
 
 # 定义安全工具（只读操作）和敏感工具（涉及更改的操作）
-update_flight_safe_tools = [search_flights]
+update_flight_safe_tools = [search_flights, search_flights_page, search_flight_connections]
 update_flight_sensitive_tools = [update_ticket_to_new_flight, cancel_ticket]
 
 # 创建可运行对象，绑定航班预订提示模板和工具集，包括CompleteOrEscalate工具
@@ -64,7 +67,12 @@ book_hotel_prompt = ChatPromptTemplate.from_messages(
 
 # 定义安全工具（只读操作）和敏感工具（涉及更改的操作）
 book_hotel_safe_tools = [search_hotels]
-book_hotel_sensitive_tools = [book_hotel, update_hotel, cancel_hotel]
+book_hotel_sensitive_tools = [book_hotel, update_hotel, cancel_hotel, book_hotels, cancel_hotels]
+# 同一轮中多次调用的单个预订/取消工具，在敏感工具节点中合并为一次批量调用：单个工具名 -> (批量工具, ID参数名, ID列表参数名)
+book_hotel_batch_tools = {
+    "book_hotel": (book_hotels, "hotel_id", "hotel_ids"),
+    "cancel_hotel": (cancel_hotels, "hotel_id", "hotel_ids"),
+}
 
 # 创建可运行对象，绑定酒店预订提示模板和工具集，包括CompleteOrEscalate工具
 book_hotel_runnable = book_hotel_prompt | llm.bind_tools(
@@ -102,7 +110,13 @@ book_car_rental_sensitive_tools = [
     book_car_rental,
     update_car_rental,
     cancel_car_rental,
+    book_car_rentals,
+    cancel_car_rentals,
 ]
+book_car_rental_batch_tools = {
+    "book_car_rental": (book_car_rentals, "rental_id", "rental_ids"),
+    "cancel_car_rental": (cancel_car_rentals, "rental_id", "rental_ids"),
+}
 
 # 创建可运行对象，绑定租车预订提示模板和工具集，包括CompleteOrEscalate工具
 book_car_rental_runnable = book_car_rental_prompt | llm.bind_tools(
@@ -135,7 +149,17 @@ book_excursion_prompt = ChatPromptTemplate.from_messages(
 
 # 定义安全工具（只读操作）和敏感工具（涉及更改的操作）
 book_excursion_safe_tools = [search_trip_recommendations]
-book_excursion_sensitive_tools = [book_excursion, update_excursion, cancel_excursion]
+book_excursion_sensitive_tools = [
+    book_excursion,
+    update_excursion,
+    cancel_excursion,
+    book_excursions,
+    cancel_excursions,
+]
+book_excursion_batch_tools = {
+    "book_excursion": (book_excursions, "recommendation_id", "recommendation_ids"),
+    "cancel_excursion": (cancel_excursions, "recommendation_id", "recommendation_ids"),
+}
 
 # 创建可运行对象，绑定游览预订提示模板和工具集，包括CompleteOrEscalate工具
 book_excursion_runnable = book_excursion_prompt | llm.bind_tools(
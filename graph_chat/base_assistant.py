@@ -14,8 +14,8 @@ from tools.base_class_tool import ToFlightBookingAssistant, ToBookCarRental, ToH
     ToBookExcursion
 from graph_chat.llm_tavily import tavily_tool, llm
 from graph_chat.state import State
-from tools.flights_tools import search_flights, update_ticket_to_new_flight, \
-    cancel_ticket
+from tools.flights_tools import search_flights, search_flights_page, search_flight_connections, \
+    update_ticket_to_new_flight, cancel_ticket
 from tools.retriever_vector import lookup_policy
 
 
@@ -96,6 +96,8 @@ sensitive_tools = [
 primary_assistant_tools = [
     tavily_tool,  # 假设TavilySearchResults是一个有效的搜索工具
     search_flights,  # 搜索航班的工具
+    search_flights_page,  # 按翻页标记分页搜索航班的工具
+    search_flight_connections,  # 搜索直飞及中转联程行程的工具
     lookup_policy,  # 查找公司政策的工具
 ]
 
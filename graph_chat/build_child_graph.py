@@ -6,7 +6,7 @@ from langgraph.prebuilt import tools_condition
 from graph_chat.agent_assistant import update_flight_runnable, update_flight_sensitive_tools, update_flight_safe_tools, \
     book_car_rental_runnable, book_car_rental_safe_tools, book_car_rental_sensitive_tools, book_hotel_runnable, \
     book_hotel_safe_tools, book_hotel_sensitive_tools, book_excursion_runnable, book_excursion_safe_tools, \
-    book_excursion_sensitive_tools
+    book_excursion_sensitive_tools, book_car_rental_batch_tools, book_hotel_batch_tools, book_excursion_batch_tools
 from graph_chat.base_assistant import CtripAssistant
 from tools.base_class_tool import CompleteOrEscalate
 from tools.tools_handler import create_tool_node_with_fallback
@@ -125,7 +125,8 @@ def build_car_graph(builder: StateGraph) -> StateGraph:
     )
     builder.add_node(
         "book_car_rental_sensitive_tools",
-        create_tool_node_with_fallback(book_car_rental_sensitive_tools),  # 敏感工具节点，包含可能修改数据的操作
+        # 敏感工具节点，包含可能修改数据的操作；同一轮中的多个预订/取消调用会合并为一次批量调用
+        create_tool_node_with_fallback(book_car_rental_sensitive_tools, book_car_rental_batch_tools),
     )
 
     builder.add_edge("enter_book_car_rental", "book_car_rental")  # 连接入口节点到实际处理节点
@@ -184,7 +185,8 @@ def builder_hotel_graph(builder: StateGraph) -> StateGraph:
     )
     builder.add_node(
         "book_hotel_sensitive_tools",
-        create_tool_node_with_fallback(book_hotel_sensitive_tools),  # 敏感工具节点，包含可能修改数据的操作
+        # 敏感工具节点，包含可能修改数据的操作；同一轮中的多个预订/取消调用会合并为一次批量调用
+        create_tool_node_with_fallback(book_hotel_sensitive_tools, book_hotel_batch_tools),
     )
 
     def route_book_hotel(state: dict):
@@ -236,7 +238,8 @@ def builder_excursion_graph(builder: StateGraph) -> StateGraph:
     )
     builder.add_node(
         "book_excursion_sensitive_tools",
-        create_tool_node_with_fallback(book_excursion_sensitive_tools),  # 敏感工具节点，包含可能修改数据的操作
+        # 敏感工具节点，包含可能修改数据的操作；同一轮中的多个预订/取消调用会合并为一次批量调用
+        create_tool_node_with_fallback(book_excursion_sensitive_tools, book_excursion_batch_tools),
     )
 
     def route_book_excursion(state: dict):
@@ -0,0 +1,356 @@
+"""
+旅游攻略知识库的离线索引。
+
+原来每次提问都要分词找城市、遍历 dataset 目录、重新解析匹配到的 PDF、重新切分文本、从头建立 BM25 检索器，
+每个问题要花几秒甚至更久。现在由 ingest 命令一次性把 dataset 目录中的 PDF 解析、切分并写入一个 SQLite 文件：
+- documents：每个 PDF 的路径、文件名和内容哈希，文件没有变化时再次 ingest 直接跳过；
+- cities：从文件名中用 jieba 识别出的地名标签，提问时按城市筛选文档；
+- chunks：切分后的文本块、长度（词数）以及内容哈希（text_hash），表中不保存向量；
+- postings：BM25 的倒排表（词 -> 文本块 -> 词频）。
+文本块的向量按 text_hash 保存在 ChunkEmbeddingCache 中（默认 ./embedding_cache），不同 PDF 中相同的文本块只计算一次，
+修改过的 PDF 重新 ingest 时没有变化的文本块也不需要重新计算。
+提问时只需要几次按索引的查询，BM25 在 SQL 取出的倒排表上打分，向量从内存映射的缓存中读出。
+
+用法（在 core 目录下运行，dataset 和索引文件的默认位置与 traval_llm_gradio.py 一致）:
+    PYTHONPATH=.. python -m loader.kb_index ingest [dataset 目录] [索引文件]
+"""
+import hashlib
+import heapq
+import math
+import os
+import re
+import sqlite3
+import sys
+from collections import Counter
+
+import jieba
+import jieba.posseg as pseg
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from loguru import logger
+
+from loader.pdf_read import FileOperation
+from utils.chunk_embedding_cache import ChunkEmbeddingCache
+from utils.db_pool import get_pool
+from utils.embedding_client import EmbeddingClient
+from utils.query_builder import fetch_dicts
+
+DEFAULT_DATASET = './dataset'
+DEFAULT_KB_PATH = './kb_index.sqlite'
+DEFAULT_CACHE_DIR = './embedding_cache'
+# 文本块向量缓存按模型分目录保存，星火 embedding 接口没有模型名参数，这里用固定的名字
+EMBEDDING_MODEL = 'spark-embedding'
+# 与原来每次提问时使用的切分参数相同
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 300
+# BM25 的参数，与 langchain BM25Retriever 使用的 rank_bm25.BM25Okapi 默认值相同
+BM25_K1 = 1.5
+BM25_B = 0.75
+# ingest 时每批计算向量的文本块数，每批计算完提交一次
+EMBED_BATCH_SIZE = 32
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS documents ("
+    "id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, name TEXT NOT NULL, sha256 TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS cities (city TEXT NOT NULL, doc_id INTEGER NOT NULL, PRIMARY KEY (city, doc_id)) "
+    "WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS chunks ("
+    "id INTEGER PRIMARY KEY, doc_id INTEGER NOT NULL, ordinal INTEGER NOT NULL, text TEXT NOT NULL, "
+    "text_hash TEXT NOT NULL, length INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (doc_id)",
+    "CREATE INDEX IF NOT EXISTS idx_chunks_text_hash ON chunks (text_hash)",
+    "CREATE TABLE IF NOT EXISTS postings ("
+    "term TEXT NOT NULL, chunk_id INTEGER NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id)",
+]
+
+# PDF 中被换行打断的非中文内容（英文单词、数字等）重新连起来，与原来的处理相同
+_BROKEN_LINE = re.compile(r'[^\u4e00-\u9fff](\n)[^\u4e00-\u9fff]', re.DOTALL)
+# 只由空白和标点组成的词不参与 BM25
+_NOT_A_TERM = re.compile(r'^[\W_]+$')
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    BM25 使用的分词：jieba 搜索引擎模式（长词再切出其中的短词），转小写，去掉空白和标点。建索引和提问使用同一个函数。
+
+    参数:
+        text (str): 文本。
+
+    返回:
+        list[str]: 词列表（保留重复）。
+    """
+    return [word for word in (w.strip().lower() for w in jieba.cut_for_search(text))
+            if word and not _NOT_A_TERM.match(word)]
+
+
+def extract_cities(text: str) -> list[str]:
+    """用 jieba 词性标注找出文本中的地名（词性 ns），去重并保持出现的顺序。"""
+    return list(dict.fromkeys(word for word, flag in pseg.cut(text) if flag == "ns"))
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def connect(kb_path: str = DEFAULT_KB_PATH) -> sqlite3.Connection:
+    """打开（必要时创建）索引文件，并建好所有表。"""
+    conn = sqlite3.connect(kb_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def _index_document(conn: sqlite3.Connection, path: str, sha256: str, text: str, splitter) -> int:
+    """在一个事务中写入（或替换）一个文档的文本块、倒排表和城市标签，返回新写入的文本块数。"""
+    name = os.path.basename(path)
+    text = re.sub(_BROKEN_LINE, lambda match: match.group(0).replace('\n', ''), text)
+    chunks = splitter.split_text(text)
+    with conn:
+        row = conn.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            doc_id = conn.execute(
+                "INSERT INTO documents (path, name, sha256) VALUES (?, ?, ?)", (path, name, sha256)
+            ).lastrowid
+            old_chunks = []
+        else:
+            doc_id = row[0]
+            conn.execute("UPDATE documents SET sha256 = ? WHERE id = ?", (sha256, doc_id))
+            old_chunks = [chunk_id for chunk_id, in conn.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))]
+        conn.execute("DELETE FROM cities WHERE doc_id = ?", (doc_id,))
+        conn.executemany(
+            "INSERT INTO cities (city, doc_id) VALUES (?, ?)",
+            [(city, doc_id) for city in extract_cities(os.path.splitext(name)[0])],
+        )
+        for ordinal, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk))
+            chunk_id = conn.execute(
+                "INSERT INTO chunks (doc_id, ordinal, text, text_hash, length) VALUES (?, ?, ?, ?, ?)",
+                (doc_id, ordinal, chunk, hashlib.sha256(chunk.encode('utf-8')).hexdigest(), sum(terms.values())),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                [(term, chunk_id, tf) for term, tf in terms.items()],
+            )
+        _drop_chunks(conn, old_chunks)
+    return len(chunks)
+
+
+def _drop_chunks(conn: sqlite3.Connection, chunk_ids: list[int]):
+    """删除文本块及其倒排表。向量保存在按内容寻址的缓存中，不随文本块删除，内容相同的新文本块可以直接使用。"""
+    conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+    conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+
+
+def embed_chunks(conn: sqlite3.Connection, client: EmbeddingClient, batch_size: int = EMBED_BATCH_SIZE) -> int:
+    """
+    确保每个（按内容去重后的）文本块在向量缓存中都有向量。已经缓存的直接跳过，其余每批由 EmbeddingClient 按接口配额并发计算
+    并写入缓存，中途中断后再次运行只会计算剩下的文本块。
+
+    参数:
+        conn (sqlite3.Connection): 索引文件的连接。
+        client (EmbeddingClient): 带有向量缓存（store）的嵌入客户端。
+        batch_size (int): 每批的文本块数。
+
+    返回:
+        int: 调用接口计算的向量数。
+    """
+    unique = conn.execute("SELECT text_hash, MIN(text) FROM chunks GROUP BY text_hash ORDER BY MIN(id)").fetchall()
+    embedded = client.stats()["embedded"]
+    for start in range(0, len(unique), batch_size):
+        client.embed_many([text for _, text in unique[start:start + batch_size]])
+        logger.info(f'已处理 {min(start + batch_size, len(unique))}/{len(unique)} 个文本块的向量')
+    return client.stats()["embedded"] - embedded
+
+
+def ingest(dataset: str = DEFAULT_DATASET, kb_path: str = DEFAULT_KB_PATH, embed=None,
+           cache_dir: str = DEFAULT_CACHE_DIR) -> dict:
+    """
+    把 dataset 目录（包括子目录）中的 PDF 解析、切分并写入索引。内容哈希没有变化的文件跳过，目录中已经不存在的文件从索引中删除。
+
+    参数:
+        dataset (str): 攻略 PDF 所在的目录。
+        kb_path (str): 索引文件路径。
+        embed: 函数，接收一段文本，返回向量，由 EmbeddingClient 限流并发调用；为 None 时只建 BM25 索引，不计算向量。
+        cache_dir (str): 文本块向量缓存的目录。
+
+    返回:
+        dict: 新增或更新的文件数、跳过的文件数、删除的文件数、读取失败的文件数、写入的文本块数、
+        调用接口计算的向量数，以及去重和缓存节省的接口调用次数。
+    """
+    conn = connect(kb_path)
+    file_opr = FileOperation()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    indexed = dict(conn.execute("SELECT path, sha256 FROM documents"))
+    stats = {"indexed": 0, "skipped": 0, "removed": 0, "failed": 0, "chunks": 0, "embedded": 0, "api_calls_saved": 0}
+    seen = set()
+    for root, _, files in os.walk(dataset):
+        for file in sorted(files):
+            if not file.endswith('.pdf'):
+                continue
+            path = os.path.join(root, file)
+            seen.add(path)
+            sha256 = _sha256(path)
+            if indexed.get(path) == sha256:
+                stats["skipped"] += 1
+                continue
+            text, error = file_opr.read(path)
+            if error is not None:
+                stats["failed"] += 1
+                continue
+            stats["chunks"] += _index_document(conn, path, sha256, text, splitter)
+            stats["indexed"] += 1
+            logger.info(f'已索引 {path}')
+    for path in set(indexed) - seen:
+        with conn:
+            doc_id, = conn.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+            _drop_chunks(conn, [chunk_id for chunk_id, in conn.execute(
+                "SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))])
+            conn.execute("DELETE FROM cities WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        stats["removed"] += 1
+    if embed is not None:
+        client = EmbeddingClient(embed, store=ChunkEmbeddingCache(cache_dir, EMBEDDING_MODEL))
+        stats["embedded"] = embed_chunks(conn, client)
+        # 与每个文本块都请求一次接口相比节省的调用次数：不同 PDF 中重复的文本块，以及之前已经计算过的文本块
+        stats["api_calls_saved"] = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] - stats["embedded"]
+    conn.execute("ANALYZE")
+    conn.close()
+    return stats
+
+
+class KnowledgeBase:
+    """
+    提问时使用的只读接口，通过连接池读取 ingest 建好的索引，可以在多个线程中同时使用。
+    """
+
+    def __init__(self, kb_path: str = DEFAULT_KB_PATH, cache: ChunkEmbeddingCache = None):
+        """
+        参数:
+            kb_path (str): 索引文件路径。
+            cache (ChunkEmbeddingCache): 文本块向量缓存，为 None 时使用默认目录。
+        """
+        self.kb_path = kb_path
+        self.cache = cache or ChunkEmbeddingCache(DEFAULT_CACHE_DIR, EMBEDDING_MODEL)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.kb_path)
+
+    def documents_for_cities(self, cities: list[str]) -> list[int]:
+        """
+        找出与这些城市有关的文档：文件名中包含城市名（与原来遍历目录时的匹配规则相同），或者问题中识别出的地名包含文件名的地名标签
+        （例如问题中的"北京故宫"匹配标签为"北京"的文档）。
+
+        参数:
+            cities (list[str]): 城市名列表。
+
+        返回:
+            list[int]: 文档ID列表。
+        """
+        if not cities:
+            return []
+        with get_pool(self.kb_path).reader() as conn:
+            doc_ids = set()
+            for city in cities:
+                doc_ids.update(row["id"] for row in fetch_dicts(
+                    conn,
+                    "SELECT id FROM documents WHERE instr(name, ?) > 0 UNION SELECT doc_id FROM cities WHERE instr(?, city) > 0",
+                    (city, city),
+                ))
+        return sorted(doc_ids)
+
+    def bm25(self, question: str, doc_ids: list[int], k: int = 20) -> list[dict]:
+        """
+        在指定文档的文本块中按 BM25 检索。与原来只用匹配到的 PDF 建立 BM25Retriever 一样，文档数、平均长度和文档频率
+        都只在这些文档的范围内统计；IDF 使用 log(1 + (N - df + 0.5) / (df + 0.5))，不会出现负值。
+
+        参数:
+            question (str): 问题。
+            doc_ids (list[int]): 文档ID列表。
+            k (int): 返回的文本块数。
+
+        返回:
+            list[dict]: 得分最高的 k 个文本块（id、text、score），按得分降序。
+        """
+        terms = tokenize(question)
+        if not terms or not doc_ids:
+            return []
+        docs = ", ".join("?" for _ in doc_ids)
+        unique_terms = list(dict.fromkeys(terms))
+        with get_pool(self.kb_path).reader() as conn:
+            scope = fetch_dicts(
+                conn, f"SELECT COUNT(*) AS n, AVG(length) AS avgdl FROM chunks WHERE doc_id IN ({docs})", doc_ids
+            )[0]
+            postings = fetch_dicts(
+                conn,
+                f"SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+                f"WHERE p.term IN ({', '.join('?' for _ in unique_terms)}) AND c.doc_id IN ({docs})",
+                [*unique_terms, *doc_ids],
+            )
+        if not postings:
+            return []
+        n, avgdl = scope["n"], scope["avgdl"] or 1.0
+        df = Counter(row["term"] for row in postings)
+        query_tf = Counter(terms)
+        scores = Counter()
+        for row in postings:
+            idf = math.log(1 + (n - df[row["term"]] + 0.5) / (df[row["term"]] + 0.5))
+            tf = row["tf"]
+            norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * row["length"] / avgdl))
+            scores[row["chunk_id"]] += query_tf[row["term"]] * idf * norm
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        with get_pool(self.kb_path).reader() as conn:
+            texts = {row["id"]: row["text"] for row in fetch_dicts(
+                conn, f"SELECT id, text FROM chunks WHERE id IN ({', '.join('?' for _ in top)})",
+                [chunk_id for chunk_id, _ in top],
+            )}
+        return [{"id": chunk_id, "text": texts[chunk_id], "score": score} for chunk_id, score in top]
+
+    def embeddings(self, chunk_ids: list[int]) -> dict:
+        """
+        从向量缓存中读取文本块的向量。
+
+        参数:
+            chunk_ids (list[int]): 文本块ID列表。
+
+        返回:
+            dict: 文本块ID -> 向量（np.ndarray），还没有计算向量的文本块不在其中。
+        """
+        if not chunk_ids:
+            return {}
+        with get_pool(self.kb_path).reader() as conn:
+            hashes = {row["id"]: row["text_hash"] for row in fetch_dicts(
+                conn, f"SELECT id, text_hash FROM chunks WHERE id IN ({', '.join('?' for _ in chunk_ids)})",
+                list(chunk_ids),
+            )}
+        vectors = self.cache.get_many(list(hashes.values()))
+        return {chunk_id: vectors[key] for chunk_id, key in hashes.items() if key in vectors}
+
+
+def _spark_embedder():
+    """用与 traval_llm_gradio.py 相同的环境变量创建星火 embedding 模型。"""
+    from dwspark.config import Config
+    from dwspark.models import EmbeddingModel
+
+    config = Config(os.environ.get("SPARKAI_APP_ID"), os.environ.get("SPARKAI_API_KEY"),
+                    os.environ.get("SPARKAI_API_SECRET"))
+    return EmbeddingModel(config).get_embedding
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != "ingest":
+        print(__doc__)
+        sys.exit(1)
+    result = ingest(
+        sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DATASET,
+        sys.argv[3] if len(sys.argv) > 3 else DEFAULT_KB_PATH,
+        embed=_spark_embedder(),
+    )
+    print(f"新增或更新 {result['indexed']} 个文件（{result['chunks']} 个文本块），跳过 {result['skipped']} 个未变化的文件，"
+          f"删除 {result['removed']} 个，读取失败 {result['failed']} 个，计算了 {result['embedded']} 个向量，"
+          f"去重和缓存节省了 {result['api_calls_saved']} 次接口调用")
@@ -0,0 +1,49 @@
+from utils.tool_output import encode_rows
+
+LEG_FIELDS = ["flight_id", "flight_no", "departure_airport", "arrival_airport", "scheduled_departure", "scheduled_arrival"]
+
+
+def _leg(flight_id, flight_no, departure, arrival, scheduled_departure, scheduled_arrival):
+    return dict(zip(LEG_FIELDS, [flight_id, flight_no, departure, arrival, scheduled_departure, scheduled_arrival]))
+
+
+def _parse(text: str) -> tuple[list[str], list[list[str]]]:
+    """把 encode_rows 的输出拆成表头和各行的单元格（跳过第一行的条数说明）。"""
+    _, header, *lines = text.split("\n")
+    return header.split("|"), [line.split("|") for line in lines]
+
+
+def test_multi_leg_row_fields_match_header():
+    rows = [{
+        "stops": 1,
+        "duration_minutes": 185,
+        "legs": [
+            _leg(1, "LX0112", "CDG", "BSL", "2024-05-01 10:00:00.000000+02:00", "2024-05-01 11:05:00.000000+02:00"),
+            _leg(7, "LX0420", "BSL", "ZRH", "2024-05-01 12:00:00.000000+02:00", "2024-05-01 13:05:00.000000+02:00"),
+        ],
+    }]
+    text = encode_rows(rows)
+    header, cells = _parse(text)
+
+    assert "时间均为 UTC+02:00" in text
+    assert header == ["stops", "duration_minutes", f"legs[{','.join(LEG_FIELDS)}]"]
+    legs = [leg.split(",") for leg in cells[0][2].split("; ")]
+    assert legs == [
+        ["1", "LX0112", "CDG", "BSL", "2024-05-01 10:00:00", "2024-05-01 11:05:00"],
+        ["7", "LX0420", "BSL", "ZRH", "2024-05-01 12:00:00", "2024-05-01 13:05:00"],
+    ]
+
+
+def test_nested_separators_in_values_are_escaped():
+    rows = [{"legs": [{"name": "Hilton, Basel; Old Town", "flight_no": "LX0112"}]}]
+    _, cells = _parse(encode_rows(rows))
+
+    assert cells[0][0].split(",") == ["Hilton/ Basel/ Old Town", "LX0112"]
+
+
+def test_columns_from_all_rows():
+    rows = [{"id": 1}, {"id": 2, "legs": [_leg(1, "LX0112", "CDG", "BSL", "2024-05-01 10:00:00", "2024-05-01 11:05:00")]}]
+    header, cells = _parse(encode_rows(rows))
+
+    assert header == ["id", f"legs[{','.join(LEG_FIELDS)}]"]
+    assert cells[0] == ["1", ""]
@@ -1,21 +1,33 @@
-from sqlite3 import connect, Cursor
 from datetime import date, datetime
 from typing import Optional, Union
 
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
 from tools.location_trans import transform_location
+from tools.tools_handler import async_implementation, compact_tool
+from utils.async_db_pool import get_async_pool
+from utils.db_pool import get_pool, resolve_db_path
+from utils.batch_booking import batch_update_by_id, abatch_update_by_id
+from utils.fts import build_search_query, compose_search_query
+from utils.hot_replica import search_reader, hot_replica_covers, apply_hot_delta, aapply_hot_delta
+from utils.optimistic import (
+    CONFLICT, NOT_FOUND, REJECTED, UPDATED, optimistic_update, aoptimistic_update, set_booked, set_values,
+)
+from utils.query_builder import afetch_dicts, fetch_dicts
 
 db = "../travel_new.sqlite"  # 这是数据库文件名
 
 
-@tool
+@compact_tool(drop_columns=("booked", "version"))
 def search_car_rentals(
         location: Optional[str] = None,
-        name: Optional[str] = None
+        name: Optional[str] = None,
         # price_tier: Optional[str] = None,
         # start_date: Optional[Union[datetime, date]] = None,
         # end_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
 ) -> list[dict]:
     """
     根据位置、名称、价格层级、开始日期和结束日期搜索汽车租赁信息。
@@ -26,32 +38,38 @@ def search_car_rentals(
     返回:
     - list[dict]: 包含匹配搜索条件的汽车租赁信息的字典列表。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
     location = transform_location(location)
-    query = "SELECT * FROM car_rentals WHERE 1=1"
-    params = []
-
-    if location:
-        query += " AND location LIKE ?"
-        params.append(f"%{location}%")
-    if name:
-        query += " AND name LIKE ?"
-        params.append(f"%{name}%")
     # 由于我们的示例数据集没有太多数据，在这里我们不对日期和价格层级进行严格匹配
+    with search_reader(resolve_db_path(config, db), "car_rentals") as conn:
+        # 有 FTS5 全文索引时按相关度排序检索，否则退回到 LIKE 查询
+        query, params = build_search_query(conn, "car_rentals", {"location": location, "name": name})
+        results = fetch_dicts(conn, query, params)
 
-    cursor.execute(query, params)
-    results = cursor.fetchall()
+    return results
 
-    conn.close()
 
-    return [
-        dict(zip([column[0] for column in cursor.description], row)) for row in results
-    ]
+@async_implementation(search_car_rentals)
+async def asearch_car_rentals(
+        location: Optional[str] = None,
+        name: Optional[str] = None,
+        *,
+        config: RunnableConfig,
+) -> list[dict]:
+    """search_car_rentals 的异步实现，在 graph.astream / ainvoke 中使用。"""
+    if hot_replica_covers(resolve_db_path(config, db), "car_rentals"):
+        # 表在内存热副本中，查询只需要几十微秒，直接在事件循环中执行同步实现
+        return search_car_rentals.func(location, name, config=config)
+    location = transform_location(location)
+    pool = get_async_pool(resolve_db_path(config, db))
+    query, params = compose_search_query(
+        "car_rentals", {"location": location, "name": name}, use_fts="car_rentals" in await pool.fts_tables()
+    )
+    async with pool.reader() as conn:
+        return await afetch_dicts(conn, query, params)
 
 
 @tool
-def book_car_rental(rental_id: int) -> str:
+def book_car_rental(rental_id: int, *, config: RunnableConfig) -> str:
     """
     通过ID预订汽车租赁服务。
 
@@ -61,18 +79,15 @@ def book_car_rental(rental_id: int) -> str:
     返回:
     - str: 表明汽车租赁是否成功预订的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    status = optimistic_update(resolve_db_path(config, db), "car_rentals", rental_id, set_booked(1))
+    return _message("book", rental_id, status)
 
-    cursor.execute("UPDATE car_rentals SET booked = 1 WHERE id = ?", (rental_id,))
-    conn.commit()
 
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"汽车租赁 {rental_id} 成功预订。"
-    else:
-        conn.close()
-        return f"未找到ID为 {rental_id} 的汽车租赁服务。"
+@async_implementation(book_car_rental)
+async def abook_car_rental(rental_id: int, *, config: RunnableConfig) -> str:
+    """book_car_rental 的异步实现。"""
+    status = await aoptimistic_update(resolve_db_path(config, db), "car_rentals", rental_id, set_booked(1))
+    return _message("book", rental_id, status)
 
 
 @tool
@@ -80,6 +95,8 @@ def update_car_rental(
         rental_id: int,
         start_date: Optional[Union[datetime, date]] = None,
         end_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
 ) -> str:
     """
     根据ID更新汽车租赁的开始和结束日期。
@@ -92,31 +109,27 @@ def update_car_rental(
     返回:
         str: 表明汽车租赁是否成功更新的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    change = set_values(start_date=start_date, end_date=end_date)
+    status = optimistic_update(resolve_db_path(config, db), "car_rentals", rental_id, change)
+    return _message("update", rental_id, status)
 
-    if start_date:
-        cursor.execute(
-            "UPDATE car_rentals SET start_date = ? WHERE id = ?",
-            (start_date, rental_id),
-        )
-    if end_date:
-        cursor.execute(
-            "UPDATE car_rentals SET end_date = ? WHERE id = ?", (end_date, rental_id)
-        )
 
-    conn.commit()
-
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"汽车租赁 {rental_id} 成功更新。"
-    else:
-        conn.close()
-        return f"未找到ID为 {rental_id} 的汽车租赁服务。"
+@async_implementation(update_car_rental)
+async def aupdate_car_rental(
+        rental_id: int,
+        start_date: Optional[Union[datetime, date]] = None,
+        end_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
+) -> str:
+    """update_car_rental 的异步实现。"""
+    change = set_values(start_date=start_date, end_date=end_date)
+    status = await aoptimistic_update(resolve_db_path(config, db), "car_rentals", rental_id, change)
+    return _message("update", rental_id, status)
 
 
 @tool
-def cancel_car_rental(rental_id: int) -> str:
+def cancel_car_rental(rental_id: int, *, config: RunnableConfig) -> str:
     """
     根据ID取消汽车租赁服务。
 
@@ -126,16 +139,116 @@ def cancel_car_rental(rental_id: int) -> str:
     返回:
         str: 表明汽车租赁是否成功取消的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
-
-    # 将booked字段设置为0来表示取消预订
-    cursor.execute("UPDATE car_rentals SET booked = 0 WHERE id = ?", (rental_id,))
-    conn.commit()
-
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"汽车租赁 {rental_id} 成功取消。"
-    else:
-        conn.close()
-        return f"未找到ID为 {rental_id} 的汽车租赁服务。"
+    status = optimistic_update(resolve_db_path(config, db), "car_rentals", rental_id, set_booked(0))
+    return _message("cancel", rental_id, status)
+
+
+@async_implementation(cancel_car_rental)
+async def acancel_car_rental(rental_id: int, *, config: RunnableConfig) -> str:
+    """cancel_car_rental 的异步实现。"""
+    status = await aoptimistic_update(resolve_db_path(config, db), "car_rentals", rental_id, set_booked(0))
+    return _message("cancel", rental_id, status)
+
+
+@tool
+def book_car_rentals(
+        rental_ids: list[int],
+        start_date: Optional[Union[datetime, date]] = None,
+        end_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
+) -> list[str]:
+    """
+    一次预订多个汽车租赁服务，所有租赁使用相同的开始和结束日期，在同一个事务中完成。
+
+    参数:
+    - rental_ids (list[int]): 要预订的汽车租赁服务的ID列表。
+    - start_date (Optional[Union[datetime, date]]): 租赁开始日期，不传则保持原值。默认为None。
+    - end_date (Optional[Union[datetime, date]]): 租赁结束日期，不传则保持原值。默认为None。
+
+    返回:
+    - list[str]: 与 rental_ids 一一对应的结果消息。
+    """
+    db_path = resolve_db_path(config, db)
+    with get_pool(db_path).writer() as conn:
+        results = batch_update_by_id(
+            conn, "car_rentals", rental_ids, set_booked(1, start_date=start_date, end_date=end_date)
+        )
+        apply_hot_delta(conn, db_path, "car_rentals", rental_ids)
+
+    return [_message("book", rental_id, results[rental_id]) for rental_id in rental_ids]
+
+
+@async_implementation(book_car_rentals)
+async def abook_car_rentals(
+        rental_ids: list[int],
+        start_date: Optional[Union[datetime, date]] = None,
+        end_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
+) -> list[str]:
+    """book_car_rentals 的异步实现。"""
+    db_path = resolve_db_path(config, db)
+    async with get_async_pool(db_path).writer() as conn:
+        results = await abatch_update_by_id(
+            conn, "car_rentals", rental_ids, set_booked(1, start_date=start_date, end_date=end_date)
+        )
+        await aapply_hot_delta(conn, db_path, "car_rentals", rental_ids)
+
+    return [_message("book", rental_id, results[rental_id]) for rental_id in rental_ids]
+
+
+@tool
+def cancel_car_rentals(rental_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """
+    一次取消多个汽车租赁服务，在同一个事务中完成。
+
+    参数:
+        rental_ids (list[int]): 要取消的汽车租赁服务的ID列表。
+
+    返回:
+        list[str]: 与 rental_ids 一一对应的结果消息。
+    """
+    db_path = resolve_db_path(config, db)
+    with get_pool(db_path).writer() as conn:
+        results = batch_update_by_id(conn, "car_rentals", rental_ids, set_booked(0))
+        apply_hot_delta(conn, db_path, "car_rentals", rental_ids)
+
+    return [_message("cancel", rental_id, results[rental_id]) for rental_id in rental_ids]
+
+
+@async_implementation(cancel_car_rentals)
+async def acancel_car_rentals(rental_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """cancel_car_rentals 的异步实现。"""
+    db_path = resolve_db_path(config, db)
+    async with get_async_pool(db_path).writer() as conn:
+        results = await abatch_update_by_id(conn, "car_rentals", rental_ids, set_booked(0))
+        await aapply_hot_delta(conn, db_path, "car_rentals", rental_ids)
+
+    return [_message("cancel", rental_id, results[rental_id]) for rental_id in rental_ids]
+
+
+# 预订、更新、取消的结果消息，按 optimistic_update / batch_update_by_id 返回的结果选择
+_MESSAGES = {
+    "book": {
+        UPDATED: "汽车租赁 {id} 成功预订。",
+        REJECTED: "汽车租赁 {id} 已经被预订，不能重复预订。",
+        NOT_FOUND: "未找到ID为 {id} 的汽车租赁服务。",
+    },
+    "update": {
+        UPDATED: "汽车租赁 {id} 成功更新。",
+        REJECTED: "没有提供新的开始或结束日期，汽车租赁 {id} 未作修改。",
+        NOT_FOUND: "未找到ID为 {id} 的汽车租赁服务。",
+    },
+    "cancel": {
+        UPDATED: "汽车租赁 {id} 成功取消。",
+        REJECTED: "汽车租赁 {id} 当前没有预订，无需取消。",
+        NOT_FOUND: "未找到ID为 {id} 的汽车租赁服务。",
+    },
+}
+
+
+def _message(action: str, rental_id: int, status: str) -> str:
+    if status == CONFLICT:
+        return f"汽车租赁 {rental_id} 正在被其他会话修改，请稍后重试。"
+    return _MESSAGES[action][status].format(id=rental_id)
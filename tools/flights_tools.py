@@ -1,13 +1,90 @@
-from sqlite3 import connect, Cursor
+import base64
+import hashlib
+import json
 from datetime import date, datetime
-from typing import Optional, List, Dict
-import pytz
+from itertools import islice
+from typing import Optional, List, Dict, Iterator
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from graph_chat.state import UserInfo
+from tools.tools_handler import async_implementation, compact_tool
+from utils.async_db_pool import get_async_pool
+from utils.db_pool import get_pool, resolve_db_path
+from utils.flight_columns import get_flight_columns
+from utils.flight_graph import get_flight_graph, DEFAULT_MIN_CONNECTION
+from utils.hot_replica import search_reader, hot_replica_covers
+from utils.query_builder import Select, afetch_dicts, fetch_dicts, iter_dicts
+from utils.ttl_cache import TTLCache
 
 db = "../travel_new.sqlite"  # 数据库文件名
 
+# SQL查询语句，连接多个表以获取乘客的机票、航班和座位信息
+_USER_FLIGHTS_QUERY = """
+SELECT 
+    t.ticket_no, t.book_ref,
+    f.flight_id, f.flight_no, f.departure_airport, f.arrival_airport, f.scheduled_departure, f.scheduled_arrival,
+    bp.seat_no, tf.fare_conditions
+FROM 
+    tickets t
+    JOIN ticket_flights tf ON t.ticket_no = tf.ticket_no
+    JOIN flights f ON tf.flight_id = f.flight_id
+    JOIN boarding_passes bp ON bp.ticket_no = t.ticket_no AND bp.flight_id = f.flight_id
+WHERE 
+    t.passenger_id = ?
+"""
+
+# 改签：所有校验都写在 WHERE 中，成功时一次往返就完成了校验和更新。
+# scheduled_departure 带有时区偏移，julianday 会换算成 UTC，和 julianday('now') 直接相减即可
+_UPDATE_TICKET_SQL = """
+UPDATE ticket_flights SET flight_id = :new_flight_id
+WHERE ticket_no = :ticket_no
+  AND EXISTS (SELECT 1 FROM tickets WHERE ticket_no = :ticket_no AND passenger_id = :passenger_id)
+  AND EXISTS (
+      SELECT 1 FROM flights
+      WHERE flight_id = :new_flight_id
+        AND julianday(scheduled_departure) - julianday('now') >= 3 / 24.0
+  )
+RETURNING flight_id
+"""
+
+# 改签没有更新任何行时，在同一个事务里查出失败的原因
+_UPDATE_TICKET_FAILURE_SQL = """
+SELECT
+    (SELECT scheduled_departure FROM flights WHERE flight_id = :new_flight_id),
+    (SELECT julianday(scheduled_departure) - julianday('now') < 3 / 24.0
+     FROM flights WHERE flight_id = :new_flight_id),
+    EXISTS (SELECT 1 FROM ticket_flights WHERE ticket_no = :ticket_no)
+"""
+
+_CANCEL_TICKET_SQL = """
+DELETE FROM ticket_flights
+WHERE ticket_no = :ticket_no
+  AND EXISTS (SELECT 1 FROM tickets WHERE ticket_no = :ticket_no AND passenger_id = :passenger_id)
+RETURNING flight_id
+"""
+
+_TICKET_EXISTS_SQL = "SELECT EXISTS (SELECT 1 FROM ticket_flights WHERE ticket_no = :ticket_no)"
+
+# 每轮对话开始时都要读取一次乘客的机票信息，按 (数据库路径, 乘客ID) 缓存查询结果，
+# 改签和退票成功后删除对应的条目；TTL 兜底其他途径（例如 update_dates 重置数据库）对数据的修改
+user_info_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+def user_info_cache_key(config: RunnableConfig) -> tuple:
+    """
+    返回当前会话的乘客机票信息在 user_info_cache 中的键。
+
+    参数:
+        config (RunnableConfig): 配置信息，包含乘客ID和可选的数据库路径。
+
+    返回:
+        tuple: (数据库路径, 乘客ID)，不同的数据库快照之间互不影响。
+    """
+    passenger_id = config.get("configurable", {}).get("passenger_id", None)
+    if not passenger_id:
+        raise ValueError("未配置乘客 ID。")
+    return resolve_db_path(config, db), passenger_id
+
 
 # 当工具函数（被 @tool 装饰的函数）签名中包含一个类型为 RunnableConfig 的参数时，LangChain 会在调用时自动将当前的配置对象注入到这个参数中。
 # 且 LangChain 会将函数被包装成一个 Runnable 对象，可以无缝集成到 LCEL 链、Agent、LangGraph 工作流中
@@ -21,34 +98,15 @@ def fetch_user_flight_information(config: RunnableConfig) -> List[Dict]:
     返回:
         包含每张机票的详情、关联航班的信息及座位分配的字典列表。
     """
-    passenger_id = config.get("configurable", {}).get("passenger_id", None)
-    if not passenger_id:
-        raise ValueError("未配置乘客 ID。")
+    key = user_info_cache_key(config)
+    results = user_info_cache.get(key)
+    if results is not None:
+        return results
 
-    conn = connect(db)
-    cursor = conn.cursor()
-
-    # SQL查询语句，连接多个表以获取所需信息
-    query = """
-    SELECT 
-        t.ticket_no, t.book_ref,
-        f.flight_id, f.flight_no, f.departure_airport, f.arrival_airport, f.scheduled_departure, f.scheduled_arrival,
-        bp.seat_no, tf.fare_conditions
-    FROM 
-        tickets t
-        JOIN ticket_flights tf ON t.ticket_no = tf.ticket_no
-        JOIN flights f ON tf.flight_id = f.flight_id
-        JOIN boarding_passes bp ON bp.ticket_no = t.ticket_no AND bp.flight_id = f.flight_id
-    WHERE 
-        t.passenger_id = ?
-    """
-    cursor.execute(query, (passenger_id,))
-    rows = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    results = [dict(zip(column_names, row)) for row in rows]
-
-    cursor.close()
-    conn.close()
+    db_path, passenger_id = key
+    with get_pool(db_path).reader() as conn:
+        results = fetch_dicts(conn, _USER_FLIGHTS_QUERY, (passenger_id,))
+    user_info_cache.set(key, results)
 
     # return UserInfo(
     #     passenger_id=config["configurable"]["passenger_id"],
@@ -60,13 +118,30 @@ def fetch_user_flight_information(config: RunnableConfig) -> List[Dict]:
     return results
 
 
-@tool
+@async_implementation(fetch_user_flight_information)
+async def afetch_user_flight_information(config: RunnableConfig) -> List[Dict]:
+    """fetch_user_flight_information 的异步实现，在 graph.astream / ainvoke 中使用。"""
+    key = user_info_cache_key(config)
+    results = user_info_cache.get(key)
+    if results is not None:
+        return results
+
+    db_path, passenger_id = key
+    async with get_async_pool(db_path).reader() as conn:
+        results = await afetch_dicts(conn, _USER_FLIGHTS_QUERY, (passenger_id,))
+    user_info_cache.set(key, results)
+    return results
+
+
+@compact_tool(drop_columns=("actual_departure", "actual_arrival"))
 def search_flights(
         departure_airport: Optional[str] = None,
         arrival_airport: Optional[str] = None,
         start_time: Optional[date | datetime] = None,
         end_time: Optional[date | datetime] = None,
         limit: int = 20,
+        *,
+        config: RunnableConfig,
 ) -> List[Dict]:
     """
     根据指定的参数（如出发机场、到达机场、出发时间范围等）搜索航班，并返回匹配的航班列表。
@@ -78,43 +153,259 @@ def search_flights(
     - start_time (Optional[date | datetime]): 出发时间范围的开始时间（可选）。
     - end_time (Optional[date | datetime]): 出发时间范围的结束时间（可选）。
     - limit (int): 返回结果的最大数量，默认为20。
+    - config (RunnableConfig): 配置信息，configurable.db_path 可以指定当前会话使用的数据库。
 
     返回:
         匹配条件的航班信息列表。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    db_path = resolve_db_path(config, db)
+    if _use_columnar(config):
+        return get_flight_columns(db_path).search(departure_airport, arrival_airport, start_time, end_time, limit=limit)
+    # 按 (scheduled_departure, flight_id) 排序，结果是确定的；逐行从游标读取，读够 limit 行就停止
+    return list(islice(
+        iter_flights(db_path, departure_airport, arrival_airport, start_time, end_time, limit=limit),
+        limit,
+    ))
+
+
+@async_implementation(search_flights)
+async def asearch_flights(
+        departure_airport: Optional[str] = None,
+        arrival_airport: Optional[str] = None,
+        start_time: Optional[date | datetime] = None,
+        end_time: Optional[date | datetime] = None,
+        limit: int = 20,
+        *,
+        config: RunnableConfig,
+) -> List[Dict]:
+    """search_flights 的异步实现。"""
+    if _use_columnar(config):
+        # 列式存储在内存中，向量化查询不涉及 I/O，直接执行同步实现
+        return search_flights.func(departure_airport, arrival_airport, start_time, end_time, limit, config=config)
+    query, params = _flights_query(departure_airport, arrival_airport, start_time, end_time, limit=limit)
+    return await _afetch_flights(resolve_db_path(config, db), query, params)
 
-    query = "SELECT * FROM flights WHERE 1 = 1"
-    params = []
 
-    if departure_airport:
-        query += " AND departure_airport = ?"
-        params.append(departure_airport)
+@compact_tool(drop_columns=("actual_departure", "actual_arrival"))
+def search_flights_page(
+        departure_airport: Optional[str] = None,
+        arrival_airport: Optional[str] = None,
+        start_time: Optional[date | datetime] = None,
+        end_time: Optional[date | datetime] = None,
+        page_size: int = 20,
+        page_token: Optional[str] = None,
+        *,
+        config: RunnableConfig,
+) -> Dict:
+    """
+    分页搜索航班。结果按起飞时间（以及航班ID）排序，每次返回一页，并附带下一页的翻页标记。
+    需要查看更多航班时，用相同的搜索条件并传入上一次返回的 next_page_token 继续查询，不会返回重复的航班。
+
+    参数:
+    - departure_airport (Optional[str]): 出发机场（可选）。
+    - arrival_airport (Optional[str]): 到达机场（可选）。
+    - start_time (Optional[date | datetime]): 出发时间范围的开始时间（可选）。
+    - end_time (Optional[date | datetime]): 出发时间范围的结束时间（可选）。
+    - page_size (int): 每页返回的航班数量，默认为20。
+    - page_token (Optional[str]): 上一页返回的 next_page_token，查询第一页时不传。
+    - config (RunnableConfig): 配置信息，configurable.db_path 可以指定当前会话使用的数据库。
+
+    返回:
+        包含 flights（本页航班列表）和 next_page_token（没有更多结果时为 None）的字典。
+    """
+    fingerprint = _filters_fingerprint(departure_airport, arrival_airport, start_time, end_time)
+    after = _decode_page_token(page_token, fingerprint) if page_token else None
+
+    db_path = resolve_db_path(config, db)
+    # 多取一行，用来判断后面是否还有下一页
+    if _use_columnar(config):
+        rows = get_flight_columns(db_path).search(
+            departure_airport, arrival_airport, start_time, end_time, after=after, limit=page_size + 1
+        )
+    else:
+        rows = list(islice(
+            iter_flights(
+                db_path,
+                departure_airport,
+                arrival_airport,
+                start_time,
+                end_time,
+                after=after,
+                limit=page_size + 1,
+            ),
+            page_size + 1,
+        ))
+    return _flights_page(rows, page_size, fingerprint)
+
+
+@async_implementation(search_flights_page)
+async def asearch_flights_page(
+        departure_airport: Optional[str] = None,
+        arrival_airport: Optional[str] = None,
+        start_time: Optional[date | datetime] = None,
+        end_time: Optional[date | datetime] = None,
+        page_size: int = 20,
+        page_token: Optional[str] = None,
+        *,
+        config: RunnableConfig,
+) -> Dict:
+    """search_flights_page 的异步实现。"""
+    if _use_columnar(config):
+        return search_flights_page.func(
+            departure_airport, arrival_airport, start_time, end_time, page_size, page_token, config=config
+        )
+    fingerprint = _filters_fingerprint(departure_airport, arrival_airport, start_time, end_time)
+    after = _decode_page_token(page_token, fingerprint) if page_token else None
+    query, params = _flights_query(
+        departure_airport, arrival_airport, start_time, end_time, after=after, limit=page_size + 1
+    )
+    rows = await _afetch_flights(resolve_db_path(config, db), query, params)
+    return _flights_page(rows, page_size, fingerprint)
 
-    if arrival_airport:
-        query += " AND arrival_airport = ?"
-        params.append(arrival_airport)
 
-    if start_time:
-        query += " AND scheduled_departure >= ?"
-        params.append(start_time)
+@compact_tool(drop_columns=("actual_departure", "actual_arrival"))
+def search_flight_connections(
+        departure_airport: str,
+        arrival_airport: str,
+        start_time: Optional[date | datetime] = None,
+        end_time: Optional[date | datetime] = None,
+        max_stops: int = 2,
+        min_connection_minutes: int = DEFAULT_MIN_CONNECTION,
+        sort_by: str = "arrival",
+        top_k: int = 5,
+        *,
+        config: RunnableConfig,
+) -> List[Dict]:
+    """
+    搜索从出发机场到到达机场的行程，包括直飞、一次中转和两次中转的联程航班。
+    没有直飞航班或者需要比较中转方案时使用，不需要多次调用 search_flights 自己拼接航段。
+
+    参数:
+    - departure_airport (str): 出发机场。
+    - arrival_airport (str): 到达机场。
+    - start_time (Optional[date | datetime]): 第一段航班起飞时间范围的开始时间（可选）。
+    - end_time (Optional[date | datetime]): 第一段航班起飞时间范围的结束时间（可选）。
+    - max_stops (int): 最多中转次数，0~2，默认为2。
+    - min_connection_minutes (int): 最短转机时间（分钟），默认为60。
+    - sort_by (str): "arrival" 按到达时间最早排序，"duration" 按总耗时最短排序，默认为 "arrival"。
+    - top_k (int): 返回的行程数量，默认为5。
+    - config (RunnableConfig): 配置信息，configurable.db_path 可以指定当前会话使用的数据库。
+
+    返回:
+        行程列表。每个行程包含中转次数 stops、总耗时 duration_minutes、每次转机的等待时间 layover_minutes 和各段航班 legs。
+    """
+    # 查询只访问内存中的航班图，没有单独的异步实现；在 ainvoke 中 LangChain 会把它放到线程池中执行
+    graph = get_flight_graph(resolve_db_path(config, db))
+    return graph.search(
+        departure_airport,
+        arrival_airport,
+        start_time=start_time,
+        end_time=end_time,
+        max_stops=max_stops,
+        min_connection=min_connection_minutes,
+        top_k=top_k,
+        sort_by=sort_by,
+    )
 
-    if end_time:
-        query += " AND scheduled_departure <= ?"
-        params.append(end_time)
 
-    query += " LIMIT ?"
-    params.append(limit)
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    results = [dict(zip(column_names, row)) for row in rows]
+def _use_columnar(config: RunnableConfig) -> bool:
+    """
+    航班搜索使用哪个后端，由 configurable.flight_search_backend 指定：
+    "sqlite"（默认）逐行读取 SQLite 的查询结果；"columnar" 使用内存中的列式存储（utils.flight_columns），
+    适合一次返回大量航班的统计类查询。两者返回的字段和顺序相同。
+    """
+    backend = config.get("configurable", {}).get("flight_search_backend", "sqlite")
+    if backend not in ("sqlite", "columnar"):
+        raise ValueError(f"不支持的航班搜索后端: {backend}，可选值为 sqlite、columnar。")
+    return backend == "columnar"
 
-    cursor.close()
-    conn.close()
 
-    return results
+def iter_flights(
+        db_path: str,
+        departure_airport: Optional[str] = None,
+        arrival_airport: Optional[str] = None,
+        start_time: Optional[date | datetime] = None,
+        end_time: Optional[date | datetime] = None,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+) -> Iterator[Dict]:
+    """
+    按 (scheduled_departure, flight_id) 顺序逐行生成符合条件的航班，不会一次性 fetchall 到内存中。
+
+    参数:
+    - db_path (str): 数据库路径。
+    - departure_airport / arrival_airport / start_time / end_time: 与 search_flights 相同的过滤条件。
+    - after (Optional[tuple]): 键集分页的起点 (scheduled_departure, flight_id)，只返回排在它之后的航班。
+    - limit (Optional[int]): 最多返回的行数，不传则返回所有匹配的航班。
+
+    返回:
+        航班字典的迭代器。
+    """
+    query, params = _flights_query(departure_airport, arrival_airport, start_time, end_time, after, limit)
+    with search_reader(db_path, "flights") as conn:
+        yield from iter_dicts(conn, query, params)
+
+
+def _flights_query(
+        departure_airport: Optional[str] = None,
+        arrival_airport: Optional[str] = None,
+        start_time: Optional[date | datetime] = None,
+        end_time: Optional[date | datetime] = None,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+) -> tuple[str, list]:
+    """生成按 (scheduled_departure, flight_id) 排序的航班查询语句和参数，参数含义与 iter_flights 相同。"""
+    select = (
+        Select("flights")
+        .where_if(departure_airport, "departure_airport = ?")
+        .where_if(arrival_airport, "arrival_airport = ?")
+        .where_if(start_time, "scheduled_departure >= ?")
+        .where_if(end_time, "scheduled_departure <= ?")
+    )
+    if after:
+        # 行值比较可以直接用上 (..., scheduled_departure, flight_id) 索引定位到起点，而不是跳过前面的 OFFSET 行
+        select.where("(scheduled_departure, flight_id) > (?, ?)", *after)
+    return select.order_by("scheduled_departure, flight_id").limit(limit).build()
+
+
+async def _afetch_flights(db_path: str, query: str, params: list) -> List[Dict]:
+    if hot_replica_covers(db_path, "flights"):
+        # flights 表在内存热副本中，直接同步查询，不需要经过 aiosqlite 的后台线程
+        with search_reader(db_path, "flights") as conn:
+            return fetch_dicts(conn, query, params)
+    async with get_async_pool(db_path).reader() as conn:
+        return await afetch_dicts(conn, query, params)
+
+
+def _flights_page(rows: List[Dict], page_size: int, fingerprint: str) -> Dict:
+    """把多取了一行的查询结果整理成一页，有多余的行说明还有下一页，生成指向本页最后一行的翻页标记。"""
+    flights = rows[:page_size]
+    next_page_token = None
+    if len(rows) > page_size:
+        last = flights[-1]
+        next_page_token = _encode_page_token((last["scheduled_departure"], last["flight_id"]), fingerprint)
+    return {"flights": flights, "next_page_token": next_page_token}
+
+
+def _filters_fingerprint(*filters) -> str:
+    """计算搜索条件的指纹，写入翻页标记中，防止用一组条件的标记去翻另一组条件的结果。"""
+    return hashlib.sha256(json.dumps([str(f) if f else None for f in filters]).encode()).hexdigest()[:12]
+
+
+def _encode_page_token(position: tuple, fingerprint: str) -> str:
+    payload = json.dumps({"after": list(position), "filters": fingerprint})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_page_token(token: str, fingerprint: str) -> tuple:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        after = tuple(payload["after"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("无效的翻页标记。")
+    if payload.get("filters") != fingerprint:
+        raise ValueError("翻页标记与当前的搜索条件不匹配，请使用相同的搜索条件翻页，或重新从第一页开始搜索。")
+    return after
 
 
 @tool
@@ -122,13 +413,13 @@ def update_ticket_to_new_flight(
         ticket_no: str, new_flight_id: int, *, config: RunnableConfig
 ) -> str:
     """
-    将用户的机票更新为新的有效航班。步骤如下：
+    将用户的机票更新为新的有效航班。只有同时满足以下条件时才会更新，校验和更新在同一个事务的同一条语句中完成：
     1、检查乘客ID：首先从传入的配置中获取乘客ID，并验证其是否存在。
-    2、查询新航班详情：根据提供的新航班ID查询航班详情，包括出发机场、到达机场和计划起飞时间。
+    2、新航班有效：提供的新航班ID必须存在。
     3、时间验证：确保新选择的航班起飞时间与当前时间相差不少于3小时。
     4、确认原机票存在性：验证提供的机票号是否存在于系统中。
     5、验证乘客身份：确保请求修改机票的乘客是该机票的实际拥有者。
-    6、更新机票信息：如果所有检查都通过，则更新机票对应的新航班ID，并提交更改。
+    任一条件不满足时不做任何修改，并返回具体的原因。
 
     参数:
     - ticket_no (str): 要更新的机票编号。
@@ -142,73 +433,57 @@ def update_ticket_to_new_flight(
     if not passenger_id:
         raise ValueError("未配置乘客 ID。")
 
-    conn = connect(db)
-    cursor = conn.cursor()
+    db_path = resolve_db_path(config, db)
+    params = {"ticket_no": ticket_no, "new_flight_id": new_flight_id, "passenger_id": passenger_id}
+    with get_pool(db_path).writer() as conn:
+        updated = conn.execute(_UPDATE_TICKET_SQL, params).fetchall()
+        if not updated:
+            return _update_ticket_failure(conn.execute(_UPDATE_TICKET_FAILURE_SQL, params).fetchone(), params)
 
-    # 查询新航班的信息
-    cursor.execute(
-        "SELECT departure_airport, arrival_airport, scheduled_departure FROM flights WHERE flight_id = ?",
-        (new_flight_id,),
-    )
-    new_flight = cursor.fetchone()
-    if not new_flight:
-        cursor.close()
-        conn.close()
-        return "提供的新的航班 ID 无效。"
-    column_names = [column[0] for column in cursor.description]
-    new_flight_dict = dict(zip(column_names, new_flight))
-
-    # 设置时区并计算当前时间和新航班起飞时间之间的差值
-    timezone = pytz.timezone("Etc/GMT-3")
-    current_time = datetime.now(tz=timezone)
-    departure_time = datetime.strptime(
-        new_flight_dict["scheduled_departure"], "%Y-%m-%d %H:%M:%S.%f%z"
-    )
-    time_until = (departure_time - current_time).total_seconds()
-    if time_until < (3 * 3600):
-        return f"不允许重新安排到距离当前时间少于 3 小时的航班。所选航班时间为 {departure_time}。"
+    user_info_cache.invalidate((db_path, passenger_id))
+    return "机票已成功更新为新的航班。"
 
-    # 确认原机票的存在性
-    cursor.execute(
-        "SELECT flight_id FROM ticket_flights WHERE ticket_no = ?", (ticket_no,)
-    )
-    current_flight = cursor.fetchone()
-    if not current_flight:
-        cursor.close()
-        conn.close()
-        return "未找到给定机票号码的现有机票。"
 
-    # 确认已登录用户确实拥有此机票
-    cursor.execute(
-        "SELECT * FROM tickets WHERE ticket_no = ? AND passenger_id = ?",
-        (ticket_no, passenger_id),
-    )
-    current_ticket = cursor.fetchone()
-    if not current_ticket:
-        cursor.close()
-        conn.close()
-        return f"当前登录的乘客 ID 为 {passenger_id}，不是机票 {ticket_no} 的拥有者。"
-
-    # 更新机票对应的航班ID
-    cursor.execute(
-        "UPDATE ticket_flights SET flight_id = ? WHERE ticket_no = ?",
-        (new_flight_id, ticket_no),
-    )
-    conn.commit()
+@async_implementation(update_ticket_to_new_flight)
+async def aupdate_ticket_to_new_flight(
+        ticket_no: str, new_flight_id: int, *, config: RunnableConfig
+) -> str:
+    """update_ticket_to_new_flight 的异步实现。"""
+    passenger_id = config.get("configurable", {}).get("passenger_id", None)
+    if not passenger_id:
+        raise ValueError("未配置乘客 ID。")
+
+    db_path = resolve_db_path(config, db)
+    params = {"ticket_no": ticket_no, "new_flight_id": new_flight_id, "passenger_id": passenger_id}
+    async with get_async_pool(db_path).writer() as conn:
+        updated = await conn.execute_fetchall(_UPDATE_TICKET_SQL, params)
+        if not updated:
+            async with conn.execute(_UPDATE_TICKET_FAILURE_SQL, params) as cursor:
+                return _update_ticket_failure(await cursor.fetchone(), params)
 
-    cursor.close()
-    conn.close()
+    user_info_cache.invalidate((db_path, passenger_id))
     return "机票已成功更新为新的航班。"
 
 
+def _update_ticket_failure(diagnosis: tuple, params: dict) -> str:
+    """根据 _UPDATE_TICKET_FAILURE_SQL 的查询结果，按原来的校验顺序返回改签失败的原因。"""
+    scheduled_departure, too_soon, ticket_exists = diagnosis
+    if scheduled_departure is None:
+        return "提供的新的航班 ID 无效。"
+    if too_soon:
+        return f"不允许重新安排到距离当前时间少于 3 小时的航班。所选航班时间为 {scheduled_departure}。"
+    if not ticket_exists:
+        return "未找到给定机票号码的现有机票。"
+    return f"当前登录的乘客 ID 为 {params['passenger_id']}，不是机票 {params['ticket_no']} 的拥有者。"
+
+
 @tool
 def cancel_ticket(ticket_no: str, *, config: RunnableConfig) -> str:
     """
-    取消用户的机票并将其从数据库中删除。步骤如下：
+    取消用户的机票并将其从数据库中删除。只有同时满足以下条件时才会删除，校验和删除在同一个事务的同一条语句中完成：
     1、检查乘客ID：首先从传入的配置中获取乘客ID，并验证其是否存在。
-    2、查询机票存在性：根据提供的机票号查询该机票是否存在于系统中。
+    2、查询机票存在性：提供的机票号必须存在于系统中。
     3、验证乘客身份：确保请求取消机票的乘客是该机票的实际拥有者。
-    4、删除机票信息：如果所有检查都通过，则从数据库中删除该机票的信息，并提交更改。
 
     参数:
     - ticket_no (str): 要取消的机票编号。
@@ -222,34 +497,38 @@ def cancel_ticket(ticket_no: str, *, config: RunnableConfig) -> str:
     if not passenger_id:
         raise ValueError("未配置乘客 ID。")
 
-    conn = connect(db)
-    cursor = conn.cursor()
+    db_path = resolve_db_path(config, db)
+    params = {"ticket_no": ticket_no, "passenger_id": passenger_id}
+    with get_pool(db_path).writer() as conn:
+        deleted = conn.execute(_CANCEL_TICKET_SQL, params).fetchall()
+        if not deleted:
+            # 没有删除任何行：要么机票不存在，要么不属于当前乘客
+            return _cancel_ticket_failure(conn.execute(_TICKET_EXISTS_SQL, params).fetchone()[0], params)
 
-    # 查询给定机票号是否存在
-    cursor.execute(
-        "SELECT flight_id FROM ticket_flights WHERE ticket_no = ?", (ticket_no,)
-    )
-    existing_ticket = cursor.fetchone()
-    if not existing_ticket:
-        cursor.close()
-        conn.close()
-        return "未找到给定机票号码的现有机票。"
+    user_info_cache.invalidate((db_path, passenger_id))
+    return "机票已成功取消。"
 
-    # 确认已登录用户确实拥有此机票
-    cursor.execute(
-        "SELECT flight_id FROM tickets WHERE ticket_no = ? AND passenger_id = ?",
-        (ticket_no, passenger_id),
-    )
-    current_ticket = cursor.fetchone()
-    if not current_ticket:
-        cursor.close()
-        conn.close()
-        return f"当前登录的乘客 ID 为 {passenger_id}，不是机票 {ticket_no} 的拥有者。"
-
-    # 删除机票对应的记录
-    cursor.execute("DELETE FROM ticket_flights WHERE ticket_no = ?", (ticket_no,))
-    conn.commit()
-
-    cursor.close()
-    conn.close()
+
+@async_implementation(cancel_ticket)
+async def acancel_ticket(ticket_no: str, *, config: RunnableConfig) -> str:
+    """cancel_ticket 的异步实现。"""
+    passenger_id = config.get("configurable", {}).get("passenger_id", None)
+    if not passenger_id:
+        raise ValueError("未配置乘客 ID。")
+
+    db_path = resolve_db_path(config, db)
+    params = {"ticket_no": ticket_no, "passenger_id": passenger_id}
+    async with get_async_pool(db_path).writer() as conn:
+        deleted = await conn.execute_fetchall(_CANCEL_TICKET_SQL, params)
+        if not deleted:
+            async with conn.execute(_TICKET_EXISTS_SQL, params) as cursor:
+                return _cancel_ticket_failure((await cursor.fetchone())[0], params)
+
+    user_info_cache.invalidate((db_path, passenger_id))
     return "机票已成功取消。"
+
+
+def _cancel_ticket_failure(ticket_exists: int, params: dict) -> str:
+    if not ticket_exists:
+        return "未找到给定机票号码的现有机票。"
+    return f"当前登录的乘客 ID 为 {params['passenger_id']}，不是机票 {params['ticket_no']} 的拥有者。"
@@ -1,19 +1,31 @@
-from sqlite3 import connect, Cursor
 from datetime import date, datetime
 from typing import Optional, Union
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from tools.location_trans import transform_location
+from tools.tools_handler import async_implementation, compact_tool
+from utils.async_db_pool import get_async_pool
+from utils.db_pool import get_pool, resolve_db_path
+from utils.batch_booking import batch_update_by_id, abatch_update_by_id
+from utils.fts import build_search_query, compose_search_query
+from utils.hot_replica import search_reader, hot_replica_covers, apply_hot_delta, aapply_hot_delta
+from utils.optimistic import (
+    CONFLICT, NOT_FOUND, REJECTED, UPDATED, optimistic_update, aoptimistic_update, set_booked, set_values,
+)
+from utils.query_builder import afetch_dicts, fetch_dicts
 
 db = "../travel_new.sqlite"  # 这是数据库文件名
 
 
-@tool
+@compact_tool(drop_columns=("booked", "version"))
 def search_hotels(
         location: Optional[str] = None,
-        name: Optional[str] = None
+        name: Optional[str] = None,
         # price_tier: Optional[str] = None,
         # checkin_date: Optional[Union[datetime, date]] = None,
         # checkout_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
 ) -> list[dict]:
     """
     根据位置、名称、价格层级、入住日期和退房日期搜索酒店。
@@ -26,33 +38,40 @@ def search_hotels(
         list[dict]: 包含匹配搜索条件的酒店信息的字典列表。
     """
 
-    conn = connect(db)
-    cursor = conn.cursor()
     location = transform_location(location)
-    query = "SELECT * FROM hotels WHERE 1=1"
-    params = []
-
-    if location:
-        query += " AND location LIKE ?"
-        params.append(f"%{location}%")
-    if name:
-        query += " AND name LIKE ?"
-        params.append(f"%{name}%")
     # 为了本教程的目的，我们不对日期和价格层级进行严格匹配
-
-    print('查询酒店的SQL：' + query, '参数: ', params)
-    cursor.execute(query, params)
-    results = cursor.fetchall()
+    with search_reader(resolve_db_path(config, db), "hotels") as conn:
+        # 有 FTS5 全文索引时按相关度排序检索，否则退回到 LIKE 查询
+        query, params = build_search_query(conn, "hotels", {"location": location, "name": name})
+        print('查询酒店的SQL：' + query, '参数: ', params)
+        results = fetch_dicts(conn, query, params)
     print('查询酒店的结果: ', results)
-    conn.close()
 
-    return [
-        dict(zip([column[0] for column in cursor.description], row)) for row in results
-    ]
+    return results
+
+
+@async_implementation(search_hotels)
+async def asearch_hotels(
+        location: Optional[str] = None,
+        name: Optional[str] = None,
+        *,
+        config: RunnableConfig,
+) -> list[dict]:
+    """search_hotels 的异步实现，在 graph.astream / ainvoke 中使用。"""
+    if hot_replica_covers(resolve_db_path(config, db), "hotels"):
+        # 表在内存热副本中，查询只需要几十微秒，直接在事件循环中执行同步实现
+        return search_hotels.func(location, name, config=config)
+    location = transform_location(location)
+    pool = get_async_pool(resolve_db_path(config, db))
+    query, params = compose_search_query(
+        "hotels", {"location": location, "name": name}, use_fts="hotels" in await pool.fts_tables()
+    )
+    async with pool.reader() as conn:
+        return await afetch_dicts(conn, query, params)
 
 
 @tool
-def book_hotel(hotel_id: int) -> str:
+def book_hotel(hotel_id: int, *, config: RunnableConfig) -> str:
     """
     通过ID预订酒店。
 
@@ -62,18 +81,15 @@ def book_hotel(hotel_id: int) -> str:
     返回:
         str: 表明酒店是否成功预订的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    status = optimistic_update(resolve_db_path(config, db), "hotels", hotel_id, set_booked(1))
+    return _message("book", hotel_id, status)
 
-    cursor.execute("UPDATE hotels SET booked = 1 WHERE id = ?", (hotel_id,))
-    conn.commit()
 
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"Hotel {hotel_id} 成功预定。"
-    else:
-        conn.close()
-        return f"未找到ID为 {hotel_id} 的酒店。"
+@async_implementation(book_hotel)
+async def abook_hotel(hotel_id: int, *, config: RunnableConfig) -> str:
+    """book_hotel 的异步实现。"""
+    status = await aoptimistic_update(resolve_db_path(config, db), "hotels", hotel_id, set_booked(1))
+    return _message("book", hotel_id, status)
 
 
 @tool
@@ -81,6 +97,8 @@ def update_hotel(
         hotel_id: int,
         checkin_date: Optional[Union[datetime, date]] = None,
         checkout_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
 ) -> str:
     """
     根据ID更新酒店预订的入住和退房日期。
@@ -93,30 +111,27 @@ def update_hotel(
     返回:
         str: 表明酒店预订是否成功更新的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    change = set_values(checkin_date=checkin_date, checkout_date=checkout_date)
+    status = optimistic_update(resolve_db_path(config, db), "hotels", hotel_id, change)
+    return _message("update", hotel_id, status)
 
-    if checkin_date:
-        cursor.execute(
-            "UPDATE hotels SET checkin_date = ? WHERE id = ?", (checkin_date, hotel_id)
-        )
-    if checkout_date:
-        cursor.execute(
-            "UPDATE hotels SET checkout_date = ? WHERE id = ?", (checkout_date, hotel_id)
-        )
-
-    conn.commit()
 
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"Hotel {hotel_id} 成功更新。"
-    else:
-        conn.close()
-        return f"未找到ID为 {hotel_id} 的酒店。"
+@async_implementation(update_hotel)
+async def aupdate_hotel(
+        hotel_id: int,
+        checkin_date: Optional[Union[datetime, date]] = None,
+        checkout_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
+) -> str:
+    """update_hotel 的异步实现。"""
+    change = set_values(checkin_date=checkin_date, checkout_date=checkout_date)
+    status = await aoptimistic_update(resolve_db_path(config, db), "hotels", hotel_id, change)
+    return _message("update", hotel_id, status)
 
 
 @tool
-def cancel_hotel(hotel_id: int) -> str:
+def cancel_hotel(hotel_id: int, *, config: RunnableConfig) -> str:
     """
     根据ID取消酒店预订。
 
@@ -126,16 +141,116 @@ def cancel_hotel(hotel_id: int) -> str:
     返回:
         str: 表明酒店预订是否成功取消的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
-
-    # 将booked字段设置为0来表示取消预订
-    cursor.execute("UPDATE hotels SET booked = 0 WHERE id = ?", (hotel_id,))
-    conn.commit()
-
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"Hotel {hotel_id} 成功取消。"
-    else:
-        conn.close()
-        return f"未找到ID为 {hotel_id} 的酒店。"
+    status = optimistic_update(resolve_db_path(config, db), "hotels", hotel_id, set_booked(0))
+    return _message("cancel", hotel_id, status)
+
+
+@async_implementation(cancel_hotel)
+async def acancel_hotel(hotel_id: int, *, config: RunnableConfig) -> str:
+    """cancel_hotel 的异步实现。"""
+    status = await aoptimistic_update(resolve_db_path(config, db), "hotels", hotel_id, set_booked(0))
+    return _message("cancel", hotel_id, status)
+
+
+@tool
+def book_hotels(
+        hotel_ids: list[int],
+        checkin_date: Optional[Union[datetime, date]] = None,
+        checkout_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
+) -> list[str]:
+    """
+    一次预订多家酒店，所有酒店使用相同的入住和退房日期，在同一个事务中完成。
+
+    参数:
+        hotel_ids (list[int]): 要预订的酒店的ID列表。
+        checkin_date (Optional[Union[datetime, date]]): 入住日期，不传则保持原值。默认为None。
+        checkout_date (Optional[Union[datetime, date]]): 退房日期，不传则保持原值。默认为None。
+
+    返回:
+        list[str]: 与 hotel_ids 一一对应的结果消息。
+    """
+    db_path = resolve_db_path(config, db)
+    with get_pool(db_path).writer() as conn:
+        results = batch_update_by_id(
+            conn, "hotels", hotel_ids, set_booked(1, checkin_date=checkin_date, checkout_date=checkout_date)
+        )
+        apply_hot_delta(conn, db_path, "hotels", hotel_ids)
+
+    return [_message("book", hotel_id, results[hotel_id]) for hotel_id in hotel_ids]
+
+
+@async_implementation(book_hotels)
+async def abook_hotels(
+        hotel_ids: list[int],
+        checkin_date: Optional[Union[datetime, date]] = None,
+        checkout_date: Optional[Union[datetime, date]] = None,
+        *,
+        config: RunnableConfig,
+) -> list[str]:
+    """book_hotels 的异步实现。"""
+    db_path = resolve_db_path(config, db)
+    async with get_async_pool(db_path).writer() as conn:
+        results = await abatch_update_by_id(
+            conn, "hotels", hotel_ids, set_booked(1, checkin_date=checkin_date, checkout_date=checkout_date)
+        )
+        await aapply_hot_delta(conn, db_path, "hotels", hotel_ids)
+
+    return [_message("book", hotel_id, results[hotel_id]) for hotel_id in hotel_ids]
+
+
+@tool
+def cancel_hotels(hotel_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """
+    一次取消多家酒店的预订，在同一个事务中完成。
+
+    参数:
+        hotel_ids (list[int]): 要取消的酒店预订的ID列表。
+
+    返回:
+        list[str]: 与 hotel_ids 一一对应的结果消息。
+    """
+    db_path = resolve_db_path(config, db)
+    with get_pool(db_path).writer() as conn:
+        results = batch_update_by_id(conn, "hotels", hotel_ids, set_booked(0))
+        apply_hot_delta(conn, db_path, "hotels", hotel_ids)
+
+    return [_message("cancel", hotel_id, results[hotel_id]) for hotel_id in hotel_ids]
+
+
+@async_implementation(cancel_hotels)
+async def acancel_hotels(hotel_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """cancel_hotels 的异步实现。"""
+    db_path = resolve_db_path(config, db)
+    async with get_async_pool(db_path).writer() as conn:
+        results = await abatch_update_by_id(conn, "hotels", hotel_ids, set_booked(0))
+        await aapply_hot_delta(conn, db_path, "hotels", hotel_ids)
+
+    return [_message("cancel", hotel_id, results[hotel_id]) for hotel_id in hotel_ids]
+
+
+# 预订、更新、取消的结果消息，按 optimistic_update / batch_update_by_id 返回的结果选择
+_MESSAGES = {
+    "book": {
+        UPDATED: "Hotel {id} 成功预定。",
+        REJECTED: "Hotel {id} 已经被预订，不能重复预订。",
+        NOT_FOUND: "未找到ID为 {id} 的酒店。",
+    },
+    "update": {
+        UPDATED: "Hotel {id} 成功更新。",
+        REJECTED: "没有提供新的入住或退房日期，Hotel {id} 未作修改。",
+        NOT_FOUND: "未找到ID为 {id} 的酒店。",
+    },
+    "cancel": {
+        UPDATED: "Hotel {id} 成功取消。",
+        REJECTED: "Hotel {id} 当前没有预订，无需取消。",
+        NOT_FOUND: "未找到ID为 {id} 的酒店。",
+    },
+}
+
+
+def _message(action: str, hotel_id: int, status: str) -> str:
+    if status == CONFLICT:
+        return f"Hotel {hotel_id} 正在被其他会话修改，请稍后重试。"
+    return _MESSAGES[action][status].format(id=hotel_id)
@@ -13,6 +13,10 @@ def transform_location(chinese_city):
         # 添加更多的城市映射...
     }
 
+    # 没有给出城市时原样返回，由调用方忽略该条件
+    if not chinese_city:
+        return chinese_city
+
     # Check if the input is in Chinese
     if all('\u4e00' <= char <= '\u9fff' for char in chinese_city):
         return city_dict.get(chinese_city, "城市名称未找到")
@@ -1,3 +1,4 @@
+import atexit
 import re
 import os
 import numpy as np
@@ -5,6 +6,11 @@ from langchain_community.embeddings import ZhipuAIEmbeddings
 from langchain_core.tools import tool
 from langchain_openai import OpenAIEmbeddings
 
+from utils.embedding_store import EmbeddingStore, FileWatcher, content_hash
+from utils.micro_batch import MicroBatcher
+from utils.query_embedding_cache import QueryEmbeddingCache
+from utils.vector_index import ExactIndex, VectorIndex, load_or_build
+
 
 # embeddings_model = ZhipuAIEmbeddings(
 #     model="embedding-3",
@@ -16,12 +22,32 @@ embeddings_model = OpenAIEmbeddings(
 )
 
 
+# FAQ 文本文件，以及按内容哈希保存 FAQ 各段落向量的目录
+faq_file = '../order_faq.md'
+faq_index_dir = '../order_faq.index'
+# 后台检查 FAQ 文件是否被修改的间隔（秒）
+FAQ_WATCH_INTERVAL = 5.0
+# FAQ 向量索引的后端："exact"（精确检索，默认）、"ivf" 或 "hnsw"（需要安装 hnswlib），文档数上千之后可以换成近似检索
+FAQ_INDEX_BACKEND = "exact"
+# 索引后端的参数。精确检索默认直接使用内存映射的 float32 向量分块打分；语料很大时可以用 {"quantize": "int8"} 把向量量化后
+# 保存在 FAQ 向量目录中，内存和磁盘占用都只有 float32 的四分之一
+FAQ_INDEX_PARAMS = {}
+
+
+def build_index(docs: list, vectors, store: EmbeddingStore, backend: str = FAQ_INDEX_BACKEND) -> VectorIndex:
+    """为文档建立向量索引。近似检索的索引保存在向量存储的目录中，文档没有变化时直接读回，不需要重新建立。"""
+    fingerprint = content_hash("".join(content_hash(doc["page_content"]) for doc in docs))
+    return load_or_build(
+        backend, os.path.join(store.directory, f"index-{backend}"), vectors, fingerprint, **FAQ_INDEX_PARAMS
+    )
+
+
 # 定义向量存储检索器类
 class VectorStoreRetriever:
-    def __init__(self, docs: list, vectors: list):
-        # 存储文档和对应的向量
-        self._arr = np.array(vectors)
-        self._docs = docs
+    def __init__(self, docs: list, vectors, index: VectorIndex = None):
+        # 存储文档和对应的向量索引（默认为精确检索）。两者放在同一个元组中整体替换，后台刷新时查询拿到的总是一致的一对
+        self._index = (docs, index or ExactIndex().build(vectors))
+        self.backend = self._index[1].name
 
     @classmethod
     def from_docs(cls, docs):
@@ -29,38 +55,81 @@ class VectorStoreRetriever:
         vectors = embeddings_model.embed_documents([doc["page_content"] for doc in docs])
         return cls(docs, vectors)
 
-    def query(self, query: str, k: int = 5) -> list[dict]:
-        # 对查询生成嵌入向量
-        embed = embeddings_model.embed_query(query)
-
-        # 计算查询向量与文档向量的相似度（进行矩阵乘法计算点积值 @），输出索引及分数（点积值越大，表示两个向量越相似（方向越接近））
-        # T 是转置就是行和列的互换
-        scores = np.array(embed) @ self._arr.T
+    @classmethod
+    def from_store(cls, docs: list, store: EmbeddingStore, backend: str = FAQ_INDEX_BACKEND):
+        """从磁盘上的向量存储创建检索器，只有存储中没有的（新增或修改过的）文档才需要调用嵌入模型。"""
+        vectors, stats = store.sync([doc["page_content"] for doc in docs], embeddings_model.embed_documents)
+        print(f"FAQ 向量加载完成: 复用 {stats['reused']} 段，重新计算 {stats['embedded']} 段，删除 {stats['removed']} 段")
+        return cls(docs, vectors, build_index(docs, vectors, store, backend))
+
+    def refresh(self, docs: list, store: EmbeddingStore):
+        """用新的文档更新检索器。计算向量和建立索引期间查询继续使用旧的索引，完成后一次性替换。"""
+        vectors, stats = store.sync([doc["page_content"] for doc in docs], embeddings_model.embed_documents)
+        self._index = (docs, build_index(docs, vectors, store, self.backend))
+        print(f"FAQ 已刷新: 复用 {stats['reused']} 段，重新计算 {stats['embedded']} 段，删除 {stats['removed']} 段")
 
-        # 获取相似度最高的 k 个文档的索引（分最高的数据的索引，放在了最后面）
-        # argpartition 函数使用分区算法排序（默认正序），将数组中的元素划分，使得第k大的元素在第k个位置，左边的元素都比它大，右边的元素都比它小
-        # argpartition 不会完全排序数组，它只是将前 k 个最大/最小值放在正确的位置，这比完全排序更高效。但这两部分内部的数据是未排序的。
-        top_k_idx = np.argpartition(scores, -k)[-k:]
+    def query(self, query: str, k: int = 5) -> list[dict]:
+        # 对查询生成嵌入向量：同样的（规范化后相同的）问题直接从缓存中取，不再请求远程接口
+        embed = query_embedding_cache.get_or_embed(query, embeddings_model.embed_query)
 
-        # scores[top_k_idx]：获取 top-k 索引列表对应的得分列表
-        # -scores[top_k_idx]：取负值，因为 argsort 默认是升序排序，得到按得分降序排列的索引
-        # top_k_idx[...]：使用这些索引重新排列到 top_k_idx，使其索引按相似度降序排列，注意返回的是索引
-        top_k_idx_sorted = top_k_idx[np.argsort(-scores[top_k_idx])]
+        # 在索引中检索与查询向量点积最大（方向最接近）的 k 个文档，索引按相似度降序返回文档下标和分数
+        docs, index = self._index
+        top_k_idx_sorted, scores = index.search(embed, k)
 
         # 返回相似度最高的 k 个文档及其相似度
         return [
-            {**self._docs[idx], "similarity": scores[idx]} for idx in top_k_idx_sorted
+            {**docs[idx], "similarity": score} for idx, score in zip(top_k_idx_sorted, scores)
         ]
 
+    def query_batch(self, queries: list[str], k: int = 5) -> list[list[dict]]:
+        """
+        一次检索多个查询：缓存中没有的查询合并在一次 embed_documents 请求中计算向量，所有查询与文档向量做一次矩阵乘法，
+        再沿 axis=1 批量取前 k 个。
+
+        参数:
+            queries (list[str]): 查询列表。
+            k (int): 每个查询返回的文档数。
+
+        返回:
+            list[list[dict]]: 与 queries 一一对应，每个查询相似度最高的 k 个文档及其相似度。
+        """
+        if not queries:
+            return []
+        embeds = query_embedding_cache.get_or_embed_many(queries, embeddings_model.embed_documents)
+        docs, index = self._index
+        top_k_idx_sorted, scores = index.search_batch(embeds, k)
+        return [
+            [{**docs[idx], "similarity": score} for idx, score in zip(row_idx, row_scores)]
+            for row_idx, row_scores in zip(top_k_idx_sorted, scores)
+        ]
+
+
+def load_faq_docs(path: str = faq_file) -> list[dict]:
+    # 读取 FAQ 文本文件
+    with open(path, encoding='utf8') as f:
+        faq_text = f.read()
+    # 将 FAQ 文本按标题分割成多个文档
+    return [{"page_content": txt} for txt in re.split(r"(?=\n##)", faq_text)]
+
+
+# 查询向量缓存：助理在每次写操作前都会查询政策，相同的问题反复出现。缓存保存在 FAQ 向量目录中，进程退出时写回磁盘
+query_embedding_cache = QueryEmbeddingCache(
+    path=os.path.join(faq_index_dir, 'query_cache.npz'), model=embeddings_model.model
+)
+query_embedding_cache.load()
+atexit.register(query_embedding_cache.save)
+
+# 创建向量存储检索器实例：向量按段落内容的哈希保存在磁盘上，启动时内存映射，只有改动过的段落才重新计算
+faq_store = EmbeddingStore(faq_index_dir, model=embeddings_model.model)
+retriever = VectorStoreRetriever.from_store(load_faq_docs(), faq_store)
+# FAQ 文件被修改后在后台刷新索引，不阻塞查询
+faq_watcher = FileWatcher(
+    faq_file, lambda: retriever.refresh(load_faq_docs(), faq_store), interval=FAQ_WATCH_INTERVAL
+).start()
 
-# 读取 FAQ 文本文件
-with open('../order_faq.md', encoding='utf8') as f:
-    faq_text = f.read()
-# 将 FAQ 文本按标题分割成多个文档
-docs = [{"page_content": txt} for txt in re.split(r"(?=\n##)", faq_text)]
 
-# 创建向量存储检索器实例
-retriever = VectorStoreRetriever.from_docs(docs)
+# 同一轮中并发执行的多个 lookup_policy 调用合并成一次 query_batch：一次嵌入请求、一次矩阵乘法
+policy_batcher = MicroBatcher(lambda queries: retriever.query_batch(queries, k=2))
 
 
 # 定义工具函数，用于查询航空公司的政策
@@ -68,7 +137,7 @@ retriever = VectorStoreRetriever.from_docs(docs)
 def lookup_policy(query: str) -> str:
     """查询公司政策，检查某些选项是否允许。在进行航班变更或其他'写'操作之前使用此函数。"""
     # 查询相似度最高的 k 个文档
-    docs = retriever.query(query, k=2)
+    docs = policy_batcher.submit(query)
     # 返回这些文档的内容
     return "\n\n".join([doc["page_content"] for doc in docs])
 
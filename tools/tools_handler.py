@@ -1,7 +1,12 @@
+import json
+
 from langchain_core.messages import ToolMessage
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import RunnableLambda, RunnableConfig
+from langchain_core.tools import StructuredTool, tool
 from langgraph.prebuilt import ToolNode
 
+from utils.tool_output import DEFAULT_MAX_CHARS, compact_result, tool_output_stats
+
 # 以字典形式，返回出错信息，对state的更新
 def handle_tool_error(state) -> dict:
     """
@@ -26,16 +31,174 @@ def handle_tool_error(state) -> dict:
     }
 
 
-def create_tool_node_with_fallback(tools: list) -> dict:
+def create_tool_node_with_fallback(tools: list, batch_tools: dict = None) -> dict:
     """
     创建一个带有错误处理机制的工具节点。当指定的工具执行失败时（例如抛出异常）触发。
+
+    参数:
+        tools (list): 节点中可以调用的工具。
+        batch_tools (dict): 单个工具名 -> (批量工具, 单个工具的ID参数名, 批量工具的ID列表参数名)。
+            同一轮中对同一个工具的多次调用（除ID外参数都相同）会被合并成一次批量工具调用，只用一个事务完成。
     """
-    return ToolNode(tools).with_fallbacks(
+    tool_node = ToolNode(tools)
+    node = tool_node
+    if batch_tools:
+        # 同时提供异步实现：graph.astream / ainvoke 中仍然 await 工具的协程，而不是整个节点在线程池中同步执行
+        node = RunnableLambda(
+            lambda state, config: _invoke_with_batching(tool_node, batch_tools, state, config),
+            afunc=lambda state, config: _ainvoke_with_batching(tool_node, batch_tools, state, config),
+            name="tools",
+        )
+    return node.with_fallbacks(
         # 调用handle_tool_error函数进行错误处理
         [RunnableLambda(handle_tool_error)], exception_key="error"
     )
 
 
+def _batch_calls(batch_tools: dict, message) -> list:
+    """
+    把消息中可以合并的工具调用分组（同一个工具、除ID外参数都相同，且至少两次调用）。
+
+    返回:
+        list: 每组为 (工具名, 工具调用列表, 批量工具, 批量工具的参数)。
+    """
+    groups = {}
+    for tool_call in message.tool_calls:
+        spec = batch_tools.get(tool_call["name"])
+        if spec is None:
+            continue
+        _, id_arg, _ = spec
+        shared_args = {key: value for key, value in tool_call["args"].items() if key != id_arg}
+        key = (tool_call["name"], json.dumps(shared_args, sort_keys=True, default=str))
+        groups.setdefault(key, []).append(tool_call)
+
+    batches = []
+    for (name, _), tool_calls in groups.items():
+        if len(tool_calls) < 2:
+            continue
+        batch_tool, id_arg, ids_arg = batch_tools[name]
+        args = {key: value for key, value in tool_calls[0]["args"].items() if key != id_arg}
+        args[ids_arg] = [tool_call["args"][id_arg] for tool_call in tool_calls]
+        batches.append((name, tool_calls, batch_tool, args))
+    return batches
+
+
+def _batch_messages(name: str, tool_calls: list, statuses: list) -> dict:
+    return {
+        tool_call["id"]: ToolMessage(content=status, name=name, tool_call_id=tool_call["id"])
+        for tool_call, status in zip(tool_calls, statuses)
+    }
+
+
+def _remaining_state(state: dict, results: dict):
+    """返回只包含未合并的工具调用的状态，没有剩余的调用时返回 None。"""
+    message = state["messages"][-1]
+    remaining = [tool_call for tool_call in message.tool_calls if tool_call["id"] not in results]
+    if not remaining:
+        return None
+    return {**state, "messages": [*state["messages"][:-1], message.model_copy(update={"tool_calls": remaining})]}
+
+
+def _invoke_with_batching(node: ToolNode, batch_tools: dict, state: dict, config: RunnableConfig) -> dict:
+    """
+    把最后一条消息中可以合并的工具调用分组，每组调用一次批量工具，其余的工具调用仍交给 ToolNode 执行。
+    返回的 ToolMessage 与原来的工具调用一一对应，顺序不变。
+    """
+    message = state["messages"][-1]
+    results = {}
+    for name, tool_calls, batch_tool, args in _batch_calls(batch_tools, message):
+        results.update(_batch_messages(name, tool_calls, batch_tool.invoke(args, config)))
+
+    remaining = _remaining_state(state, results)
+    if remaining is not None:
+        for tool_message in node.invoke(remaining, config)["messages"]:
+            results[tool_message.tool_call_id] = tool_message
+    return {"messages": [results[tool_call["id"]] for tool_call in message.tool_calls]}
+
+
+async def _ainvoke_with_batching(node: ToolNode, batch_tools: dict, state: dict, config: RunnableConfig) -> dict:
+    """_invoke_with_batching 的异步版本，批量工具和 ToolNode 都通过 ainvoke 调用，使用工具的协程实现。"""
+    message = state["messages"][-1]
+    results = {}
+    for name, tool_calls, batch_tool, args in _batch_calls(batch_tools, message):
+        results.update(_batch_messages(name, tool_calls, await batch_tool.ainvoke(args, config)))
+
+    remaining = _remaining_state(state, results)
+    if remaining is not None:
+        for tool_message in (await node.ainvoke(remaining, config))["messages"]:
+            results[tool_message.tool_call_id] = tool_message
+    return {"messages": [results[tool_call["id"]] for tool_call in message.tool_calls]}
+
+
+def async_implementation(sync_tool):
+    """
+    装饰器：把一个 async def 函数注册为已有工具的协程实现。
+    工具在 graph.astream / ainvoke 中被调用时会直接 await 这个协程，而不是把同步函数丢到线程池中执行，
+    ToolNode 也可以并发执行同一轮中的多个工具调用。被装饰的函数参数需要与同步工具保持一致。
+
+    参数:
+        sync_tool: 用 @tool 创建的同步工具。
+    """
+
+    def register(coroutine):
+        sync_tool.coroutine = coroutine
+        return coroutine
+
+    return register
+
+
+class CompactResultTool(StructuredTool):
+    """
+    返回结果较大的查询工具：ToolNode 发回给 LLM 的内容是 compact_result 编码后的紧凑表格，
+    原始的返回值作为 ToolMessage.artifact 保留，程序中仍然可以拿到完整的数据。
+    工具的 func / coroutine 不变，直接调用它们得到的仍然是原始的返回值。
+    """
+
+    response_format: str = "content_and_artifact"
+    drop_columns: tuple = ()  # 不发给 LLM 的列
+    max_chars: int = DEFAULT_MAX_CHARS
+
+    def _compact(self, result) -> tuple:
+        content = compact_result(result, self.drop_columns, self.max_chars)
+        tool_output_stats.record(self.name, result, content)
+        return content, result
+
+    # 父类按 _run/_arun 的签名决定是否传入 config 和 run_manager，这里的签名需要与父类保持一致
+    def _run(self, *args, config: RunnableConfig, run_manager=None, **kwargs):
+        return self._compact(super()._run(*args, config=config, run_manager=run_manager, **kwargs))
+
+    async def _arun(self, *args, config: RunnableConfig, run_manager=None, **kwargs):
+        result = await super()._arun(*args, config=config, run_manager=run_manager, **kwargs)
+        if self.coroutine is None:
+            # 没有异步实现时父类会在线程池中调用 self._run，结果已经编码过
+            return result
+        return self._compact(result)
+
+
+def compact_tool(drop_columns=(), max_chars: int = DEFAULT_MAX_CHARS):
+    """
+    装饰器：与 @tool 相同，但工具的结果以紧凑的表格形式发给 LLM（列名只出现一次，每行一条记录），
+    并去掉 LLM 用不到的列，结果过长时截断并说明省略的条数。
+
+    参数:
+        drop_columns: 不发给 LLM 的列。
+        max_chars (int): 发给 LLM 的表格最多保留的字符数。
+    """
+
+    def decorator(func):
+        base = tool(func)
+        return CompactResultTool(
+            name=base.name,
+            description=base.description,
+            args_schema=base.args_schema,
+            func=base.func,
+            drop_columns=tuple(drop_columns),
+            max_chars=max_chars,
+        )
+
+    return decorator
+
+
 def _print_event(event: dict, _printed: set, max_length=1500):
     """
     打印事件信息，特别是对话状态和消息内容。如果消息内容过长，会进行截断处理以保证输出的可读性。
@@ -1,18 +1,30 @@
-from sqlite3 import connect, Cursor
 from typing import Optional, List
 
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
 from tools.location_trans import transform_location
+from tools.tools_handler import async_implementation, compact_tool
+from utils.async_db_pool import get_async_pool
+from utils.db_pool import get_pool, resolve_db_path
+from utils.batch_booking import batch_update_by_id, abatch_update_by_id
+from utils.fts import build_search_query, compose_search_query
+from utils.hot_replica import search_reader, hot_replica_covers, apply_hot_delta, aapply_hot_delta
+from utils.optimistic import (
+    CONFLICT, NOT_FOUND, REJECTED, UPDATED, optimistic_update, aoptimistic_update, set_booked, set_values,
+)
+from utils.query_builder import afetch_dicts, fetch_dicts
 
 db = "../travel_new.sqlite"  # 这是数据库文件名
 
 
-@tool
+@compact_tool(drop_columns=("booked", "version"))
 def search_trip_recommendations(
         location: Optional[str] = None,
         name: Optional[str] = None,
         keywords: Optional[str] = None,
+        *,
+        config: RunnableConfig,
 ) -> List[dict]:
     """
     根据位置、名称和关键词搜索旅行推荐。
@@ -25,36 +37,49 @@ def search_trip_recommendations(
     返回:
         list[dict]: 包含匹配搜索条件的旅行推荐字典列表。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
     location = transform_location(location)
-    query = "SELECT * FROM trip_recommendations WHERE 1=1"
-    params = []
-
-    if location:
-        query += " AND location LIKE ?"
-        params.append(f"%{location}%")
-    if name:
-        query += " AND name LIKE ?"
-        params.append(f"%{name}%")
-    if keywords:
-        keyword_list = keywords.split(",")
-        keyword_conditions = " OR ".join(["keywords LIKE ?" for _ in keyword_list])
-        query += f" AND ({keyword_conditions})"
-        params.extend([f"%{keyword.strip()}%" for keyword in keyword_list])
-
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-
-    conn.close()
-
-    return [
-        dict(zip([column[0] for column in cursor.description], row)) for row in results
-    ]
+    # 多个关键词以逗号分隔，任意一个匹配即可
+    keyword_list = [keyword.strip() for keyword in keywords.split(",")] if keywords else []
+    with search_reader(resolve_db_path(config, db), "trip_recommendations") as conn:
+        # 有 FTS5 全文索引时按相关度排序检索，否则退回到 LIKE 查询
+        query, params = build_search_query(
+            conn,
+            "trip_recommendations",
+            {"location": location, "name": name},
+            {"keywords": keyword_list},
+        )
+        results = fetch_dicts(conn, query, params)
+
+    return results
+
+
+@async_implementation(search_trip_recommendations)
+async def asearch_trip_recommendations(
+        location: Optional[str] = None,
+        name: Optional[str] = None,
+        keywords: Optional[str] = None,
+        *,
+        config: RunnableConfig,
+) -> List[dict]:
+    """search_trip_recommendations 的异步实现，在 graph.astream / ainvoke 中使用。"""
+    if hot_replica_covers(resolve_db_path(config, db), "trip_recommendations"):
+        # 表在内存热副本中，查询只需要几十微秒，直接在事件循环中执行同步实现
+        return search_trip_recommendations.func(location, name, keywords, config=config)
+    location = transform_location(location)
+    keyword_list = [keyword.strip() for keyword in keywords.split(",")] if keywords else []
+    pool = get_async_pool(resolve_db_path(config, db))
+    query, params = compose_search_query(
+        "trip_recommendations",
+        {"location": location, "name": name},
+        {"keywords": keyword_list},
+        use_fts="trip_recommendations" in await pool.fts_tables(),
+    )
+    async with pool.reader() as conn:
+        return await afetch_dicts(conn, query, params)
 
 
 @tool
-def book_excursion(recommendation_id: int) -> str:
+def book_excursion(recommendation_id: int, *, config: RunnableConfig) -> str:
     """
     通过推荐ID预订一次旅行项目。
 
@@ -64,24 +89,21 @@ def book_excursion(recommendation_id: int) -> str:
     返回:
         str: 表明旅行推荐是否成功预订的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    status = optimistic_update(resolve_db_path(config, db), "trip_recommendations", recommendation_id, set_booked(1))
+    return _message("book", recommendation_id, status)
 
-    cursor.execute(
-        "UPDATE trip_recommendations SET booked = 1 WHERE id = ?", (recommendation_id,)
-    )
-    conn.commit()
 
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"旅行推荐  {recommendation_id} 成功预定."
-    else:
-        conn.close()
-        return f"未找到与 ID 相关的旅行推荐信息。 {recommendation_id}."
+@async_implementation(book_excursion)
+async def abook_excursion(recommendation_id: int, *, config: RunnableConfig) -> str:
+    """book_excursion 的异步实现。"""
+    status = await aoptimistic_update(
+        resolve_db_path(config, db), "trip_recommendations", recommendation_id, set_booked(1)
+    )
+    return _message("book", recommendation_id, status)
 
 
 @tool
-def update_excursion(recommendation_id: int, details: str) -> str:
+def update_excursion(recommendation_id: int, details: str, *, config: RunnableConfig) -> str:
     """
     根据ID更新旅行推荐的详细信息。
 
@@ -92,25 +114,21 @@ def update_excursion(recommendation_id: int, details: str) -> str:
     返回:
         str: 表明旅行推荐是否成功更新的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    change = set_values(details=details)
+    status = optimistic_update(resolve_db_path(config, db), "trip_recommendations", recommendation_id, change)
+    return _message("update", recommendation_id, status)
 
-    cursor.execute(
-        "UPDATE trip_recommendations SET details = ? WHERE id = ?",
-        (details, recommendation_id),
-    )
-    conn.commit()
 
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"旅行推荐 {recommendation_id} 成功更新。"
-    else:
-        conn.close()
-        return f"未找到ID为 {recommendation_id} 的旅行推荐。"
+@async_implementation(update_excursion)
+async def aupdate_excursion(recommendation_id: int, details: str, *, config: RunnableConfig) -> str:
+    """update_excursion 的异步实现。"""
+    change = set_values(details=details)
+    status = await aoptimistic_update(resolve_db_path(config, db), "trip_recommendations", recommendation_id, change)
+    return _message("update", recommendation_id, status)
 
 
 @tool
-def cancel_excursion(recommendation_id: int) -> str:
+def cancel_excursion(recommendation_id: int, *, config: RunnableConfig) -> str:
     """
     根据ID取消旅行推荐。
 
@@ -120,18 +138,102 @@ def cancel_excursion(recommendation_id: int) -> str:
     返回:
         str: 表明旅行推荐是否成功取消的消息。
     """
-    conn = connect(db)
-    cursor = conn.cursor()
+    status = optimistic_update(resolve_db_path(config, db), "trip_recommendations", recommendation_id, set_booked(0))
+    return _message("cancel", recommendation_id, status)
+
 
-    # 将booked字段设置为0来表示取消预订
-    cursor.execute(
-        "UPDATE trip_recommendations SET booked = 0 WHERE id = ?", (recommendation_id,)
+@async_implementation(cancel_excursion)
+async def acancel_excursion(recommendation_id: int, *, config: RunnableConfig) -> str:
+    """cancel_excursion 的异步实现。"""
+    status = await aoptimistic_update(
+        resolve_db_path(config, db), "trip_recommendations", recommendation_id, set_booked(0)
     )
-    conn.commit()
-
-    if cursor.rowcount > 0:
-        conn.close()
-        return f"旅行推荐 {recommendation_id} 成功取消。"
-    else:
-        conn.close()
-        return f"未找到ID为 {recommendation_id} 的旅行推荐。"
+    return _message("cancel", recommendation_id, status)
+
+
+@tool
+def book_excursions(recommendation_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """
+    一次预订多个旅行项目，在同一个事务中完成。
+
+    参数:
+        recommendation_ids (list[int]): 要预订的旅行推荐的ID列表。
+
+    返回:
+        list[str]: 与 recommendation_ids 一一对应的结果消息。
+    """
+    db_path = resolve_db_path(config, db)
+    with get_pool(db_path).writer() as conn:
+        results = batch_update_by_id(conn, "trip_recommendations", recommendation_ids, set_booked(1))
+        apply_hot_delta(conn, db_path, "trip_recommendations", recommendation_ids)
+
+    return [_message("book", recommendation_id, results[recommendation_id]) for recommendation_id in recommendation_ids]
+
+
+@async_implementation(book_excursions)
+async def abook_excursions(recommendation_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """book_excursions 的异步实现。"""
+    db_path = resolve_db_path(config, db)
+    async with get_async_pool(db_path).writer() as conn:
+        results = await abatch_update_by_id(conn, "trip_recommendations", recommendation_ids, set_booked(1))
+        await aapply_hot_delta(conn, db_path, "trip_recommendations", recommendation_ids)
+
+    return [_message("book", recommendation_id, results[recommendation_id]) for recommendation_id in recommendation_ids]
+
+
+@tool
+def cancel_excursions(recommendation_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """
+    一次取消多个旅行推荐，在同一个事务中完成。
+
+    参数:
+        recommendation_ids (list[int]): 要取消的旅行推荐的ID列表。
+
+    返回:
+        list[str]: 与 recommendation_ids 一一对应的结果消息。
+    """
+    db_path = resolve_db_path(config, db)
+    with get_pool(db_path).writer() as conn:
+        results = batch_update_by_id(conn, "trip_recommendations", recommendation_ids, set_booked(0))
+        apply_hot_delta(conn, db_path, "trip_recommendations", recommendation_ids)
+
+    return [_message("cancel", recommendation_id, results[recommendation_id])
+            for recommendation_id in recommendation_ids]
+
+
+@async_implementation(cancel_excursions)
+async def acancel_excursions(recommendation_ids: list[int], *, config: RunnableConfig) -> list[str]:
+    """cancel_excursions 的异步实现。"""
+    db_path = resolve_db_path(config, db)
+    async with get_async_pool(db_path).writer() as conn:
+        results = await abatch_update_by_id(conn, "trip_recommendations", recommendation_ids, set_booked(0))
+        await aapply_hot_delta(conn, db_path, "trip_recommendations", recommendation_ids)
+
+    return [_message("cancel", recommendation_id, results[recommendation_id])
+            for recommendation_id in recommendation_ids]
+
+
+# 预订、更新、取消的结果消息，按 optimistic_update / batch_update_by_id 返回的结果选择
+_MESSAGES = {
+    "book": {
+        UPDATED: "旅行推荐  {id} 成功预定.",
+        REJECTED: "旅行推荐 {id} 已经被预订，不能重复预订。",
+        NOT_FOUND: "未找到与 ID 相关的旅行推荐信息。 {id}.",
+    },
+    "update": {
+        UPDATED: "旅行推荐 {id} 成功更新。",
+        REJECTED: "没有提供新的详细信息，旅行推荐 {id} 未作修改。",
+        NOT_FOUND: "未找到ID为 {id} 的旅行推荐。",
+    },
+    "cancel": {
+        UPDATED: "旅行推荐 {id} 成功取消。",
+        REJECTED: "旅行推荐 {id} 当前没有预订，无需取消。",
+        NOT_FOUND: "未找到ID为 {id} 的旅行推荐。",
+    },
+}
+
+
+def _message(action: str, recommendation_id: int, status: str) -> str:
+    if status == CONFLICT:
+        return f"旅行推荐 {recommendation_id} 正在被其他会话修改，请稍后重试。"
+    return _MESSAGES[action][status].format(id=recommendation_id)
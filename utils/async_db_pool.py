@@ -0,0 +1,178 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from utils.db_pool import DEFAULT_PRAGMAS, PoolStats
+from utils.query_builder import STATEMENT_CACHE_SIZE
+
+# 每个异步连接池最多打开的读连接数。aiosqlite 的每个连接都在自己的后台线程中执行 SQL，
+# 读连接数就是同一个数据库上可以并发执行的查询数，不会随会话数增长而耗尽线程
+DEFAULT_READERS = 8
+
+
+class AsyncSQLitePool:
+    """
+    基于 aiosqlite 的异步 SQLite 连接池，与 SQLitePool 的读写模型相同：
+    - 读：最多 size 个读连接，协程借用空闲的连接，全部被占用时排队等待，而不是阻塞事件循环。
+    - 写：全池只有一个写连接，由 asyncio.Lock 串行化，每次写入都在 BEGIN IMMEDIATE 事务中执行。
+    """
+
+    def __init__(self, db_path: str, size: int = DEFAULT_READERS, pragmas: dict = None):
+        self.db_path = db_path
+        self.size = size
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.stats = PoolStats()
+        self._idle = asyncio.Queue()
+        self._readers = []
+        self._create_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._writer = None
+        self._after_commit = []
+        self._fts_tables = None
+        self._closed = False
+
+    async def _connect(self, isolation_level: str | None = "") -> aiosqlite.Connection:
+        connection = aiosqlite.connect(
+            self.db_path,
+            isolation_level=isolation_level,
+            uri=self.db_path.startswith("file:"),
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        # 池中的连接通常一直存活到进程结束，把 aiosqlite 的后台线程设为守护线程，没有显式 close() 时也不会阻止进程退出
+        getattr(connection, "_thread", connection).daemon = True
+        conn = await connection
+        for name, value in self.pragmas.items():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        if "cache=shared" in self.db_path:
+            await conn.execute("PRAGMA read_uncommitted = 1")
+        return conn
+
+    @asynccontextmanager
+    async def reader(self):
+        """
+        借用一个读连接，退出上下文后归还给连接池。
+
+        返回:
+            aiosqlite.Connection: 读连接。
+        """
+        if self._closed:
+            raise RuntimeError(f"连接池已关闭: {self.db_path}")
+        conn = None
+        if self._idle.empty():
+            async with self._create_lock:
+                if len(self._readers) < self.size:
+                    self.stats.record("read_misses")
+                    conn = await self._connect()
+                    self._readers.append(conn)
+        if conn is None:
+            conn = await self._idle.get()
+            self.stats.record("read_hits")
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """
+        独占唯一的写连接，并在其上开启一个 BEGIN IMMEDIATE 事务。正常退出时提交事务并执行 after_commit 注册的回调，
+        发生异常时回滚。
+
+        返回:
+            aiosqlite.Connection: 写连接。
+        """
+        if self._closed:
+            raise RuntimeError(f"连接池已关闭: {self.db_path}")
+        start = time.perf_counter()
+        async with self._write_lock:
+            self.stats.record_wait(time.perf_counter() - start)
+            if self._writer is None:
+                self.stats.record("write_misses")
+                self._writer = await self._connect(isolation_level=None)
+            else:
+                self.stats.record("write_hits")
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                self._after_commit.clear()
+                await self._writer.rollback()
+                raise
+            callbacks, self._after_commit = self._after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback):
+        """与 SQLitePool.after_commit 相同：当前写事务提交成功后调用 callback，回滚时丢弃。只能在 writer() 的上下文中调用。"""
+        self._after_commit.append(callback)
+
+    async def fts_tables(self) -> set[str]:
+        """返回已经建好 FTS5 虚拟表的实体表名集合。结果在第一次查询后缓存，供 compose_search_query 使用。"""
+        if self._fts_tables is None:
+            async with self.reader() as conn:
+                async with conn.execute(
+                    "SELECT substr(name, 1, length(name) - 4) FROM sqlite_master "
+                    "WHERE type = 'table' AND name LIKE '%\\_fts' ESCAPE '\\'"
+                ) as cursor:
+                    self._fts_tables = {row[0] for row in await cursor.fetchall()}
+        return self._fts_tables
+
+    async def close(self):
+        """关闭池中所有的连接。"""
+        self._closed = True
+        async with self._write_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+        for conn in self._readers:
+            await conn.close()
+        self._readers.clear()
+
+
+# 事件循环 -> {数据库路径: 连接池}。asyncio 的锁、队列和 aiosqlite 的连接都只能在创建它们的事件循环中使用，
+# 因此每个事件循环有自己的一组连接池，事件循环被回收时对应的连接池也随之释放
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool(db_path: str) -> AsyncSQLitePool:
+    """
+    获取当前事件循环中指定数据库的异步连接池，同一个事件循环中同一个文件只会创建一个池。必须在协程中调用。
+
+    参数:
+        db_path (str): 数据库文件路径。
+
+    返回:
+        AsyncSQLitePool: 该数据库的异步连接池。
+    """
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get(db_path)
+    if pool is None:
+        pool = AsyncSQLitePool(db_path)
+        pools[db_path] = pool
+    return pool
+
+
+def close_async_pools(db_path: str):
+    """
+    从所有事件循环中移除并关闭指定数据库的异步连接池，下次 get_async_pool 时会重新创建。
+    可以在同步代码中调用（例如 update_dates 重置数据库之前），关闭操作会被调度到各自的事件循环中执行。
+
+    参数:
+        db_path (str): 数据库文件路径。
+    """
+    for loop, pools in list(_pools.items()):
+        pool = pools.pop(db_path, None)
+        if pool is None or loop.is_closed():
+            continue
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is running:
+            loop.create_task(pool.close())
+        else:
+            asyncio.run_coroutine_threadsafe(pool.close(), loop)
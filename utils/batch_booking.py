@@ -0,0 +1,70 @@
+import sqlite3
+
+import aiosqlite
+
+from utils.optimistic import NOT_FOUND, REJECTED, UPDATED, VERSION_COLUMN, update_statement
+from utils.query_builder import afetch_dicts, fetch_dicts
+
+
+def _select_statement(table: str, ids: list[int]) -> str:
+    placeholders = ", ".join("?" for _ in ids)
+    return f"SELECT * FROM {table} WHERE id IN ({placeholders})"
+
+
+def _plan_batch_update(ids: list[int], rows: list[dict], change) -> tuple[dict, dict]:
+    """
+    根据当前行逐个决定每个ID的结果，并把要执行的更新按修改的列分组（每组是同一条 UPDATE 语句的多组参数）。
+
+    返回:
+        tuple[dict, dict]: (ID -> UPDATED/NOT_FOUND/REJECTED, 修改的列 -> 参数列表)。
+    """
+    current = {row["id"]: row for row in rows}
+    results, groups = {}, {}
+    # 同一个ID出现多次时只更新一次，结果相同
+    for row_id in dict.fromkeys(ids):
+        row = current.get(row_id)
+        if row is None:
+            results[row_id] = NOT_FOUND
+            continue
+        values = change(row)
+        if values is None:
+            results[row_id] = REJECTED
+            continue
+        groups.setdefault(tuple(values), []).append((*values.values(), row_id, row[VERSION_COLUMN]))
+        results[row_id] = UPDATED
+    return results, groups
+
+
+def batch_update_by_id(conn: sqlite3.Connection, table: str, ids: list[int], change) -> dict:
+    """
+    在同一个事务中修改一批ID：先读出这些行，由 change 决定每一行要写入的值（与 optimistic_update 的 change 相同），
+    再用 executemany 执行合并后的 UPDATE，语句只准备一次。写事务是 BEGIN IMMEDIATE，读出的行在提交前不会被其它会话修改，
+    不需要重试；UPDATE 同样会把版本号加一，单个预订工具中读出旧版本号的并发修改会因此重试。
+
+    参数:
+        conn (sqlite3.Connection): 写连接，调用方负责事务（通常是连接池的 writer()）。
+        table (str): 表名，表中需要有 id 列和 version 列。
+        ids (list[int]): 要修改的ID列表。
+        change: 函数，接收当前行的字典，返回列名 -> 新值的字典；当前状态不允许修改时返回 None。
+
+    返回:
+        dict: ID -> UPDATED、NOT_FOUND 或 REJECTED，调用方据此生成每个ID的结果。
+    """
+    if not ids:
+        return {}
+    rows = fetch_dicts(conn, _select_statement(table, ids), list(ids))
+    results, groups = _plan_batch_update(ids, rows, change)
+    for columns, params in groups.items():
+        conn.executemany(update_statement(table, columns), params)
+    return results
+
+
+async def abatch_update_by_id(conn: aiosqlite.Connection, table: str, ids: list[int], change) -> dict:
+    """batch_update_by_id 的异步版本，conn 为 AsyncSQLitePool.writer() 借出的连接。"""
+    if not ids:
+        return {}
+    rows = await afetch_dicts(conn, _select_statement(table, ids), list(ids))
+    results, groups = _plan_batch_update(ids, rows, change)
+    for columns, params in groups.items():
+        await conn.executemany(update_statement(table, columns), params)
+    return results
@@ -0,0 +1,157 @@
+import os
+import re
+import threading
+
+import numpy as np
+
+from utils.db_pool import get_pool
+from utils.query_builder import fetch_dicts
+
+# 向量数据文件每次扩容的最少行数，避免每写入几个向量就改一次文件大小
+GROW_ROWS = 4096
+# 一条 IN 查询最多的参数个数（SQLite 默认上限为 999）
+_MAX_PARAMS = 900
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, slot INTEGER NOT NULL) WITHOUT ROWID",
+]
+
+
+class ChunkEmbeddingCache:
+    """
+    按内容哈希寻址的向量缓存，可以被多个进程同时使用。每个嵌入模型一个子目录：
+    - index.sqlite：内容哈希 -> 向量在数据文件中的行号，以及向量维度和下一个空闲行号；
+    - vectors.f32：所有向量依次存放的 float32 文件，读取时内存映射，不需要把向量读入内存。
+    写入在索引库的 BEGIN IMMEDIATE 事务中进行：先分配行号、写入并刷新向量数据，再插入哈希并提交。
+    SQLite 的写锁保证同一时刻只有一个进程（线程）在分配行号；提交之前其它读者看不到新的哈希，
+    写到一半中断时数据文件中多出的行没有被索引引用，下次写入时会被覆盖。
+    同一段文本（例如不同 PDF 中相同的段落）只保存一个向量。
+    """
+
+    def __init__(self, directory: str, model: str):
+        """
+        参数:
+            directory (str): 缓存的根目录。
+            model (str): 嵌入模型名，不同模型的向量保存在不同的子目录中。
+        """
+        self.directory = os.path.join(directory, re.sub(r'[^\w.-]+', '_', model))
+        os.makedirs(self.directory, exist_ok=True)
+        self.model = model
+        self.index_path = os.path.join(self.directory, "index.sqlite")
+        self.data_path = os.path.join(self.directory, "vectors.f32")
+        with get_pool(self.index_path).writer() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        self._map = None
+        self._map_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _meta(self, conn, key: str):
+        rows = fetch_dicts(conn, "SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    def _view(self, dim: int, rows: int) -> np.ndarray:
+        """返回至少包含 rows 行的只读内存映射。数据文件被其它进程扩容后重新映射，已经返回的旧映射仍然有效。"""
+        with self._map_lock:
+            if self._map is None or self._map.shape[1] != dim or len(self._map) < rows:
+                total = os.path.getsize(self.data_path) // (dim * 4)
+                self._map = np.memmap(self.data_path, dtype=np.float32, mode="r", shape=(total, dim))
+            return self._map
+
+    def get_many(self, hashes: list[str]) -> dict:
+        """
+        读取缓存的向量。
+
+        参数:
+            hashes (list[str]): 内容哈希列表。
+
+        返回:
+            dict: 内容哈希 -> 向量（内存映射的只读 float32 数组），缓存中没有的哈希不在其中。
+        """
+        unique = list(dict.fromkeys(hashes))
+        slots = {}
+        with get_pool(self.index_path).reader() as conn:
+            dim = self._meta(conn, "dim")
+            if dim is not None:
+                for start in range(0, len(unique), _MAX_PARAMS):
+                    batch = unique[start:start + _MAX_PARAMS]
+                    slots.update((row["hash"], row["slot"]) for row in fetch_dicts(
+                        conn, f"SELECT hash, slot FROM vectors WHERE hash IN ({', '.join('?' for _ in batch)})", batch
+                    ))
+        with self._stats_lock:
+            self.hits += len(slots)
+            self.misses += len(unique) - len(slots)
+        if not slots:
+            return {}
+        view = self._view(dim, max(slots.values()) + 1)
+        return {key: view[slot] for key, slot in slots.items()}
+
+    def put_many(self, vectors: dict):
+        """
+        写入向量，已经存在的哈希跳过（其它进程可能刚刚写入了同一段文本的向量）。
+
+        参数:
+            vectors (dict): 内容哈希 -> 向量。
+        """
+        if not vectors:
+            return
+        with get_pool(self.index_path).writer() as conn:
+            existing = set()
+            keys = list(vectors)
+            for start in range(0, len(keys), _MAX_PARAMS):
+                batch = keys[start:start + _MAX_PARAMS]
+                existing.update(row["hash"] for row in fetch_dicts(
+                    conn, f"SELECT hash FROM vectors WHERE hash IN ({', '.join('?' for _ in batch)})", batch
+                ))
+            new = [key for key in keys if key not in existing]
+            if not new:
+                return
+            matrix = np.asarray([vectors[key] for key in new], dtype=np.float32)
+            dim = self._meta(conn, "dim")
+            if dim is None:
+                dim = matrix.shape[1]
+                conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (dim,))
+            elif matrix.shape[1] != dim:
+                raise ValueError(f"向量维度 {matrix.shape[1]} 与缓存中的维度 {dim} 不一致（模型: {self.model}）")
+            slot = self._meta(conn, "next_slot") or 0
+            needed = (slot + len(new)) * dim * 4
+            with open(self.data_path, "ab") as f:
+                if f.tell() < needed:
+                    f.truncate(max(needed, (slot + max(len(new), GROW_ROWS)) * dim * 4))
+            data = np.memmap(self.data_path, dtype=np.float32, mode="r+", offset=slot * dim * 4, shape=matrix.shape)
+            data[:] = matrix
+            data.flush()
+            del data
+            conn.executemany(
+                "INSERT INTO vectors (hash, slot) VALUES (?, ?)", [(key, slot + i) for i, key in enumerate(new)]
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('next_slot', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (slot + len(new),),
+            )
+        with self._stats_lock:
+            self.writes += len(new)
+
+    def stats(self) -> dict:
+        """
+        返回本进程中的命中统计，以及缓存中的向量总数。
+
+        返回:
+            dict: 命中次数、未命中次数、命中率、写入的向量数和缓存中的向量总数。
+        """
+        with get_pool(self.index_path).reader() as conn:
+            size = fetch_dicts(conn, "SELECT COUNT(*) AS n FROM vectors")[0]["n"]
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "size": size,
+            }
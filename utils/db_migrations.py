@@ -0,0 +1,251 @@
+import sqlite3
+import sys
+
+from tools.flights_tools import (
+    _CANCEL_TICKET_SQL, _TICKET_EXISTS_SQL, _UPDATE_TICKET_FAILURE_SQL, _UPDATE_TICKET_SQL, _USER_FLIGHTS_QUERY,
+    _flights_query,
+)
+from utils.fts import create_fts_indexes
+from utils.optimistic import add_version_columns
+
+# 数据库的迁移步骤，按版本号递增排列。每个步骤是一组 SQL 语句，或者接收连接作为参数的函数。当前已应用到的版本号记录在 PRAGMA user_version 中，
+# 每次 migrate 只执行版本号大于它的步骤。
+# 注意：update_dates 会用备份文件覆盖数据库并以 to_sql(if_exists="replace") 重建所有表，
+# 这会同时清掉索引并把 user_version 恢复成备份文件中的值，所以每次 update_dates 之后都要重新执行 migrate。
+MIGRATIONS = [
+    (
+        1,
+        "航班检索、乘客机票联表以及按ID读写的索引",
+        [
+            # search_flights：出发机场 + 到达机场 + 起飞时间范围
+            "CREATE INDEX IF NOT EXISTS idx_flights_route_departure "
+            "ON flights (departure_airport, arrival_airport, scheduled_departure)",
+            # search_flights：只给出出发机场、只给出到达机场或只给出时间范围
+            "CREATE INDEX IF NOT EXISTS idx_flights_departure_airport_time "
+            "ON flights (departure_airport, scheduled_departure)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_arrival_departure "
+            "ON flights (arrival_airport, scheduled_departure)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_departure ON flights (scheduled_departure)",
+            # fetch_user_flight_information 和 update_ticket_to_new_flight 中按 flight_id 取航班的覆盖索引
+            "CREATE INDEX IF NOT EXISTS idx_flights_id_cover "
+            "ON flights (flight_id, flight_no, departure_airport, arrival_airport, "
+            "scheduled_departure, scheduled_arrival)",
+            # 按乘客查机票，以及校验机票归属
+            "CREATE INDEX IF NOT EXISTS idx_tickets_passenger ON tickets (passenger_id, ticket_no, book_ref)",
+            "CREATE INDEX IF NOT EXISTS idx_tickets_ticket_no ON tickets (ticket_no, passenger_id)",
+            "CREATE INDEX IF NOT EXISTS idx_ticket_flights_ticket "
+            "ON ticket_flights (ticket_no, flight_id, fare_conditions)",
+            "CREATE INDEX IF NOT EXISTS idx_boarding_passes_ticket_flight "
+            "ON boarding_passes (ticket_no, flight_id, seat_no)",
+            # 酒店、租车、游览的预订/更新/取消都是按 id 更新
+            "CREATE INDEX IF NOT EXISTS idx_hotels_id ON hotels (id)",
+            "CREATE INDEX IF NOT EXISTS idx_car_rentals_id ON car_rentals (id)",
+            "CREATE INDEX IF NOT EXISTS idx_trip_recommendations_id ON trip_recommendations (id)",
+            # 让查询规划器拿到新索引的统计信息
+            "ANALYZE",
+        ],
+    ),
+    (
+        2,
+        "酒店、租车、游览的 FTS5 全文索引及同步触发器",
+        [create_fts_indexes],
+    ),
+    (
+        3,
+        "航班索引末尾追加 flight_id，支持按 (scheduled_departure, flight_id) 排序的键集分页",
+        [
+            "DROP INDEX IF EXISTS idx_flights_route_departure",
+            "DROP INDEX IF EXISTS idx_flights_departure_airport_time",
+            "DROP INDEX IF EXISTS idx_flights_arrival_departure",
+            "DROP INDEX IF EXISTS idx_flights_departure",
+            "CREATE INDEX IF NOT EXISTS idx_flights_route_departure_id "
+            "ON flights (departure_airport, arrival_airport, scheduled_departure, flight_id)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_departure_airport_time_id "
+            "ON flights (departure_airport, scheduled_departure, flight_id)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_arrival_departure_id "
+            "ON flights (arrival_airport, scheduled_departure, flight_id)",
+            "CREATE INDEX IF NOT EXISTS idx_flights_departure_id ON flights (scheduled_departure, flight_id)",
+            "ANALYZE",
+        ],
+    ),
+    (
+        4,
+        "酒店、租车、游览增加 version 列，预订/更新/取消按版本号做乐观并发控制",
+        [add_version_columns],
+    ),
+]
+
+# 所有工具中执行的查询（按不同的参数组合展开），用于 explain_tool_queries 检查执行计划。
+# 航班和机票的查询直接引用 tools.flights_tools 中的语句（或生成语句的函数），检查的就是工具实际执行的 SQL。
+# 参数只用于生成执行计划，取值不影响结果。
+TOOL_QUERIES = [
+    ("fetch_user_flight_information", _USER_FLIGHTS_QUERY, ("3442 587242",)),
+    ("search_flights(departure, arrival, start, end)", *_flights_query("CDG", "BSL", "2024-05-01", "2024-05-02", limit=20)),
+    ("search_flights(departure, arrival)", *_flights_query("CDG", "BSL", limit=20)),
+    ("search_flights(departure, start, end)", *_flights_query("CDG", None, "2024-05-01", "2024-05-02", limit=20)),
+    ("search_flights(arrival, start, end)", *_flights_query(None, "BSL", "2024-05-01", "2024-05-02", limit=20)),
+    ("search_flights(start, end)", *_flights_query(None, None, "2024-05-01", "2024-05-02", limit=20)),
+    (
+        "search_flights_page(departure, arrival, 翻页)",
+        *_flights_query("CDG", "BSL", after=("2024-05-01 10:00:00.000000+02:00", 1), limit=21),
+    ),
+    (
+        "update_ticket_to_new_flight: 校验并改签",
+        _UPDATE_TICKET_SQL,
+        {"ticket_no": "7240005432906569", "new_flight_id": 1, "passenger_id": "3442 587242"},
+    ),
+    (
+        "update_ticket_to_new_flight: 改签失败的原因",
+        _UPDATE_TICKET_FAILURE_SQL,
+        {"ticket_no": "7240005432906569", "new_flight_id": 1},
+    ),
+    (
+        "cancel_ticket: 校验并删除",
+        _CANCEL_TICKET_SQL,
+        {"ticket_no": "7240005432906569", "passenger_id": "3442 587242"},
+    ),
+    ("cancel_ticket: 机票存在性", _TICKET_EXISTS_SQL, {"ticket_no": "7240005432906569"}),
+    ("book_hotel / update_hotel / cancel_hotel: 读取当前行", "SELECT * FROM hotels WHERE id = ?", (1,)),
+    (
+        "book_hotel / cancel_hotel: 比较版本号并更新",
+        "UPDATE hotels SET booked = ?, version = version + 1 WHERE id = ? AND version = ?",
+        (1, 1, 0),
+    ),
+    (
+        "update_hotel: 比较版本号并更新",
+        "UPDATE hotels SET checkin_date = ?, checkout_date = ?, version = version + 1 WHERE id = ? AND version = ?",
+        ("2024-05-01", "2024-05-03", 1, 0),
+    ),
+    (
+        "book_car_rental / update_car_rental / cancel_car_rental: 读取当前行",
+        "SELECT * FROM car_rentals WHERE id = ?",
+        (1,),
+    ),
+    (
+        "book_car_rental / cancel_car_rental: 比较版本号并更新",
+        "UPDATE car_rentals SET booked = ?, version = version + 1 WHERE id = ? AND version = ?",
+        (1, 1, 0),
+    ),
+    (
+        "update_car_rental: 比较版本号并更新",
+        "UPDATE car_rentals SET start_date = ?, end_date = ?, version = version + 1 WHERE id = ? AND version = ?",
+        ("2024-05-01", "2024-05-03", 1, 0),
+    ),
+    (
+        "book_excursion / update_excursion / cancel_excursion: 读取当前行",
+        "SELECT * FROM trip_recommendations WHERE id = ?",
+        (1,),
+    ),
+    (
+        "book_excursion / cancel_excursion: 比较版本号并更新",
+        "UPDATE trip_recommendations SET booked = ?, version = version + 1 WHERE id = ? AND version = ?",
+        (1, 1, 0),
+    ),
+    (
+        "update_excursion: 比较版本号并更新",
+        "UPDATE trip_recommendations SET details = ?, version = version + 1 WHERE id = ? AND version = ?",
+        ("", 1, 0),
+    ),
+    (
+        "search_hotels(location, name)",
+        "SELECT hotels.* FROM hotels_fts JOIN hotels ON hotels.rowid = hotels_fts.rowid "
+        "WHERE hotels_fts MATCH ? ORDER BY bm25(hotels_fts)",
+        ('location : ("Basel"*) AND name : ("Hilton"*)',),
+    ),
+    (
+        "search_car_rentals(location, name)",
+        "SELECT car_rentals.* FROM car_rentals_fts JOIN car_rentals ON car_rentals.rowid = car_rentals_fts.rowid "
+        "WHERE car_rentals_fts MATCH ? ORDER BY bm25(car_rentals_fts)",
+        ('location : ("Basel"*) AND name : ("Europcar"*)',),
+    ),
+    (
+        "search_trip_recommendations(location, name, keywords)",
+        "SELECT trip_recommendations.* FROM trip_recommendations_fts "
+        "JOIN trip_recommendations ON trip_recommendations.rowid = trip_recommendations_fts.rowid "
+        "WHERE trip_recommendations_fts MATCH ? ORDER BY bm25(trip_recommendations_fts)",
+        ('location : ("Basel"*) AND name : ("Museum"*) AND keywords : ("art"* OR "history"*)',),
+    ),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """返回数据库当前的迁移版本号。"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    依次执行所有尚未应用的迁移步骤，每个步骤在单独的事务中执行并更新 user_version。
+
+    参数:
+        conn (sqlite3.Connection): 要迁移的数据库连接。
+
+    返回:
+        int: 迁移完成后的版本号。
+    """
+    current = schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"应用数据库迁移 v{version}: {description}")
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            # PRAGMA 不支持参数绑定，version 来自上面的常量列表
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+
+def explain_tool_queries(conn: sqlite3.Connection) -> list[str]:
+    """
+    打印每个工具查询的 EXPLAIN QUERY PLAN，并找出其中仍然需要全表扫描的查询。
+
+    参数:
+        conn (sqlite3.Connection): 数据库连接。
+
+    返回:
+        list[str]: 存在全表扫描的查询名称列表，为空表示所有查询都用上了索引。
+    """
+    full_scans = []
+    for name, sql, params in TOOL_QUERIES:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        print(f"\n[{name}]\n  {' '.join(sql.split())}")
+        scanned = False
+        for _, _, _, detail in plan:
+            print(f"    {detail}")
+            # SQLite 3.36 之前输出 "SCAN TABLE x"，之后输出 "SCAN x"；走索引的是 "SEARCH x USING ..."。
+            # "SCAN x USING COVERING INDEX" 虽然不回表，但仍然要读完整个索引，同样算作全表扫描。
+            # FTS5 虚拟表的 MATCH 查询显示为 "SCAN x_fts VIRTUAL TABLE INDEX 0:M..."，实际走的是倒排索引
+            if (
+                    detail.startswith("SCAN")
+                    and detail != "SCAN CONSTANT ROW"
+                    and "VIRTUAL TABLE INDEX 0:M" not in detail
+            ):
+                scanned = True
+        if scanned:
+            full_scans.append(name)
+
+    if full_scans:
+        print("\n以下查询仍然存在全表扫描:")
+        for name in full_scans:
+            print(f"  - {name}")
+    else:
+        print("\n所有工具查询都使用了索引，没有全表扫描。")
+    return full_scans
+
+
+if __name__ == '__main__':
+    # 用法: python -m utils.db_migrations [数据库文件路径]
+    db_file = sys.argv[1] if len(sys.argv) > 1 else "../travel_new.sqlite"
+    connection = sqlite3.connect(db_file)
+    print(f"当前版本: v{schema_version(connection)}，迁移后版本: v{migrate(connection)}")
+    explain_tool_queries(connection)
+    connection.close()
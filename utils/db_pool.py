@@ -0,0 +1,248 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.query_builder import Connection, STATEMENT_CACHE_SIZE
+
+# 每个连接打开后都会执行的 PRAGMA：
+# - journal_mode=WAL：读写互不阻塞，读连接可以和唯一的写连接并发
+# - synchronous=NORMAL：WAL 模式下只在检查点时 fsync，写事务的提交延迟大幅降低
+# - mmap_size：通过内存映射读取数据库文件，省掉 read() 系统调用和一次内存拷贝
+# - cache_size：负数表示以 KiB 为单位，这里给每个连接 64MB 的页缓存
+# - busy_timeout：遇到锁时最多等待的毫秒数，而不是立即报 database is locked
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+
+class PoolStats:
+    """连接池的统计信息：命中/未命中次数，以及等待写锁的耗时。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.read_hits = 0  # 读操作复用了当前线程已有的连接
+        self.read_misses = 0  # 读操作需要为当前线程新建连接
+        self.write_hits = 0  # 写操作复用了已打开的写连接
+        self.write_misses = 0  # 写操作需要新建写连接
+        self.write_waits = 0  # 获取写锁的次数
+        self.write_wait_total = 0.0  # 等待写锁的累计耗时（秒）
+        self.write_wait_max = 0.0  # 单次等待写锁的最大耗时（秒）
+
+    def record(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.write_waits += 1
+            self.write_wait_total += seconds
+            self.write_wait_max = max(self.write_wait_max, seconds)
+
+    def snapshot(self) -> dict:
+        """
+        返回当前统计信息的字典副本。
+
+        返回:
+            dict: 包含命中率和写锁等待时间（毫秒）的统计信息。
+        """
+        with self._lock:
+            reads = self.read_hits + self.read_misses
+            writes = self.write_hits + self.write_misses
+            return {
+                "read_hits": self.read_hits,
+                "read_misses": self.read_misses,
+                "read_hit_rate": self.read_hits / reads if reads else 0.0,
+                "write_hits": self.write_hits,
+                "write_misses": self.write_misses,
+                "write_hit_rate": self.write_hits / writes if writes else 0.0,
+                "write_wait_avg_ms": self.write_wait_total / self.write_waits * 1000 if self.write_waits else 0.0,
+                "write_wait_max_ms": self.write_wait_max * 1000,
+            }
+
+
+class SQLitePool:
+    """
+    线程安全的 SQLite 连接池。
+    - 读：每个线程持有一个自己的读连接（sqlite3 连接默认不能跨线程使用），第一次使用时创建，之后一直复用。
+    - 写：全池只有一个写连接，由一把锁串行化，避免多个写事务互相抢锁导致 database is locked。
+    """
+
+    def __init__(self, db_path: str, pragmas: dict = None):
+        self.db_path = db_path
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.stats = PoolStats()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._after_commit = []  # 当前写事务提交成功后要执行的回调，只由持有写锁的线程访问
+        # 记录所有线程创建的读连接，便于 close() 时统一关闭
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self, check_same_thread: bool = True, isolation_level: str | None = "") -> sqlite3.Connection:
+        # "file:" 开头的是 URI 形式的路径，例如内存快照 file:xxx?mode=memory&cache=shared
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=check_same_thread,
+            isolation_level=isolation_level,
+            uri=self.db_path.startswith("file:"),
+            factory=Connection,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if "cache=shared" in self.db_path:
+            # 共享缓存模式下表级锁不受 busy_timeout 控制，读连接不加读锁，避免写连接持锁时读操作直接报 table is locked
+            conn.execute("PRAGMA read_uncommitted = 1")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        借用当前线程的读连接。连接在退出上下文后不会关闭，而是留给该线程下一次使用。
+
+        返回:
+            sqlite3.Connection: 当前线程的读连接。
+        """
+        if self._closed:
+            raise RuntimeError(f"连接池已关闭: {self.db_path}")
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.stats.record("read_misses")
+            conn = self._connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        else:
+            self.stats.record("read_hits")
+        yield conn
+
+    @contextmanager
+    def writer(self):
+        """
+        独占唯一的写连接，并在其上开启一个 BEGIN IMMEDIATE 事务。正常退出时提交事务并执行 after_commit 注册的回调，
+        发生异常时回滚。IMMEDIATE 事务一开始就拿到写锁，事务内先读后写的校验不会被其它进程的写入插进来，
+        也不会出现延迟事务在读锁升级为写锁时直接报 database is locked 的情况。
+
+        返回:
+            sqlite3.Connection: 写连接。
+        """
+        if self._closed:
+            raise RuntimeError(f"连接池已关闭: {self.db_path}")
+        start = time.perf_counter()
+        with self._write_lock:
+            self.stats.record_wait(time.perf_counter() - start)
+            if self._writer is None:
+                self.stats.record("write_misses")
+                # 写连接会被不同线程轮流使用，由 _write_lock 保证同一时刻只有一个线程在用；
+                # isolation_level=None 关闭 sqlite3 模块的隐式事务，由下面显式地 BEGIN IMMEDIATE
+                self._writer = self._connect(check_same_thread=False, isolation_level=None)
+            else:
+                self.stats.record("write_hits")
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._after_commit.clear()
+                self._writer.rollback()
+                raise
+            # 提交之后、释放写锁之前执行，回调的顺序与事务提交的顺序一致
+            callbacks, self._after_commit = self._after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback):
+        """
+        在当前写事务提交成功后调用 callback（不带参数），事务回滚时丢弃。只能在 writer() 的上下文中调用。
+        用于把事务中的改动同步到进程内的其它副本，保证副本中不会出现没有提交的数据。
+
+        参数:
+            callback: 无参数的函数。
+        """
+        self._after_commit.append(callback)
+
+    def close(self):
+        """关闭池中所有的连接。用于重置数据库文件之前，确保没有连接还指向旧文件。"""
+        self._closed = True
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    # 其它线程创建的连接不能在当前线程关闭，交给垃圾回收处理
+                    pass
+            self._readers.clear()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> SQLitePool:
+    """
+    获取指定数据库文件对应的连接池，同一个文件在进程内只会创建一个池。
+
+    参数:
+        db_path (str): 数据库文件路径。
+
+    返回:
+        SQLitePool: 该数据库的连接池。
+    """
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = SQLitePool(db_path)
+            _pools[db_path] = pool
+        return pool
+
+
+def close_pool(db_path: str):
+    """
+    关闭并移除指定数据库的连接池，下次 get_pool 时会重新创建。
+
+    参数:
+        db_path (str): 数据库文件路径。
+    """
+    with _pools_lock:
+        pool = _pools.pop(db_path, None)
+    if pool is not None:
+        pool.close()
+
+
+def resolve_db_path(config: dict, default: str) -> str:
+    """
+    从 RunnableConfig 中取出当前会话使用的数据库路径（configurable.db_path），没有配置时使用默认路径。
+    每个会话/压测进程可以通过它指向自己独立的数据库快照，参见 utils.db_snapshot。
+
+    参数:
+        config (dict): 工具调用时注入的 RunnableConfig。
+        default (str): 默认的数据库路径。
+
+    返回:
+        str: 数据库路径。
+    """
+    return (config or {}).get("configurable", {}).get("db_path") or default
+
+
+def pool_stats() -> dict:
+    """
+    返回所有连接池的统计信息。
+
+    返回:
+        dict: 以数据库路径为键、统计信息字典为值。
+    """
+    with _pools_lock:
+        pools = dict(_pools)
+    return {path: pool.stats.snapshot() for path, pool in pools.items()}
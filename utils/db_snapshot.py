@@ -0,0 +1,193 @@
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # 只有 Unix 上有 fcntl，其它平台上克隆时直接复制文件
+    fcntl = None
+
+from utils.async_db_pool import close_async_pools
+from utils.db_migrations import MIGRATIONS, schema_version
+from utils.db_pool import close_pool
+from utils.hot_replica import close_hot_replica
+from utils.init_db import update_dates
+
+# 已经完成日期对齐和索引迁移的模板库，所有快照都从它克隆，只在过期时重建一次
+template_file = "../travel_template.sqlite"
+# 文件快照的存放目录
+snapshot_dir = "../snapshots"
+# 模板库的有效期（秒）。模板中的日期是按建库时刻对齐的，过期后重建，保证航班时间仍然是"最近"的时间
+TEMPLATE_MAX_AGE = 6 * 3600
+
+# Linux 上 FICLONE ioctl 的请求码，btrfs/xfs 等支持 reflink 的文件系统可以用它做写时复制的克隆
+_FICLONE = 0x40049409
+# 构建模板时持有的锁文件，以及等待锁的轮询间隔（秒）
+_TEMPLATE_LOCK = template_file + ".building"
+_LOCK_POLL_INTERVAL = 0.2
+# 锁文件超过这个时间（秒）没有释放时，认为持有它的进程已经异常退出，删除后重新竞争
+_LOCK_STALE_AFTER = 600
+
+
+@contextmanager
+def _file_lock(path: str, stale_after: float = _LOCK_STALE_AFTER):
+    """
+    跨平台的进程间互斥锁：用 O_CREAT | O_EXCL 创建锁文件，创建成功的进程持有锁，退出时删除锁文件；
+    其它进程轮询等待。持有锁的进程崩溃后留下的锁文件在 stale_after 秒后被视为失效。
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.remove(path)
+                    continue
+            except OSError:
+                # 锁文件刚好被释放或被其它进程删除，重新尝试
+                continue
+            time.sleep(_LOCK_POLL_INTERVAL)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def build_template(max_age: float = TEMPLATE_MAX_AGE) -> str:
+    """
+    构建（或复用）模板库：从备份库复制、对齐日期并建好索引。多个进程同时调用时只有一个进程真正构建，其余进程等待并复用结果。
+
+    参数:
+        max_age (float): 模板的有效期（秒），超过后重建。
+
+    返回:
+        str: 模板库的文件路径。
+    """
+    with _file_lock(_TEMPLATE_LOCK):
+        if (
+                os.path.exists(template_file)
+                and time.time() - os.path.getmtime(template_file) < max_age
+                and _template_schema_version() == MIGRATIONS[-1][0]
+        ):
+            return template_file
+        # 先在临时文件中构建，完成后原子替换，避免其它进程读到一半的模板
+        building_file = f"{template_file}.{os.getpid()}.tmp"
+        update_dates(mode="sql", db_file=building_file)
+        # 关掉 WAL，让模板成为一个自包含的单文件，克隆时不需要带上 -wal
+        conn = sqlite3.connect(building_file)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        os.replace(building_file, template_file)
+        return template_file
+
+
+def _template_schema_version() -> int:
+    """模板库的迁移版本号。新增迁移之后，按旧的表结构建好的模板即使没有过期也要重建。"""
+    conn = sqlite3.connect(template_file)
+    try:
+        return schema_version(conn)
+    finally:
+        conn.close()
+
+
+def clone_file(source: str, target: str) -> str:
+    """
+    克隆数据库文件。优先使用 reflink（写时复制，瞬间完成且不占用额外空间），文件系统或平台不支持时退回到普通复制。
+    这里不使用硬链接：SQLite 在检查点时会把 WAL 中的修改写回主文件，硬链接会让所有快照共享同一份被修改的数据。
+
+    参数:
+        source (str): 源文件路径。
+        target (str): 目标文件路径。
+
+    返回:
+        str: 实际使用的克隆方式，"reflink" 或 "copy"。
+    """
+    if fcntl is not None:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                pass
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+class DatabaseSnapshot:
+    """
+    一个会话/压测进程独享的数据库快照。把 path 放到 RunnableConfig 的 configurable.db_path 中，
+    所有预订工具就会读写这份快照，而不会影响其它会话。
+    """
+
+    def __init__(self, path: str, keeper: sqlite3.Connection = None):
+        self.path = path
+        # 内存快照需要至少保持一个连接不关闭，否则最后一个连接关闭时内存数据库就被销毁了
+        self._keeper = keeper
+
+    def config(self, **configurable) -> dict:
+        """
+        生成指向该快照的 RunnableConfig。
+
+        参数:
+            configurable: 其它 configurable 字段，例如 passenger_id、thread_id。
+
+        返回:
+            dict: 可以直接传给 graph.stream / tool.invoke 的配置。
+        """
+        return {"configurable": {**configurable, "db_path": self.path}}
+
+    def close(self):
+        """关闭快照的连接池，并删除快照文件（或释放内存数据库）。"""
+        close_pool(self.path)
+        close_async_pools(self.path)
+        close_hot_replica(self.path)
+        if self._keeper is not None:
+            self._keeper.close()
+            self._keeper = None
+        else:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def create_snapshot(name: str = None, in_memory: bool = False) -> DatabaseSnapshot:
+    """
+    基于模板库创建一个独立的数据库快照。
+
+    参数:
+        name (str): 快照名称，通常是会话ID或压测 worker 的编号。默认随机生成。
+        in_memory (bool): 为 True 时用 SQLite 的 backup API 把模板复制到共享缓存的内存数据库中，
+            适合单元测试这类短生命周期、数据量不大的场景；否则克隆出一个独立的文件。
+
+    返回:
+        DatabaseSnapshot: 快照对象。
+    """
+    name = name or uuid.uuid4().hex
+    template = build_template()
+    if in_memory:
+        path = f"file:travel_snapshot_{name}?mode=memory&cache=shared"
+        keeper = sqlite3.connect(path, uri=True, check_same_thread=False)
+        source = sqlite3.connect(template)
+        source.backup(keeper)
+        source.close()
+        return DatabaseSnapshot(path, keeper)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, f"travel_{name}.sqlite")
+    clone_file(template, path)
+    return DatabaseSnapshot(path)
@@ -0,0 +1,167 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.chunk_embedding_cache import ChunkEmbeddingCache
+from utils.embedding_store import content_hash
+from utils.ttl_cache import TTLCache
+
+# 嵌入接口的请求配额（次/秒）。原来每次请求后固定 sleep 0.65 秒，加上请求本身的耗时，实际远低于配额；
+# 这里按配额发请求，换了账号或接口时按实际配额调整
+DEFAULT_QPS = 2.0
+# 同时在途的请求数上限。请求耗时比 1/QPS 长时，靠并发才能用满配额
+DEFAULT_MAX_WORKERS = 4
+# 失败后最多重试的次数，以及第一次重试前的最长等待时间（秒），之后每次翻倍，实际等待时间在 [0, 上限) 中随机
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器：令牌以 rate 个/秒的速度补充，最多积攒 capacity 个，每次请求取走一个，没有令牌时等待。
+    长期的请求速率不超过 rate，空闲之后允许最多 capacity 个请求立即发出。
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        取走一个令牌，必要时等待。
+
+        返回:
+            float: 等待的秒数。
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class EmbeddingClient:
+    """
+    包装只能一次计算一段文本的嵌入接口（例如星火 EmbeddingModel.get_embedding）：
+    - embed_many 一次提交一批文本，按内容哈希去重并先查缓存，剩下的由最多 max_workers 个线程并发请求；
+    - 每个请求先从令牌桶取令牌，整体速率贴着配额走，而不是在每两次请求之间固定 sleep；
+    - 请求失败（抛出异常或返回空结果）时按指数退避加随机抖动重试，避免多个线程在同一时刻一起重试；
+    - 计算结果按内容哈希缓存在内存中；指定 store（ChunkEmbeddingCache）时同时写入磁盘（persist=False 的调用除外），
+      多个进程、多次运行之间共享，同一个文本块只计算一次。
+    """
+
+    def __init__(self, embed, qps: float = DEFAULT_QPS, max_workers: int = DEFAULT_MAX_WORKERS,
+                 retries: int = MAX_RETRIES, cache_size: int = 4096, store: ChunkEmbeddingCache = None):
+        """
+        参数:
+            embed: 函数，接收一段文本，返回向量。
+            qps (float): 接口的请求配额（次/秒）。
+            max_workers (int): 同时在途的请求数上限。
+            retries (int): 失败后最多重试的次数。
+            cache_size (int): 内存中缓存的向量数。
+            store (ChunkEmbeddingCache): 磁盘上的向量缓存，为 None 时只使用内存缓存。
+        """
+        self.embed = embed
+        self.store = store
+        self.retries = retries
+        self.bucket = TokenBucket(qps)
+        self.cache = TTLCache(maxsize=cache_size, ttl=24 * 3600)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+        self._lock = threading.Lock()
+        self.lookups = 0  # 请求向量的文本数
+        self.embedded = 0  # 其中真正调用接口计算的（去重并且两级缓存都没有命中的）文本数
+        self.requests = 0
+        self.retried = 0
+        self.throttled = 0.0  # 等待令牌的累计秒数
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        for attempt in range(self.retries + 1):
+            waited = self.bucket.acquire()
+            with self._lock:
+                self.requests += 1
+                self.throttled += waited
+            try:
+                vector = self.embed(text)
+                if vector is not None and len(vector):
+                    return np.asarray(vector, dtype=np.float32)
+                error = ValueError("嵌入接口返回了空结果")
+            except Exception as e:
+                error = e
+            if attempt == self.retries:
+                raise error
+            with self._lock:
+                self.retried += 1
+            time.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+
+    def embed_many(self, texts: list[str], persist: bool = True) -> list[np.ndarray]:
+        """
+        计算一批文本的向量，结果与 texts 一一对应。任何一个文本重试用完仍然失败时抛出最后一次的异常。
+
+        参数:
+            texts (list[str]): 文本列表。
+            persist (bool): 是否把新计算的向量写入磁盘缓存。用户的问题这类一次性的文本传 False，只保留在内存缓存中，
+                避免磁盘缓存随问题数无限增长。
+
+        返回:
+            list[np.ndarray]: 向量列表（float32）。
+        """
+        keys = [content_hash(text) for text in texts]
+        vectors, missing = {}, {}
+        for key, text in zip(keys, texts):
+            vector = self.cache.get(key)
+            if vector is not None:
+                vectors[key] = vector
+            else:
+                missing.setdefault(key, text)
+        if missing and self.store is not None:
+            for key, vector in self.store.get_many(list(missing)).items():
+                vectors[key] = vector
+                self.cache.set(key, vector)
+                del missing[key]
+        futures = {key: self._executor.submit(self._embed_one, text) for key, text in missing.items()}
+        for key, future in futures.items():
+            vectors[key] = future.result()
+            self.cache.set(key, vectors[key])
+        if futures and persist and self.store is not None:
+            self.store.put_many({key: vectors[key] for key in futures})
+        with self._lock:
+            self.lookups += len(keys)
+            self.embedded += len(futures)
+        return [vectors[key] for key in keys]
+
+    def embed_one(self, text: str, persist: bool = True) -> np.ndarray:
+        """计算一段文本的向量，同样经过缓存、限流和重试。persist 的含义与 embed_many 相同。"""
+        return self.embed_many([text], persist)[0]
+
+    def stats(self) -> dict:
+        """
+        返回客户端的统计信息。
+
+        返回:
+            dict: 请求向量的文本数、调用接口计算的文本数、节省的接口调用次数及比例、实际发出的请求数（包括重试）、
+            重试次数、等待令牌的累计秒数，以及内存缓存的统计。
+        """
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "embedded": self.embedded,
+                "api_calls_saved": self.lookups - self.embedded,
+                "api_calls_saved_rate": (self.lookups - self.embedded) / self.lookups if self.lookups else 0.0,
+                "requests": self.requests,
+                "retries": self.retried,
+                "throttled_s": self.throttled,
+                "cache": self.cache.stats(),
+            }
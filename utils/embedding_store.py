@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+# 修改时间在这个时间（秒）以内的向量文件不清理：它们可能属于另一个正在保存、还没有替换 manifest 的进程
+STALE_VECTORS_AGE = 300
+
+
+def content_hash(text: str) -> str:
+    """文本内容的 SHA-256，作为向量在存储中的键：内容不变，向量就可以复用。"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    按内容哈希保存文本向量的磁盘存储，一个目录对应一个嵌入模型：
+    - manifest.json：模型名、向量维度，以及向量文件中每一行对应的内容哈希；
+    - vectors-<id>.npy：所有向量组成的矩阵，启动时用 np.load(mmap_mode="r") 内存映射，不需要读入内存也不需要重新计算。
+    更新时先写新的向量文件，再原子替换 manifest.json，其它进程或线程在任何时刻读到的都是一对完整一致的文件。
+    替换之后保留上一代向量文件（刚读到旧 manifest 的进程仍然可以打开它），更早的才删除。
+    """
+
+    def __init__(self, directory: str, model: str):
+        self.directory = directory
+        self.model = model
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST)
+
+    def load(self) -> tuple[list[str], np.ndarray | None]:
+        """
+        读取已保存的向量。
+
+        返回:
+            tuple: (内容哈希列表, 内存映射的向量矩阵)。没有保存过、或者保存时使用的是另一个模型时返回 ([], None)。
+        """
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["model"] != self.model:
+                return [], None
+            vectors = np.load(os.path.join(self.directory, manifest["vectors"]), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            # 文件不存在或已损坏，当作没有保存过，全部重新计算
+            return [], None
+        return manifest["hashes"], vectors
+
+    def sync(self, texts: list[str], embed_documents) -> tuple[np.ndarray, dict]:
+        """
+        让存储与 texts 保持一致：内容没有变化的文本直接复用已保存的向量，只对新增或修改过的文本调用 embed_documents，
+        不再出现的文本从存储中删除。有变化时写回磁盘。
+
+        参数:
+            texts (list[str]): 当前的全部文本。
+            embed_documents: 函数，接收文本列表，返回对应的向量列表（例如 Embeddings.embed_documents）。
+
+        返回:
+            tuple: (与 texts 一一对应的向量矩阵, 统计信息 {"reused", "embedded", "removed"})。
+        """
+        hashes = [content_hash(text) for text in texts]
+        saved_hashes, saved = self.load()
+        saved_rows = {key: row for row, key in enumerate(saved_hashes)}
+
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in saved_rows:
+                missing.setdefault(key, text)
+        embedded = {}
+        if missing:
+            embedded = dict(zip(missing, embed_documents(list(missing.values()))))
+
+        stats = {
+            "reused": sum(1 for key in hashes if key in saved_rows),
+            "embedded": len(missing),
+            "removed": len(set(saved_rows) - set(hashes)),
+        }
+        if not missing and saved_hashes == hashes:
+            return saved, stats
+
+        vectors = np.array(
+            [saved[saved_rows[key]] if key in saved_rows else embedded[key] for key in hashes], dtype=np.float32
+        )
+        return self._save(hashes, vectors), stats
+
+    def _save(self, hashes: list[str], vectors: np.ndarray) -> np.ndarray:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"vectors-{uuid.uuid4().hex[:12]}.npy"
+        np.save(os.path.join(self.directory, name), vectors)
+        previous = self._manifest_vectors()
+        manifest_tmp = f"{self._manifest_path()}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(manifest_tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": int(vectors.shape[1]), "vectors": name, "hashes": hashes}, f)
+        os.replace(manifest_tmp, self._manifest_path())
+        self._remove_stale_vectors({name, previous})
+        return np.load(os.path.join(self.directory, name), mmap_mode="r")
+
+    def _manifest_vectors(self) -> str | None:
+        """当前 manifest 引用的向量文件名，没有 manifest 或无法读取时返回 None。"""
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f).get("vectors")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _remove_stale_vectors(self, keep: set):
+        """
+        删除不在 keep 中、并且已经有一段时间没有修改的向量文件。删除失败（例如 Windows 上文件仍被其它进程映射）时跳过，
+        下次保存时再尝试。
+        """
+        now = time.time()
+        for entry in os.listdir(self.directory):
+            if not entry.startswith("vectors-") or entry in keep:
+                continue
+            path = os.path.join(self.directory, entry)
+            try:
+                if now - os.path.getmtime(path) > STALE_VECTORS_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class FileWatcher:
+    """
+    在后台线程中轮询文件的修改时间和大小，变化时调用 callback。回调在后台线程中执行，不会阻塞调用方；
+    回调抛出的异常只打印出来，下次文件变化时再次尝试。
+    """
+
+    def __init__(self, path: str, callback, interval: float = 2.0):
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._signature = self._stat()
+        self._thread = threading.Thread(target=self._run, name=f"watch:{os.path.basename(path)}", daemon=True)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                self.callback()
+            except Exception as e:
+                print(f"刷新 {self.path} 失败: {e!r}")
+
+    def start(self) -> "FileWatcher":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
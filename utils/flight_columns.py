@@ -0,0 +1,229 @@
+import threading
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Optional
+
+import numpy as np
+
+from utils.db_pool import get_pool
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _epoch_us(value: datetime) -> int:
+    """带时区的时间转换为 UTC 纪元以来的微秒数（整数运算，没有浮点误差）。"""
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _parse_departures(values: list[str]) -> tuple[np.ndarray, Optional[tzinfo]]:
+    """
+    把 "2024-05-15 03:24:00.000000-04:00" 格式的时间文本批量转换为 UTC 微秒数。
+    前 26 个字符交给 NumPy 按本地时间向量化解析，时区偏移只有少数几种，逐个解析后按下标减去；
+    格式不符时退回到逐行 datetime.fromisoformat。
+
+    返回:
+        tuple: (int64 数组, 数据中第一行的时区)。
+    """
+    if not values:
+        return np.empty(0, dtype=np.int64), None
+    try:
+        text = np.asarray(values, dtype=str)
+        local = text.astype("U26").astype("datetime64[us]").astype(np.int64)
+        offsets, inverse = np.unique([value[26:] for value in values], return_inverse=True)
+        zones = [datetime.fromisoformat(f"2000-01-01 00:00:00{offset}").tzinfo for offset in offsets.tolist()]
+        if any(zone is None for zone in zones):
+            raise ValueError("时间中缺少时区偏移")
+        offset_us = np.array([zone.utcoffset(None) // _MICROSECOND for zone in zones], dtype=np.int64)
+        return local - offset_us[inverse], zones[inverse[0]]
+    except ValueError:
+        departures = [datetime.fromisoformat(value) for value in values]
+        return np.array([_epoch_us(value) for value in departures], dtype=np.int64), departures[0].tzinfo
+
+
+class FlightColumns:
+    """
+    flights 表在内存中的列式副本，用于"某机场本周的所有航班"这类一次返回大量行的查询：
+    - 每一列是一个连续的 NumPy 数组，所有列按 (起飞时间, flight_id) 排序，与 search_flights 的 ORDER BY 相同；
+    - 机场代码字典编码为 int32，过滤条件是对整列的向量化比较，得到布尔掩码；
+    - 起飞时间保存为 int64 的 UTC 微秒数，时间范围用 np.searchsorted 二分定位到连续的一段，只在这一段上计算掩码；
+    - 只有最终返回的行才转换成 Python 字典，字段和类型与 SELECT * FROM flights 的结果相同。
+    数据只在加载时写入，之后只读，多个线程可以同时查询。
+    """
+
+    def __init__(self, columns: dict, departure_ts: np.ndarray, airport_codes: dict,
+                 departure_codes: np.ndarray, arrival_codes: np.ndarray, tzinfo):
+        self.columns = columns  # 列名 -> 数组，顺序与表中的列相同
+        self.departure_ts = departure_ts
+        self.airport_codes = airport_codes  # 机场代码 -> 编码
+        self.departure_codes = departure_codes
+        self.arrival_codes = arrival_codes
+        # 数据中的时区，用来解释不带时区的查询时间
+        self.tzinfo = tzinfo
+
+    @classmethod
+    def load(cls, conn) -> "FlightColumns":
+        """
+        从数据库读取全部航班，构建列式存储。
+
+        参数:
+            conn (sqlite3.Connection): 数据库连接。
+
+        返回:
+            FlightColumns: 构建好的列式存储。
+        """
+        cursor = conn.execute("SELECT * FROM flights")
+        names = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        raw = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+        departure_ts, tz = _parse_departures(raw["scheduled_departure"])
+        flight_ids = np.asarray(raw["flight_id"], dtype=np.int64)
+        # 先按 flight_id、再按起飞时间做稳定排序，等价于 ORDER BY scheduled_departure, flight_id
+        order = np.lexsort((flight_ids, departure_ts))
+
+        columns = {}
+        for name, values in raw.items():
+            if name == "flight_id":
+                columns[name] = flight_ids[order]
+            else:
+                # 文本和可能为 NULL 的列保存为 object 数组，取出的值就是原来的 str/None
+                array = np.empty(len(values), dtype=object)
+                array[:] = values
+                columns[name] = array[order]
+
+        airports, encoded = np.unique(
+            np.concatenate([columns["departure_airport"], columns["arrival_airport"]]).astype(str),
+            return_inverse=True,
+        )
+        encoded = encoded.astype(np.int32)
+        return cls(
+            columns,
+            departure_ts[order],
+            {airport: code for code, airport in enumerate(airports.tolist())},
+            encoded[:len(rows)],
+            encoded[len(rows):],
+            tz,
+        )
+
+    def __len__(self):
+        return len(self.departure_ts)
+
+    def _timestamp(self, value) -> Optional[int]:
+        """把查询参数中的时间转换为 UTC 微秒数。不带时区的时间按数据中的时区解释，date 视为当天零点。"""
+        if value is None or value == "":
+            return None
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, datetime) and isinstance(value, date):
+            value = datetime.combine(value, datetime.min.time())
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=self.tzinfo or timezone.utc)
+        return _epoch_us(value)
+
+    def _edge(self, value, lower: bool) -> int:
+        """
+        时间范围的一端在排序后数组中的下标。起飞时刻严格早于/晚于边界的航班按时间戳二分定位；
+        恰好在边界时刻起飞的航班，按 SQLite 对文本的比较决定是否包含（例如结束时间 "2026-10-12" 不包含当天零点整起飞的航班），
+        这样两个后端对工具实际传入的时间格式返回完全相同的结果。
+        """
+        ts = self._timestamp(value)
+        first = int(np.searchsorted(self.departure_ts, ts, side="left"))
+        last = int(np.searchsorted(self.departure_ts, ts, side="right"))
+        text = value if isinstance(value, str) else str(value)
+        same = self.columns["scheduled_departure"][first:last]
+        if lower:
+            return first + sum(1 for departure in same if departure < text)
+        return first + sum(1 for departure in same if departure <= text)
+
+    def _bounds(self, start_time, end_time, after: Optional[tuple]) -> tuple[int, int]:
+        """用二分查找把时间范围和翻页起点换算成排序后数组中的下标区间 [lo, hi)。"""
+        lo, hi = 0, len(self)
+        if start_time:
+            lo = self._edge(start_time, lower=True)
+        if end_time:
+            hi = self._edge(end_time, lower=False)
+        if after:
+            # 键集分页：跳过 (起飞时间, flight_id) <= after 的行。起飞时间相同的一段内 flight_id 是升序的
+            after_ts = self._timestamp(after[0])
+            first = int(np.searchsorted(self.departure_ts, after_ts, side="left"))
+            last = int(np.searchsorted(self.departure_ts, after_ts, side="right"))
+            skip = int(np.searchsorted(self.columns["flight_id"][first:last], after[1], side="right"))
+            lo = max(lo, first + skip)
+        return lo, hi
+
+    def search(
+            self,
+            departure_airport: Optional[str] = None,
+            arrival_airport: Optional[str] = None,
+            start_time=None,
+            end_time=None,
+            after: Optional[tuple] = None,
+            limit: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        按与 iter_flights 相同的条件和顺序查询航班。
+
+        参数:
+            departure_airport / arrival_airport / start_time / end_time: 与 search_flights 相同的过滤条件。
+            after (Optional[tuple]): 键集分页的起点 (scheduled_departure, flight_id)，只返回排在它之后的航班。
+            limit (Optional[int]): 最多返回的行数，不传则返回所有匹配的航班。
+
+        返回:
+            list[dict]: 航班字典列表，字段与 SELECT * FROM flights 相同。
+        """
+        lo, hi = self._bounds(start_time, end_time, after)
+        if lo >= hi:
+            return []
+        mask = None
+        for airport, codes in ((departure_airport, self.departure_codes), (arrival_airport, self.arrival_codes)):
+            if not airport:
+                continue
+            code = self.airport_codes.get(airport)
+            if code is None:
+                return []
+            matches = codes[lo:hi] == code
+            mask = matches if mask is None else mask & matches
+        indices = np.arange(lo, hi) if mask is None else lo + np.flatnonzero(mask)
+        if limit is not None:
+            indices = indices[:limit]
+        # tolist() 把 NumPy 标量转换回 Python 的 int/str，结果可以直接序列化
+        values = [column[indices].tolist() for column in self.columns.values()]
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_flight_columns(db_path: str) -> FlightColumns:
+    """
+    获取指定数据库的航班列式存储，第一次使用时从数据库构建，之后在进程内复用。
+
+    参数:
+        db_path (str): 数据库路径。
+
+    返回:
+        FlightColumns: 航班列式存储。
+    """
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            with get_pool(db_path).reader() as conn:
+                store = FlightColumns.load(conn)
+            _stores[db_path] = store
+        return store
+
+
+def invalidate_flight_columns(db_path: str = None):
+    """
+    丢弃航班列式存储，下次使用时重新构建。用于 update_dates 这类整体改写航班数据的操作。
+
+    参数:
+        db_path (str): 数据库路径，不传则丢弃所有数据库的列式存储。
+    """
+    with _stores_lock:
+        if db_path is None:
+            _stores.clear()
+        else:
+            _stores.pop(db_path, None)
@@ -0,0 +1,270 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timezone
+from typing import NamedTuple, Optional
+
+from utils.db_pool import get_pool
+
+# 默认的最短转机时间（分钟）：前一段的到达时间和后一段的起飞时间至少要间隔这么久
+DEFAULT_MIN_CONNECTION = 60
+# 默认的最长转机时间（分钟）：超过这个间隔的衔接不算作同一个行程
+DEFAULT_MAX_CONNECTION = 24 * 60
+
+_LEG_COLUMNS = "flight_id, flight_no, departure_airport, arrival_airport, scheduled_departure, scheduled_arrival"
+
+
+class FlightLeg(NamedTuple):
+    """时间展开图中的一条边：一个航班从 departure_airport 的 dep_ts 时刻出发，在 arrival_airport 的 arr_ts 时刻到达。"""
+    dep_ts: float
+    arr_ts: float
+    flight_id: int
+    flight_no: str
+    departure_airport: str
+    arrival_airport: str
+    scheduled_departure: str
+    scheduled_arrival: str
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "FlightLeg":
+        flight_id, flight_no, departure_airport, arrival_airport, scheduled_departure, scheduled_arrival = row
+        return cls(
+            datetime.fromisoformat(scheduled_departure).timestamp(),
+            datetime.fromisoformat(scheduled_arrival).timestamp(),
+            flight_id,
+            flight_no,
+            departure_airport,
+            arrival_airport,
+            scheduled_departure,
+            scheduled_arrival,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "flight_id": self.flight_id,
+            "flight_no": self.flight_no,
+            "departure_airport": self.departure_airport,
+            "arrival_airport": self.arrival_airport,
+            "scheduled_departure": self.scheduled_departure,
+            "scheduled_arrival": self.scheduled_arrival,
+        }
+
+
+class FlightConnectionGraph:
+    """
+    flights 表在内存中的时间展开图，用于查询直飞、一次中转和两次中转的行程。
+    - 每个机场的出发航班按起飞时间排序，找"某时刻之后从某机场出发的航班"只需要一次二分查找。
+    - 每条航线 (出发机场, 到达机场) 也单独按起飞时间排序，行程的最后一段直接在到达目的地的航线上二分查找，
+      不需要遍历中转机场的所有出发航班。
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        # 机场 -> 按起飞时间排序的出发航班，以及对应的起飞时间列表（供 bisect 使用）
+        self._departures = {}
+        self._departure_times = {}
+        # (出发机场, 到达机场) -> 按起飞时间排序的航班及起飞时间列表
+        self._routes = {}
+        self._route_times = {}
+        # 数据中的时区，用来解释不带时区的查询时间
+        self.tzinfo = None
+
+    @classmethod
+    def load(cls, conn) -> "FlightConnectionGraph":
+        """
+        从数据库读取全部航班，构建时间展开图。
+
+        参数:
+            conn (sqlite3.Connection): 数据库连接。
+
+        返回:
+            FlightConnectionGraph: 构建好的图。
+        """
+        graph = cls()
+        legs = [FlightLeg.from_row(row) for row in conn.execute(f"SELECT {_LEG_COLUMNS} FROM flights")]
+        legs.sort()
+        for leg in legs:
+            graph._by_id[leg.flight_id] = leg
+            graph._departures.setdefault(leg.departure_airport, []).append(leg)
+            graph._routes.setdefault((leg.departure_airport, leg.arrival_airport), []).append(leg)
+        graph._departure_times = {airport: [leg.dep_ts for leg in items] for airport, items in graph._departures.items()}
+        graph._route_times = {route: [leg.dep_ts for leg in items] for route, items in graph._routes.items()}
+        if legs:
+            graph.tzinfo = datetime.fromisoformat(legs[0].scheduled_departure).tzinfo
+        return graph
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _timestamp(self, value) -> Optional[float]:
+        """把查询参数中的时间转换为时间戳。不带时区的时间按数据中的时区解释，date 视为当天零点。"""
+        if value is None or value == "":
+            return None
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, datetime) and isinstance(value, date):
+            value = datetime.combine(value, datetime.min.time())
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=self.tzinfo or timezone.utc)
+        return value.timestamp()
+
+    def search(
+            self,
+            origin: str,
+            destination: str,
+            start_time=None,
+            end_time=None,
+            max_stops: int = 2,
+            min_connection: int = DEFAULT_MIN_CONNECTION,
+            max_connection: int = DEFAULT_MAX_CONNECTION,
+            top_k: int = 5,
+            sort_by: str = "arrival",
+    ) -> list[dict]:
+        """
+        查询从 origin 到 destination 的行程（直飞、一次中转、两次中转），返回最好的 top_k 个。
+
+        参数:
+            origin (str): 出发机场。
+            destination (str): 目的地机场。
+            start_time / end_time: 第一段航班起飞时间的范围（可选）。
+            max_stops (int): 最多中转次数，0~2。
+            min_connection (int): 最短转机时间（分钟）。
+            max_connection (int): 最长转机时间（分钟）。
+            top_k (int): 返回的行程数量。
+            sort_by (str): "arrival" 按到达时间最早排序，"duration" 按总耗时最短排序。
+
+        返回:
+            list[dict]: 行程列表，每个行程包含各段航班、中转次数、总耗时和每次转机的等待时间。
+        """
+        if sort_by not in ("arrival", "duration"):
+            raise ValueError(f"不支持的排序方式: {sort_by}，可选值为 arrival、duration。")
+        if origin == destination or top_k <= 0:
+            return []
+        max_stops = max(0, min(max_stops, 2))
+        start_ts = self._timestamp(start_time)
+        end_ts = self._timestamp(end_time)
+        min_gap = min_connection * 60
+        max_gap = max_connection * 60
+        # 大顶堆（取负值）保存当前最好的 top_k 个行程，堆顶是其中最差的一个，用它来剪枝
+        best = []
+        counter = 0
+
+        def bound() -> float:
+            return -best[0][0] if len(best) >= top_k else float("inf")
+
+        def score(first: FlightLeg, last: FlightLeg) -> float:
+            return last.arr_ts if sort_by == "arrival" else last.arr_ts - first.dep_ts
+
+        def offer(path: tuple):
+            nonlocal counter
+            value = score(path[0], path[-1])
+            if value >= bound():
+                return
+            counter += 1
+            item = (-value, -counter, path)
+            if len(best) < top_k:
+                heapq.heappush(best, item)
+            else:
+                heapq.heapreplace(best, item)
+
+        def lower_bound(first: FlightLeg, leg: FlightLeg) -> float:
+            # 行程经过 leg 后，最终的到达时间/总耗时至少是 leg 到达时的值，可以据此剪枝
+            return leg.arr_ts if sort_by == "arrival" else leg.arr_ts - first.dep_ts
+
+        def connections(legs_by_key: dict, times_by_key: dict, key, arrived: float):
+            legs = legs_by_key.get(key)
+            if not legs:
+                return
+            times = times_by_key[key]
+            index = bisect_left(times, arrived + min_gap)
+            stop = bisect_right(times, arrived + max_gap)
+            for leg in legs[index:stop]:
+                # 后续航班的起飞时间只会更晚，超过当前第 k 好的值后就不可能更优了
+                if sort_by == "arrival" and leg.dep_ts >= bound():
+                    return
+                yield leg
+
+        def extend(path: tuple, stops_left: int):
+            first, last = path[0], path[-1]
+            if stops_left == 0:
+                return
+            visited = {leg.departure_airport for leg in path}
+            if stops_left == 1:
+                # 最后一段只能飞往目的地，直接在航线上查找
+                for leg in connections(self._routes, self._route_times, (last.arrival_airport, destination),
+                                       last.arr_ts):
+                    offer(path + (leg,))
+                return
+            for leg in connections(self._departures, self._departure_times, last.arrival_airport, last.arr_ts):
+                if leg.arrival_airport in visited:
+                    continue
+                if lower_bound(first, leg) >= bound():
+                    continue
+                if leg.arrival_airport == destination:
+                    offer(path + (leg,))
+                else:
+                    extend(path + (leg,), stops_left - 1)
+
+        legs = self._departures.get(origin, [])
+        times = self._departure_times.get(origin, [])
+        index = bisect_left(times, start_ts) if start_ts is not None else 0
+        stop = bisect_right(times, end_ts) if end_ts is not None else len(times)
+        for first in legs[index:stop]:
+            # 第一段按起飞时间递增遍历，起飞时间已经晚于第 k 早的到达时间时，后面的航班都不可能更优
+            if sort_by == "arrival" and first.dep_ts >= bound():
+                break
+            if first.arrival_airport == destination:
+                offer((first,))
+            elif lower_bound(first, first) < bound():
+                extend((first,), max_stops)
+
+        itineraries = []
+        for _, _, path in sorted(best, reverse=True):
+            itineraries.append({
+                "stops": len(path) - 1,
+                "departure_airport": path[0].departure_airport,
+                "arrival_airport": path[-1].arrival_airport,
+                "scheduled_departure": path[0].scheduled_departure,
+                "scheduled_arrival": path[-1].scheduled_arrival,
+                "duration_minutes": round((path[-1].arr_ts - path[0].dep_ts) / 60),
+                "layover_minutes": [round((b.dep_ts - a.arr_ts) / 60) for a, b in zip(path, path[1:])],
+                "legs": [leg.to_dict() for leg in path],
+            })
+        return itineraries
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_flight_graph(db_path: str) -> FlightConnectionGraph:
+    """
+    获取指定数据库的航班时间展开图，第一次使用时从数据库构建，之后在进程内复用。
+
+    参数:
+        db_path (str): 数据库路径。
+
+    返回:
+        FlightConnectionGraph: 航班图。
+    """
+    with _graphs_lock:
+        graph = _graphs.get(db_path)
+        if graph is None:
+            with get_pool(db_path).reader() as conn:
+                graph = FlightConnectionGraph.load(conn)
+            _graphs[db_path] = graph
+        return graph
+
+
+def invalidate_flight_graph(db_path: str = None):
+    """
+    丢弃航班图，下次使用时重新构建。用于 update_dates 这类整体改写航班数据的操作。
+
+    参数:
+        db_path (str): 数据库路径，不传则丢弃所有数据库的图。
+    """
+    with _graphs_lock:
+        if db_path is None:
+            _graphs.clear()
+        else:
+            _graphs.pop(db_path, None)
@@ -0,0 +1,159 @@
+import re
+import sqlite3
+
+from utils.query_builder import Select
+
+# 需要全文检索的实体表及其检索列。每个表对应一张外部内容（external content）的 FTS5 虚拟表 <表名>_fts，
+# 只保存倒排索引，不重复保存原始文本，由触发器与原表保持同步。
+FTS_TABLES = {
+    "hotels": ("name", "location"),
+    "car_rentals": ("name", "location"),
+    "trip_recommendations": ("name", "location", "keywords"),
+}
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    """判断当前 SQLite 是否编译了 FTS5 扩展。"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def has_fts_index(conn: sqlite3.Connection, table: str) -> bool:
+    """判断实体表是否已经建好了对应的 FTS5 虚拟表。"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",)
+    ).fetchone()
+    return row is not None
+
+
+def create_fts_indexes(conn: sqlite3.Connection, tables: list[str] = None):
+    """
+    为 FTS_TABLES 中的每个实体表创建 FTS5 虚拟表和同步触发器，并用现有数据重建索引。
+    SQLite 没有编译 FTS5 时直接跳过，搜索工具会自动退回到 LIKE 查询。
+
+    参数:
+        conn (sqlite3.Connection): 数据库连接。
+        tables (list[str]): 只为这些表建立索引，默认为 FTS_TABLES 中的所有表。
+    """
+    if not fts5_available(conn):
+        print("当前 SQLite 不支持 FTS5，跳过全文索引的创建，搜索将使用 LIKE 查询。")
+        return
+    for table in tables or FTS_TABLES:
+        columns = FTS_TABLES[table]
+        fts = f"{table}_fts"
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        # prefix='2 3' 为 2、3 个字符的前缀建立额外的索引，加速 "xx"* 这类前缀查询
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{column_list}, content='{table}', content_rowid='rowid', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values}); END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values}); END"
+        )
+        # 只在检索列变化时才更新索引，预订/取消只修改 booked 列，不会触发索引维护
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values}); "
+            f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values}); END"
+        )
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _prefix_terms(text: str) -> list[str]:
+    """把输入文本拆分成词，每个词都转换为 FTS5 的前缀查询 "词"*。"""
+    return [f'"{token}"*' for token in _TOKEN_PATTERN.findall(text)]
+
+
+def build_search_query(
+        conn: sqlite3.Connection,
+        table: str,
+        match_all: dict,
+        match_any: dict = None,
+) -> tuple[str, list]:
+    """
+    生成实体表的搜索 SQL。表上有 FTS5 索引时通过虚拟表检索，按 bm25 相关度排序，每个词按前缀匹配；
+    否则退回到原来的 LIKE '%x%' 查询。
+
+    参数:
+        conn (sqlite3.Connection): 数据库连接，用来判断是否有 FTS5 索引。
+        table (str): 实体表名，必须是 FTS_TABLES 中的表。
+        match_all (dict): 列名 -> 检索文本，所有给出的列都必须匹配（值为空的列会被忽略）。
+        match_any (dict): 列名 -> 检索词列表，列表中任意一个词匹配即可。
+
+    返回:
+        tuple[str, list]: SQL 语句和参数列表。
+    """
+    return compose_search_query(table, match_all, match_any, use_fts=has_fts_index(conn, table))
+
+
+def compose_search_query(
+        table: str,
+        match_all: dict,
+        match_any: dict = None,
+        use_fts: bool = True,
+) -> tuple[str, list]:
+    """
+    与 build_search_query 相同，但由调用方告知表上是否有 FTS5 索引，不需要数据库连接。
+    异步工具通过 AsyncSQLitePool.fts_tables() 得到这个信息。
+
+    参数:
+        table (str): 实体表名，必须是 FTS_TABLES 中的表。
+        match_all (dict): 列名 -> 检索文本，所有给出的列都必须匹配（值为空的列会被忽略）。
+        match_any (dict): 列名 -> 检索词列表，列表中任意一个词匹配即可。
+        use_fts (bool): 是否通过 FTS5 虚拟表检索。
+
+    返回:
+        tuple[str, list]: SQL 语句和参数列表。
+    """
+    match_all = {column: text for column, text in match_all.items() if text}
+    match_any = {column: terms for column, terms in (match_any or {}).items() if terms}
+
+    if use_fts:
+        if not match_all and not match_any:
+            return Select(table).build()
+        clauses = []
+        for column, text in match_all.items():
+            terms = _prefix_terms(text)
+            if terms:
+                clauses.append(f"{column} : ({' AND '.join(terms)})")
+        for column, keywords in match_any.items():
+            terms = [term for keyword in keywords for term in _prefix_terms(keyword)]
+            if terms:
+                clauses.append(f"{column} : ({' OR '.join(terms)})")
+        if len(clauses) < len(match_all) + len(match_any):
+            # 给出了条件、但其中有条件不含任何可检索的词（例如只有标点）：FTS5 无法表达这个条件，
+            # 与 LIKE 的结果保持一致按没有匹配处理，而不是忽略这个条件
+            return Select(table).where("0").build()
+        # 检索词全部放在 MATCH 的参数中，不同的检索词共用同一条语句
+        fts = f"{table}_fts"
+        return (
+            Select(f"{fts} JOIN {table} ON {table}.rowid = {fts}.rowid", f"{table}.*")
+            .where(f"{fts} MATCH ?", " AND ".join(clauses))
+            .order_by(f"bm25({fts})")
+            .build()
+        )
+
+    # 没有 FTS5 索引时的退路：前后都带通配符的 LIKE 无法使用索引，只能全表扫描
+    select = Select(table)
+    for column, text in match_all.items():
+        select.where(f"{column} LIKE ?", f"%{text}%")
+    for column, keywords in match_any.items():
+        select.where(
+            f"({' OR '.join(f'{column} LIKE ?' for _ in keywords)})",
+            *[f"%{keyword.strip()}%" for keyword in keywords],
+        )
+    return select.build()
@@ -0,0 +1,257 @@
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import aiosqlite
+
+from utils.async_db_pool import get_async_pool
+from utils.db_pool import SQLitePool, get_pool
+
+# 读多写少、可以整表放进内存的参考表，以及每张表按行更新时使用的键
+HOT_TABLES = {
+    "flights": "flight_id",
+    "hotels": "id",
+    "car_rentals": "id",
+    "trip_recommendations": "id",
+}
+# 热副本默认最多占用的内存（字节）。四张表连同索引和全文索引大约 10MB，超出预算的表不加载，继续从磁盘读取
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+class HotReplica:
+    """
+    参考表在内存中的只读副本（共享缓存模式的内存 SQLite 数据库），表结构、索引、FTS5 全文索引和同步触发器都与磁盘上的数据库相同，
+    search_* 工具原来的 SQL 可以不做任何修改直接在副本上执行，省掉了页缓存未命中时的磁盘读取和文件锁。
+    - 读：副本有自己的连接池，每个线程一个读连接。
+    - 写：预订工具仍然写磁盘上的数据库，在同一个写事务中把改动过的行重新读出来，事务提交成功之后再通过 apply_rows
+      覆盖副本中的对应行，回滚的事务不会改动副本。提交和写入副本都在磁盘连接池的写锁内完成，副本收到的增量和磁盘上提交的顺序一致。
+    """
+
+    def __init__(self, source_path: str, tables: dict = None, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        self.source_path = source_path
+        self.memory_budget = memory_budget
+        self.path = f"file:hot_replica_{hashlib.sha1(source_path.encode()).hexdigest()[:12]}?mode=memory&cache=shared"
+        self.tables = {}  # 实际加载进内存的表 -> 行键
+        self._requested = dict(tables or HOT_TABLES)
+        # 内存数据库在最后一个连接关闭时销毁，keeper 连接一直打开，同时用于加载数据
+        self._keeper = sqlite3.connect(self.path, uri=True, check_same_thread=False)
+        self.pool = SQLitePool(self.path)
+
+    def memory_bytes(self) -> int:
+        """副本当前占用的内存（字节），按数据库的页数计算。"""
+        page_count = self._keeper.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self._keeper.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    def load(self) -> "HotReplica":
+        """
+        把参考表按顺序复制到内存中。每加载完一张表检查一次内存占用，超出预算时删掉这张表，
+        没有加载的表由 search_reader 退回到磁盘上的连接池。
+
+        返回:
+            HotReplica: 自身，便于链式调用。
+        """
+        conn = self._keeper
+        conn.execute("ATTACH DATABASE ? AS src", (self.source_path,))
+        try:
+            for table, key in self._requested.items():
+                if self._copy_table(conn, table):
+                    self.tables[table] = key
+                if self.memory_bytes() > self.memory_budget:
+                    # 放不下的表删掉并回收空间，继续尝试后面更小的表
+                    print(f"热副本超出内存预算 {self.memory_budget} 字节，{table} 表继续从磁盘读取")
+                    self._drop_table(conn, table)
+                    self.tables.pop(table, None)
+            # 让查询规划器在副本上也拿到索引的统计信息
+            conn.execute("ANALYZE main")
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE src")
+        return self
+
+    @staticmethod
+    def _copy_table(conn: sqlite3.Connection, table: str) -> bool:
+        """复制一张表的结构、数据（保留 rowid）、索引、FTS5 虚拟表和触发器。源库中没有这张表时返回 False。"""
+        objects = conn.execute(
+            "SELECT type, name, sql FROM src.sqlite_master WHERE sql IS NOT NULL AND tbl_name IN (?, ?)",
+            (table, f"{table}_fts"),
+        ).fetchall()
+        if not any(kind == "table" and name == table for kind, name, _ in objects):
+            return False
+        for kind, _, sql in objects:
+            if kind == "table":
+                conn.execute(sql)
+        columns = ", ".join(f'"{row[1]}"' for row in conn.execute(f'PRAGMA src.table_info("{table}")'))
+        # 保留原来的 rowid，FTS5 外部内容表按 rowid 关联原表，结果的顺序也和磁盘上一致
+        conn.execute(f'INSERT INTO main."{table}" (rowid, {columns}) SELECT rowid, {columns} FROM src."{table}"')
+        for kind, name, sql in objects:
+            if kind == "table" and name == f"{table}_fts":
+                conn.execute(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+        # 索引和触发器在数据复制完成后再建，批量插入时不需要逐行维护
+        for kind, _, sql in objects:
+            if kind in ("index", "trigger"):
+                conn.execute(sql)
+        conn.commit()
+        return True
+
+    @staticmethod
+    def _drop_table(conn: sqlite3.Connection, table: str):
+        conn.execute(f"DROP TABLE IF EXISTS {table}_fts")
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.commit()
+        # 删除的页只是进入空闲列表，VACUUM 之后内存才真正释放，page_count 也随之变小
+        conn.execute("VACUUM main")
+
+    def covers(self, table: str) -> bool:
+        """判断表是否已经加载到副本中。"""
+        return table in self.tables
+
+    def delta_query(self, table: str, ids: list) -> tuple[str, list]:
+        """生成从磁盘数据库读取改动行（连同 rowid）的 SQL 和参数。"""
+        placeholders = ", ".join("?" for _ in ids)
+        return f'SELECT rowid, * FROM "{table}" WHERE {self.tables[table]} IN ({placeholders})', list(ids)
+
+    def apply_rows(self, table: str, ids: list, columns: list[str], rows: list[tuple]):
+        """
+        用磁盘上的最新数据覆盖副本中的行：已有的行按 rowid 原地 UPDATE，新出现的行按原来的 rowid 插入，
+        最后只删除磁盘上已经不存在的行。副本的读连接是 read_uncommitted，先删后插时两条语句之间的查询会漏掉正在更新的行；
+        原地更新时每一行在任何时刻都在副本中。FTS5 索引由触发器同步维护。
+
+        参数:
+            table (str): 表名。
+            ids (list): 改动过的行键。
+            columns (list[str]): rows 的列名，第一列是 rowid。
+            rows (list[tuple]): 从磁盘数据库读出的行。
+        """
+        key = self.tables[table]
+        placeholders = ", ".join("?" for _ in ids)
+        data_columns = columns[1:]
+        assignments = ", ".join(f'"{column}" = ?' for column in data_columns)
+        column_list = ", ".join(f'"{column}"' for column in data_columns)
+        values = ", ".join("?" for _ in columns)
+        with self.pool.writer() as conn:
+            existing = {row[0] for row in conn.execute(
+                f'SELECT rowid FROM "{table}" WHERE {key} IN ({placeholders})', list(ids)
+            )}
+            conn.executemany(
+                f'UPDATE "{table}" SET {assignments} WHERE rowid = ?',
+                [(*row[1:], row[0]) for row in rows if row[0] in existing],
+            )
+            conn.executemany(
+                f'INSERT INTO "{table}" (rowid, {column_list}) VALUES ({values})',
+                [row for row in rows if row[0] not in existing],
+            )
+            removed = existing - {row[0] for row in rows}
+            if removed:
+                conn.executemany(f'DELETE FROM "{table}" WHERE rowid = ?', [(rowid,) for rowid in removed])
+
+    def close(self):
+        """关闭副本的连接池并释放内存数据库。"""
+        self.pool.close()
+        self._keeper.close()
+
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+
+
+def enable_hot_replica(
+        db_path: str, tables: dict = None, memory_budget: int = DEFAULT_MEMORY_BUDGET
+) -> HotReplica:
+    """
+    为数据库创建并加载热副本，之后 search_* 工具会从内存中读取已加载的参考表。通常在程序启动、创建好会话的数据库快照之后调用一次。
+
+    参数:
+        db_path (str): 磁盘上的数据库路径（与 RunnableConfig 中的 configurable.db_path 相同）。
+        tables (dict): 要加载的表及其行键，默认为 HOT_TABLES。
+        memory_budget (int): 副本最多占用的内存（字节）。
+
+    返回:
+        HotReplica: 加载完成的热副本。
+    """
+    replica = HotReplica(db_path, tables, memory_budget).load()
+    with _replicas_lock:
+        old = _replicas.pop(db_path, None)
+        _replicas[db_path] = replica
+    if old is not None:
+        old.close()
+    print(f"热副本加载完成: {sorted(replica.tables)}，占用内存 {replica.memory_bytes() / 1024 / 1024:.1f} MB")
+    return replica
+
+
+def get_hot_replica(db_path: str) -> HotReplica | None:
+    """返回数据库的热副本，没有启用时返回 None。"""
+    return _replicas.get(db_path)
+
+
+def hot_replica_covers(db_path: str, table: str) -> bool:
+    """判断数据库是否启用了热副本，并且表已经加载到内存中。"""
+    replica = _replicas.get(db_path)
+    return replica is not None and replica.covers(table)
+
+
+def close_hot_replica(db_path: str) -> dict | None:
+    """
+    关闭并移除数据库的热副本。
+
+    参数:
+        db_path (str): 数据库路径。
+
+    返回:
+        dict | None: 被关闭的副本的加载参数（表和内存预算），可以传给 enable_hot_replica 重新加载；没有副本时返回 None。
+    """
+    with _replicas_lock:
+        replica = _replicas.pop(db_path, None)
+    if replica is None:
+        return None
+    replica.close()
+    return {"tables": replica._requested, "memory_budget": replica.memory_budget}
+
+
+@contextmanager
+def search_reader(db_path: str, table: str):
+    """
+    借用一个用于查询 table 的读连接：表在热副本中时使用副本的读连接，否则使用磁盘数据库的读连接。
+
+    参数:
+        db_path (str): 数据库路径。
+        table (str): 要查询的表。
+
+    返回:
+        sqlite3.Connection: 读连接。
+    """
+    replica = _replicas.get(db_path)
+    pool = replica.pool if replica is not None and replica.covers(table) else get_pool(db_path)
+    with pool.reader() as conn:
+        yield conn
+
+
+def apply_hot_delta(conn: sqlite3.Connection, db_path: str, table: str, ids: list):
+    """
+    在预订工具的写事务中调用：从磁盘数据库读出刚改动的行，等事务提交成功后再同步到热副本，事务回滚时副本不变。
+    没有启用热副本或表不在副本中时什么也不做。
+
+    参数:
+        conn (sqlite3.Connection): 磁盘数据库的写连接（get_pool(db_path).writer() 借出的连接）。
+        db_path (str): 数据库路径。
+        table (str): 改动的表。
+        ids (list): 改动过的行键。
+    """
+    replica = _replicas.get(db_path)
+    if replica is None or not replica.covers(table) or not ids:
+        return
+    cursor = conn.execute(*replica.delta_query(table, ids))
+    columns, rows = [column[0] for column in cursor.description], cursor.fetchall()
+    get_pool(db_path).after_commit(lambda: replica.apply_rows(table, ids, columns, rows))
+
+
+async def aapply_hot_delta(conn: aiosqlite.Connection, db_path: str, table: str, ids: list):
+    """apply_hot_delta 的异步版本，conn 为 get_async_pool(db_path).writer() 借出的连接。副本在内存中，写入副本不会阻塞事件循环。"""
+    replica = _replicas.get(db_path)
+    if replica is None or not replica.covers(table) or not ids:
+        return
+    async with conn.execute(*replica.delta_query(table, ids)) as cursor:
+        rows = await cursor.fetchall()
+        columns = [column[0] for column in cursor.description]
+    get_async_pool(db_path).after_commit(lambda: replica.apply_rows(table, ids, columns, rows))
@@ -1,8 +1,27 @@
+import multiprocessing
 import os
+import queue
 import shutil
 import sqlite3
+import sys
+import time
+import traceback
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # 只有 Unix 上有 resource 模块，其它平台上不统计峰值内存
+    resource = None
+
 import pandas as pd
 
+from utils.async_db_pool import close_async_pools
+from utils.db_migrations import migrate
+from utils.db_pool import close_pool
+from utils.flight_columns import invalidate_flight_columns
+from utils.flight_graph import invalidate_flight_graph
+from utils.hot_replica import close_hot_replica, enable_hot_replica
+
 # 这个数据库才是，项目测试过程中使用的
 local_file = "../travel_new.sqlite"
 
@@ -10,21 +29,62 @@ local_file = "../travel_new.sqlite"
 backup_file = "../travel2.sqlite"
 
 
-def update_dates():
+# 需要对齐到当前时间的日期列，表名 -> 列名列表
+DATETIME_COLUMNS = {
+    "flights": ["scheduled_departure", "scheduled_arrival", "actual_departure", "actual_arrival"],
+    "bookings": ["book_date"],
+}
+
+
+def update_dates(mode: str = "pandas", db_file: str = local_file):
     """
     更新数据库中的日期，使其与当前时间对齐。
 
     参数:
-        file (str): 要更新的数据库文件路径。
+        mode (str): 日期平移的方式。
+            - "pandas"：把所有表读入 DataFrame 平移后再整体写回（原有方式）。
+            - "sql"：只对需要平移的列分批执行 UPDATE，不读入内存，也不重建表，列类型和索引都保持不变。
+        db_file (str): 要重置的数据库文件路径，默认为项目测试使用的 local_file。
 
     返回:
         str: 更新后的数据库文件路径。
     """
+    if mode not in ("pandas", "sql"):
+        raise ValueError(f"不支持的日期更新模式: {mode}")
+    start = time.perf_counter()
+
+    # 覆盖文件之前先关闭连接池中指向旧文件的连接，并清理旧文件遗留的 WAL 日志，否则旧日志会被回放到新文件上
+    close_pool(db_file)
+    close_async_pools(db_file)
+    hot_replica = close_hot_replica(db_file)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
     # 使用备份文件覆盖现有文件，作为重置步骤
-    shutil.copy(backup_file, local_file)  # 如果目标路径已经存在一个同名文件，shutil.copy 会覆盖该文件。
-    conn = sqlite3.connect(local_file)
-    # cursor = conn.cursor()
+    shutil.copy(backup_file, db_file)  # 如果目标路径已经存在一个同名文件，shutil.copy 会覆盖该文件。
+    conn = sqlite3.connect(db_file)
+
+    if mode == "sql":
+        _rebase_dates_sql(conn)
+    else:
+        _rebase_dates_pandas(conn)
 
+    # to_sql 重建表时会丢掉所有索引，重新执行迁移把索引建回来
+    migrate(conn)
+    conn.close()
+    # 航班时间整体平移了，内存中的航班图和列式存储全部作废，下次使用时重新构建
+    invalidate_flight_graph(db_file)
+    invalidate_flight_columns(db_file)
+    # 之前启用了热副本的话，用重置后的数据重新加载
+    if hot_replica is not None:
+        enable_hot_replica(db_file, **hot_replica)
+
+    print(f"日期更新完成（{mode} 模式），耗时 {time.perf_counter() - start:.2f} 秒")
+    return db_file
+
+
+def _rebase_dates_pandas(conn: sqlite3.Connection):
+    """读入所有表，用 pandas 平移日期列后整体写回。"""
     # 获取所有表名
     tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", conn).name.tolist()
     tdf = {}
@@ -44,8 +104,7 @@ def update_dates():
     )
 
     # 需要更新的日期列
-    datetime_columns = ["scheduled_departure", "scheduled_arrival", "actual_departure", "actual_arrival"]
-    for column in datetime_columns:
+    for column in DATETIME_COLUMNS["flights"]:
         tdf["flights"][column] = (
                 pd.to_datetime(tdf["flights"][column].replace("\\N", pd.NaT)) + time_diff
         )
@@ -57,12 +116,123 @@ def update_dates():
     del tdf  # 清理内存
 
     conn.commit()
-    conn.close()
 
-    return local_file
 
+def _rebase_dates_sql(conn: sqlite3.Connection, chunk_size: int = 50000):
+    """
+    在数据库内部平移日期列：只计算一次时间差，然后按 rowid 分批执行 UPDATE，全部在同一个事务中完成。
+
+    日期以 "YYYY-MM-DD HH:MM:SS.ffffff+HH:MM" 形式的文本存储。SQLite 的 datetime() 会把带时区的时间转换成 UTC
+    并丢掉微秒，所以这里只对前 19 个字符（本地时间部分）做平移，再原样拼回微秒和时区后缀，保持原有格式不变。
+    时间差按整秒计算，与 pandas 方式相比误差小于 1 秒。
+
+    参数:
+        conn (sqlite3.Connection): 数据库连接。
+        chunk_size (int): 每条 UPDATE 语句处理的行数。
+    """
+    # 找出示例时间（flights 表中 actual_departure 的最大值），取出原始文本以保留其时区
+    row = conn.execute(
+        "SELECT actual_departure FROM flights WHERE actual_departure IS NOT NULL AND actual_departure != '\\N' "
+        "ORDER BY julianday(actual_departure) DESC LIMIT 1"
+    ).fetchone()
+    example_time = datetime.fromisoformat(row[0])
+    # 与 pandas 方式一致：把当前本地时间视为示例时间所在时区的时间
+    current_time = datetime.now().replace(tzinfo=example_time.tzinfo)
+    modifier = f"{round((current_time - example_time).total_seconds()):+d} seconds"
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for table, columns in DATETIME_COLUMNS.items():
+            # "\\N" 表示空值，与 pandas 方式一样转换为 NULL
+            assignments = ", ".join(
+                f"{column} = CASE WHEN {column} IS NULL OR {column} = '\\N' THEN NULL "
+                f"ELSE datetime(substr({column}, 1, 19), :modifier) || substr({column}, 20) END"
+                for column in columns
+            )
+            low, high = conn.execute(f"SELECT min(rowid), max(rowid) FROM {table}").fetchone()
+            if low is None:
+                continue
+            for chunk_start in range(low, high + 1, chunk_size):
+                conn.execute(
+                    f"UPDATE {table} SET {assignments} WHERE rowid BETWEEN :low AND :high",
+                    {"modifier": modifier, "low": chunk_start, "high": chunk_start + chunk_size - 1},
+                )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _peak_rss_kb():
+    """返回当前进程的峰值 RSS（KiB），没有 resource 模块时返回 None。"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure_update_dates(mode: str, queue):
+    """
+    在子进程中执行一次 update_dates，把 (None, 耗时, 峰值内存（KiB，无法统计时为 None）, 内存增长) 放入队列；
+    失败时放入 (异常的堆栈文本, None, None, None)。异常对象不一定能序列化，所以只传文本。
+    """
+    try:
+        rss_before = _peak_rss_kb()
+        start = time.perf_counter()
+        update_dates(mode)
+        elapsed = time.perf_counter() - start
+        rss_peak = _peak_rss_kb()
+        queue.put((None, elapsed, rss_peak, rss_peak - rss_before if rss_peak is not None else None))
+    except BaseException:
+        queue.put((traceback.format_exc(), None, None, None))
+
+
+def _wait_result(process: multiprocessing.Process, results) -> tuple:
+    """等待子进程放入结果。子进程没有放入结果就退出（例如被系统杀掉）时抛出 RuntimeError，而不是一直等待。"""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            # 子进程可能在退出前刚好放入了结果
+            try:
+                return results.get(timeout=1.0)
+            except queue.Empty:
+                raise RuntimeError(f"子进程没有返回结果就退出了，退出码 {process.exitcode}") from None
+
+
+def compare_update_dates(modes=("pandas", "sql")) -> dict:
+    """
+    分别在独立的子进程中执行各个模式的 update_dates，对比耗时和峰值内存。
+    ru_maxrss 是进程级别只增不减的值，所以每个模式都要放在新的子进程里测量。
+
+    返回:
+        dict: 模式 -> {"elapsed_s", "peak_rss_kb", "rss_growth_kb"}，没有 resource 模块（Windows）时内存为 None。
+    """
+    report = {}
+    for mode in modes:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_measure_update_dates, args=(mode, results))
+        process.start()
+        try:
+            error, elapsed, rss_peak, rss_growth = _wait_result(process, results)
+        finally:
+            process.join()
+        if error is not None:
+            raise RuntimeError(f"update_dates(mode={mode!r}) 在子进程中失败:\n{error}")
+        report[mode] = {"elapsed_s": elapsed, "peak_rss_kb": rss_peak, "rss_growth_kb": rss_growth}
+        if rss_peak is None:
+            print(f"{mode:>6}: 耗时 {elapsed:.2f} 秒")
+        else:
+            print(f"{mode:>6}: 耗时 {elapsed:.2f} 秒，峰值 RSS {rss_peak / 1024:.1f} MB，"
+                  f"执行期间 RSS 增长 {rss_growth / 1024:.1f} MB")
+    return report
 
-if __name__ == '__main__':
 
-    # 执行日期更新操作
-    db = update_dates()
\ No newline at end of file
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        # 对比两种日期更新方式的耗时和内存
+        compare_update_dates()
+    else:
+        # 执行日期更新操作
+        db = update_dates(sys.argv[1] if len(sys.argv) > 1 else "pandas")
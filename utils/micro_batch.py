@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import Future
+
+# 第一个请求到达后等待同批其它请求的时间（秒）。ToolNode 并发执行同一条消息中的多个工具调用，它们几乎同时到达
+DEFAULT_WINDOW = 0.01
+
+
+class MicroBatcher:
+    """
+    把短时间内从多个线程并发提交的请求合并成一批处理。第一个到达的线程作为这一批的执行者：等待 window 秒
+    （或者凑满 max_batch 个请求），取走所有等待中的请求，调用一次 run_batch，再把结果分发给各个提交者。
+    run_batch 抛出的异常会传给这一批的所有提交者。
+    """
+
+    def __init__(self, run_batch, window: float = DEFAULT_WINDOW, max_batch: int = 32):
+        """
+        参数:
+            run_batch: 函数，接收请求列表，返回一一对应的结果列表。
+            window (float): 等待同批请求的时间（秒）。
+            max_batch (int): 一批最多的请求数，凑满时立即执行。
+        """
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._full = None  # 当前这一批凑满时通知执行者的事件，为 None 时没有正在等待的执行者
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        """
+        提交一个请求并等待结果。
+
+        参数:
+            item: 请求。
+
+        返回:
+            run_batch 为这个请求返回的结果。
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((item, future))
+            leader = self._full is None
+            if leader:
+                self._full = full = threading.Event()
+            elif len(self._pending) >= self.max_batch:
+                self._full.set()
+        if leader:
+            full.wait(self.window)
+            with self._lock:
+                batch, self._pending, self._full = self._pending, [], None
+                self.batches += 1
+                self.items += len(batch)
+            try:
+                results = self.run_batch([request for request, _ in batch])
+                for (_, waiter), result in zip(batch, results):
+                    waiter.set_result(result)
+            except BaseException as e:
+                for _, waiter in batch:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+        return future.result()
+
+    def stats(self) -> dict:
+        """
+        返回合并的统计信息。
+
+        返回:
+            dict: 批次数、请求数和平均每批的请求数。
+        """
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            }
@@ -0,0 +1,169 @@
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from utils.async_db_pool import get_async_pool
+from utils.db_pool import get_pool
+from utils.hot_replica import apply_hot_delta, aapply_hot_delta
+from utils.query_builder import afetch_dicts, fetch_dicts
+
+# 使用乐观并发控制的预订表。每张表增加一个 version 列，每次修改都加一
+VERSIONED_TABLES = ("hotels", "car_rentals", "trip_recommendations")
+VERSION_COLUMN = "version"
+# 比较并更新（CAS）失败后最多重试的次数，以及第一次重试前的最长等待时间（秒），之后每次翻倍，实际等待时间在 [0, 上限) 中随机
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.002
+
+# optimistic_update 的结果
+UPDATED = "updated"  # 修改成功
+NOT_FOUND = "not_found"  # 行不存在
+REJECTED = "rejected"  # 行的当前状态不允许这次修改，例如预订一个已经被预订的酒店
+CONFLICT = "conflict"  # 重试次数用完，每次写入前行都被其他会话改过了
+
+
+def add_version_columns(conn: sqlite3.Connection, tables=VERSIONED_TABLES):
+    """
+    为预订表增加 version 列（已有的行从 0 开始）。数据库迁移步骤，重复执行时跳过已经有这一列的表。
+
+    参数:
+        conn (sqlite3.Connection): 数据库连接。
+        tables: 要增加版本列的表，默认为 VERSIONED_TABLES。
+    """
+    for table in tables:
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+        if columns and VERSION_COLUMN not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {VERSION_COLUMN} INTEGER NOT NULL DEFAULT 0")
+
+
+class OptimisticStats:
+    """乐观更新的统计：写入次数、CAS 失败（版本冲突）次数、重试用完的次数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.conflicts = 0
+        self.exhausted = 0
+
+    def record(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "conflicts": self.conflicts,
+                "exhausted": self.exhausted,
+                "conflict_rate": self.conflicts / self.attempts if self.attempts else 0.0,
+            }
+
+
+optimistic_stats = OptimisticStats()
+
+
+@lru_cache(maxsize=None)
+def select_statement(table: str) -> str:
+    """读取一行当前值（包括版本号）的 SELECT。"""
+    return f"SELECT * FROM {table} WHERE id = ?"
+
+
+@lru_cache(maxsize=256)
+def update_statement(table: str, columns: tuple) -> str:
+    """按版本号比较并更新（CAS）的 UPDATE：所有列合并在一条语句中，同时把版本号加一。参数依次为各列的新值、id、读出时的版本号。"""
+    assignments = "".join(f"{column} = ?, " for column in columns)
+    return (
+        f"UPDATE {table} SET {assignments}{VERSION_COLUMN} = {VERSION_COLUMN} + 1 "
+        f"WHERE id = ? AND {VERSION_COLUMN} = ?"
+    )
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+
+
+def optimistic_update(db_path: str, table: str, row_id: int, change, retries: int = MAX_RETRIES) -> str:
+    """
+    乐观并发控制的单行修改：先用读连接读出当前行（不占用写锁），由 change 根据当前行决定要写入的值，
+    再在写事务中执行 UPDATE ... WHERE id = ? AND version = ?。版本号不一致说明读出之后行被其他会话改过了，
+    重新读取并再次调用 change，最多重试 retries 次。写入成功时在同一个事务中读出改动的行，提交之后同步到热副本。
+
+    参数:
+        db_path (str): 数据库路径。
+        table (str): 表名，必须是 VERSIONED_TABLES 中的表。
+        row_id (int): 行的 id。
+        change: 函数，接收当前行的字典，返回列名 -> 新值的字典；当前状态不允许修改时返回 None。
+        retries (int): 版本冲突后最多重试的次数。
+
+    返回:
+        str: UPDATED、NOT_FOUND、REJECTED 或 CONFLICT。
+    """
+    pool = get_pool(db_path)
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(_backoff(attempt - 1))
+        with pool.reader() as conn:
+            rows = fetch_dicts(conn, select_statement(table), (row_id,))
+        if not rows:
+            return NOT_FOUND
+        values = change(rows[0])
+        if values is None:
+            return REJECTED
+        update = update_statement(table, tuple(values))
+        optimistic_stats.record("attempts")
+        with pool.writer() as conn:
+            cursor = conn.execute(update, (*values.values(), row_id, rows[0][VERSION_COLUMN]))
+            if cursor.rowcount > 0:
+                apply_hot_delta(conn, db_path, table, [row_id])
+                return UPDATED
+        optimistic_stats.record("conflicts")
+    optimistic_stats.record("exhausted")
+    return CONFLICT
+
+
+async def aoptimistic_update(db_path: str, table: str, row_id: int, change, retries: int = MAX_RETRIES) -> str:
+    """optimistic_update 的异步版本，通过 AsyncSQLitePool 读写，重试前的等待不阻塞事件循环。"""
+    pool = get_async_pool(db_path)
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(_backoff(attempt - 1))
+        async with pool.reader() as conn:
+            rows = await afetch_dicts(conn, select_statement(table), (row_id,))
+        if not rows:
+            return NOT_FOUND
+        values = change(rows[0])
+        if values is None:
+            return REJECTED
+        update = update_statement(table, tuple(values))
+        optimistic_stats.record("attempts")
+        async with pool.writer() as conn:
+            cursor = await conn.execute(update, (*values.values(), row_id, rows[0][VERSION_COLUMN]))
+            if cursor.rowcount > 0:
+                await aapply_hot_delta(conn, db_path, table, [row_id])
+                return UPDATED
+        optimistic_stats.record("conflicts")
+    optimistic_stats.record("exhausted")
+    return CONFLICT
+
+
+def set_booked(booked: int, **values):
+    """
+    生成预订/取消用的 change 函数：只有当前的 booked 与目标状态不同时才修改（不能重复预订，也不能取消没有预订的项目），
+    同时写入 values 中不为 None 的列。
+    """
+    values = {column: value for column, value in values.items() if value is not None}
+
+    def change(row: dict):
+        if row["booked"] == booked:
+            return None
+        return {"booked": booked, **values}
+
+    return change
+
+
+def set_values(**values):
+    """生成修改字段用的 change 函数，只写入不为 None 的列，没有要修改的列时拒绝修改。"""
+    values = {column: value for column, value in values.items() if value is not None}
+    return lambda row: values or None
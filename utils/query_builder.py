@@ -0,0 +1,131 @@
+import sqlite3
+from functools import lru_cache
+from typing import Iterator
+
+# sqlite3 在每个连接上按 SQL 文本缓存编译好的语句（LRU，默认 128 条）。航班搜索的过滤条件组合最多几十种，
+# 加上全文检索和预订工具的语句，放大到 512 条，保证常用的语句形状都不会被挤出缓存而重新编译
+STATEMENT_CACHE_SIZE = 512
+
+
+class Select:
+    """
+    SELECT 语句的构建器。只记录语句的"形状"（来源、列、条件模板、排序、是否有 LIMIT）和参数，
+    同一种形状渲染出的 SQL 文本完全相同（并且只拼接一次），这样 sqlite3 连接上的语句缓存总能命中，不会重复编译。
+
+    用法:
+        query, params = Select("flights").where("departure_airport = ?", "CDG").order_by("flight_id").limit(20).build()
+    """
+
+    def __init__(self, source: str, columns: str = "*"):
+        self._source = source
+        self._columns = columns
+        self._conditions = []
+        self._params = []
+        self._order_by = None
+        self._limit = None
+
+    def where(self, condition: str, *params) -> "Select":
+        """
+        追加一个用 AND 连接的条件。
+
+        参数:
+            condition (str): 带 ? 占位符的条件模板，例如 "arrival_airport = ?"。值不能直接拼进模板，否则每次都是新的语句。
+            params: 占位符对应的参数。
+        """
+        self._conditions.append(condition)
+        self._params.extend(params)
+        return self
+
+    def where_if(self, value, condition: str) -> "Select":
+        """value 不为空时追加条件 condition，参数就是 value。用于工具中的可选过滤条件。"""
+        if value:
+            self.where(condition, value)
+        return self
+
+    def order_by(self, expression: str) -> "Select":
+        self._order_by = expression
+        return self
+
+    def limit(self, limit) -> "Select":
+        """limit 为 None 时不限制行数。LIMIT 的值作为参数传入，不同的行数共用同一条语句。"""
+        self._limit = limit
+        return self
+
+    def build(self) -> tuple[str, list]:
+        """
+        返回:
+            tuple[str, list]: SQL 语句和参数列表。
+        """
+        has_limit = self._limit is not None
+        query = _render(self._source, self._columns, tuple(self._conditions), self._order_by, has_limit)
+        return query, self._params + [self._limit] if has_limit else list(self._params)
+
+
+@lru_cache(maxsize=1024)
+def _render(source: str, columns: str, conditions: tuple, order_by, has_limit: bool) -> str:
+    """把语句形状渲染成规范的 SQL 文本，结果按形状缓存，同一形状每次返回同一个字符串。"""
+    query = f"SELECT {columns} FROM {source}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    if has_limit:
+        query += " LIMIT ?"
+    return query
+
+
+class Connection(sqlite3.Connection):
+    """
+    连接池使用的连接类型（sqlite3.connect 的 factory 参数）。与 sqlite3.Connection 相同，
+    只是可以挂上属性，用来缓存这个连接上每条语句结果的列名。
+    """
+
+
+def _column_names(conn, query: str, cursor) -> tuple:
+    """
+    返回语句结果的列名。列名在语句编译时就确定了，每条语句在每个连接上只从 cursor.description 读取一次，之后从缓存中取；
+    缓存挂在连接上，表结构变化后（update_dates 会关闭并重建连接池）新连接会重新读取。普通的 sqlite3.Connection 不能挂属性，每次都读取。
+    """
+    statements = getattr(conn, "statement_columns", None)
+    if statements is None:
+        try:
+            conn.statement_columns = statements = {}
+        except AttributeError:
+            return tuple(column[0] for column in cursor.description)
+    names = statements.get(query)
+    if names is None:
+        names = statements[query] = tuple(column[0] for column in cursor.description)
+    return names
+
+
+def iter_dicts(conn, query: str, params=()) -> Iterator[dict]:
+    """
+    执行查询，逐行生成 {列名: 值} 字典，不会一次性 fetchall 到内存中。
+
+    参数:
+        conn (sqlite3.Connection): 数据库连接。
+        query (str): SQL 语句。
+        params: 参数。
+
+    返回:
+        Iterator[dict]: 每行结果的字典。
+    """
+    cursor = conn.execute(query, params)
+    names = _column_names(conn, query, cursor)
+    for row in cursor:
+        yield dict(zip(names, row))
+
+
+def fetch_dicts(conn, query: str, params=()) -> list[dict]:
+    """执行查询，返回 {列名: 值} 字典的列表，参数同 iter_dicts。"""
+    cursor = conn.execute(query, params)
+    names = _column_names(conn, query, cursor)
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+async def afetch_dicts(conn, query: str, params=()) -> list[dict]:
+    """fetch_dicts 的异步版本，conn 为 AsyncSQLitePool.reader() 借出的 aiosqlite 连接。"""
+    async with conn.execute(query, params) as cursor:
+        rows = await cursor.fetchall()
+        names = _column_names(conn, query, cursor)
+    return [dict(zip(names, row)) for row in rows]
@@ -0,0 +1,185 @@
+import os
+import re
+import threading
+import unicodedata
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# 查询向量缓存默认占用的内存上限（字节）。1536 维 float32 向量约 6KB，32MB 可以缓存五千多条查询
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# 规范化时去掉的首尾标点：同一个问题带不带问号、句号，向量几乎一样，当作同一条查询
+_EDGE_PUNCTUATION = " \t\r\n?？!！.。,，;；:：~～'\"“”‘’"
+
+
+def normalize_query(query: str) -> str:
+    """
+    缓存键使用的规范化查询文本：全角转半角（NFKC）、转小写、连续空白合并为一个空格、去掉首尾的空白和标点。
+
+    参数:
+        query (str): 原始查询。
+
+    返回:
+        str: 规范化后的查询。
+    """
+    text = unicodedata.normalize("NFKC", query).lower()
+    return re.sub(r"\s+", " ", text).strip(_EDGE_PUNCTUATION)
+
+
+class QueryEmbeddingCache:
+    """
+    线程安全的查询向量 LRU 缓存，以规范化后的查询文本为键，按向量实际占用的内存淘汰最久没有被访问的条目。
+    - 命中时不需要再请求远程嵌入接口；未命中时调用 embed_query 并写入缓存；
+    - 指定 path 时可以 load()/save() 到磁盘（.npz），重启后继续命中；文件中记录了模型名，换了模型时不会读入；
+    - 按轮（end_turn() 取出并清零）和进程内总计统计命中、未命中，以及节省的远程调用次数。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, path: str = None, model: str = ""):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.model = model
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._turn = {"hits": 0, "misses": 0}
+        self._total = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _record(self, name: str):
+        self._turn[name] += 1
+        self._total[name] += 1
+
+    def _put(self, key: str, vector: np.ndarray):
+        """在持有锁的情况下写入一条，超过内存上限时从最久没有访问的条目开始淘汰。"""
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._data[key] = vector
+        self._bytes += vector.nbytes
+        while self._bytes > self.max_bytes and len(self._data) > 1:
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._total["evictions"] += 1
+
+    def get_or_embed(self, query: str, embed_query) -> np.ndarray:
+        """
+        返回查询的向量，缓存中没有时调用 embed_query 计算。远程调用在锁外进行，不会阻塞其它线程的命中。
+
+        参数:
+            query (str): 查询文本。
+            embed_query: 函数，接收查询文本，返回向量（例如 Embeddings.embed_query）。
+
+        返回:
+            np.ndarray: 查询向量（float32，只读）。
+        """
+        key = normalize_query(query)
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is not None:
+                self._data.move_to_end(key)
+                self._record("hits")
+                return vector
+            self._record("misses")
+        vector = np.asarray(embed_query(query), dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._put(key, vector)
+        return vector
+
+    def get_or_embed_many(self, queries: list[str], embed_documents) -> np.ndarray:
+        """
+        get_or_embed 的批量版本：缓存中没有的查询（规范化后去重）合并在一次 embed_documents 请求中计算。
+
+        参数:
+            queries (list[str]): 查询文本列表。
+            embed_documents: 函数，接收文本列表，返回对应的向量列表（例如 Embeddings.embed_documents）。
+
+        返回:
+            np.ndarray: 每行对应一个查询的向量矩阵（float32）。
+        """
+        keys = [normalize_query(query) for query in queries]
+        found, missing = {}, {}
+        with self._lock:
+            for key, query in zip(keys, queries):
+                vector = found.get(key, self._data.get(key))
+                if vector is not None:
+                    self._data.move_to_end(key)
+                    found[key] = vector
+                    self._record("hits")
+                elif key in missing:
+                    # 同一批中重复的查询只计算一次，也算作命中
+                    self._record("hits")
+                else:
+                    missing[key] = query
+                    self._record("misses")
+        if missing:
+            vectors = np.asarray(embed_documents(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    vector.setflags(write=False)
+                    self._put(key, vector)
+                    found[key] = vector
+        return np.stack([found[key] for key in keys])
+
+    def load(self) -> int:
+        """
+        从 path 读入之前保存的缓存，文件不存在、已损坏或者是另一个模型的向量时什么都不做。
+
+        返回:
+            int: 读入的条目数。
+        """
+        if not self.path:
+            return 0
+        try:
+            with np.load(self.path, allow_pickle=False) as saved:
+                if str(saved["model"]) != self.model:
+                    return 0
+                keys, vectors = saved["keys"].tolist(), saved["vectors"]
+        except (OSError, ValueError, KeyError):
+            return 0
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector = np.array(vector, dtype=np.float32)
+                vector.setflags(write=False)
+                self._put(key, vector)
+        return len(keys)
+
+    def save(self):
+        """把当前缓存按 LRU 顺序写到 path（先写临时文件再原子替换）。没有指定 path 或缓存为空时什么都不做。"""
+        if not self.path:
+            return
+        with self._lock:
+            keys = list(self._data)
+            vectors = list(self._data.values())
+        if not keys:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp.npz"
+        np.savez(tmp, model=np.array(self.model), keys=np.array(keys), vectors=np.stack(vectors))
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _summary(stats: dict) -> dict:
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+            # 每次命中都省掉一次远程嵌入请求
+            "round_trips_saved": stats["hits"],
+        }
+
+    def end_turn(self) -> dict:
+        """返回本轮（上次调用 end_turn 之后）的统计并清零。"""
+        with self._lock:
+            turn, self._turn = self._turn, {"hits": 0, "misses": 0}
+        return self._summary(turn)
+
+    def stats(self) -> dict:
+        """
+        返回进程内的总计。
+
+        返回:
+            dict: 命中次数、未命中次数、命中率、节省的远程调用次数、淘汰次数、当前条目数和占用的字节数。
+        """
+        with self._lock:
+            return {**self._summary(dict(self._total)), "size": len(self._data), "bytes": self._bytes}
@@ -0,0 +1,236 @@
+"""
+知识库问答使用的重排模型（BAAI/bge-reranker-large）。
+
+原来每个问题都在 embedding_make 中调用 load_rerank_model()，每次都从磁盘反序列化一遍模型；模型文件不存在时还会
+os.system('apt install git') 再 git clone。现在：
+- get_reranker() 在第一次使用时加载模型，之后所有请求共用同一个实例，加载过程由锁保护，并发的第一批请求只会加载一次；
+  preload_reranker() 可以在进程启动时就在后台线程中加载，第一个问题不需要等待；
+- 模型文件不存在时用 git clone 下载（不执行 apt，也不经过 shell），git 不可用时直接报错；
+- rerank() 把 (问题, 文本) 对按长度排序后分批计算得分，同一批中的文本长度相近，填充（padding）的计算最少；
+- 可选的 ONNX int8 量化模型（onnxruntime，CPU 推理），通过 python -m utils.reranker export-onnx 导出，
+  导出后 get_reranker() 优先使用。
+
+用法（在 core 目录下运行，模型目录与 traval_llm_gradio.py 一致）:
+    PYTHONPATH=.. python -m utils.reranker export-onnx [HuggingFace 模型名或本地目录]
+"""
+import os
+import pickle
+import subprocess
+import sys
+import threading
+
+import numpy as np
+from loguru import logger
+
+try:
+    import onnxruntime
+except ImportError:  # 可选依赖，没有安装时使用原来的 FlagReranker
+    onnxruntime = None
+
+rerank_path = '../model/rerank_model'
+rerank_model_name = 'BAAI/bge-reranker-large'
+rerank_repo = 'https://code.openxlab.org.cn/answer-qzd/bge_rerank.git'
+# ONNX int8 量化模型及其分词器所在的目录
+rerank_onnx_dir = os.path.join(rerank_path, 'onnx-int8')
+# 每批最多的 (问题, 文本) 对数，以及每批填充后的总 token 数上限（批内最长的长度 * 对数）
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_TOKENS = 8192
+RERANK_MAX_LENGTH = 512
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def _download_model():
+    """用 git clone 下载模型仓库（模型文件通过 git lfs 保存）。"""
+    try:
+        subprocess.run(['git', 'clone', rerank_repo, rerank_path], check=True)
+        subprocess.run(['git', 'lfs', 'pull'], cwd=rerank_path, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(
+            f'下载重排模型失败，请安装 git 和 git-lfs 后重试，或手动把 {rerank_repo} 克隆到 {rerank_path}: {e}'
+        ) from e
+
+
+def load_rerank_model(model_name=rerank_model_name):
+    """
+    从磁盘加载重排模型（不缓存，通常应该使用 get_reranker()）。
+    安装了 onnxruntime 且已经导出了 ONNX int8 模型时加载 OnnxReranker，否则反序列化 FlagReranker 的 pickle 文件，
+    文件不存在时先下载。
+
+    参数:
+    - model_name (str): 模型的名称。默认为 'BAAI/bge-reranker-large'。
+
+    返回:
+    - FlagReranker 或 OnnxReranker 实例，都提供 compute_score(pairs, batch_size) 方法。
+    """
+    if onnxruntime is not None and os.path.exists(os.path.join(rerank_onnx_dir, 'model.onnx')):
+        logger.info('Loading ONNX int8 rerank model...')
+        return OnnxReranker(rerank_onnx_dir)
+
+    rerank_model_path = os.path.join(rerank_path, model_name.split('/')[1] + '.pkl')
+    if not os.path.exists(rerank_model_path):
+        _download_model()
+    logger.info('Loading rerank model...')
+    with open(rerank_model_path, 'rb') as f:
+        reranker_model = pickle.load(f)
+    logger.info('Rerank model loaded.')
+    return reranker_model
+
+
+def get_reranker():
+    """
+    返回进程内共享的重排模型，第一次调用时加载。加载失败时抛出异常，下一次调用会重新尝试。
+
+    返回:
+        FlagReranker 或 OnnxReranker 实例。
+    """
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = load_rerank_model()
+    return _reranker
+
+
+def preload_reranker() -> threading.Thread:
+    """在后台线程中加载重排模型，不阻塞进程启动；加载失败只记录日志，第一次使用时会再次尝试。"""
+
+    def _load():
+        try:
+            get_reranker()
+        except Exception as e:
+            logger.error(f'Failed to preload rerank model: {e}')
+
+    thread = threading.Thread(target=_load, name='preload-reranker', daemon=True)
+    thread.start()
+    return thread
+
+
+def length_sorted_batches(lengths: list[int], batch_size: int = RERANK_BATCH_SIZE,
+                          max_tokens: int = RERANK_MAX_TOKENS) -> list[list[int]]:
+    """
+    按长度从长到短排序后切分批次：每批最多 batch_size 个，且 批内最长的长度 * 个数 不超过 max_tokens。
+    同一批中的长度相近，按批内最长补齐时浪费的计算最少；最长的一批最先计算，内存峰值在一开始就能暴露出来。
+
+    参数:
+        lengths (list[int]): 每一项的长度。
+        batch_size (int): 每批最多的项数。
+        max_tokens (int): 每批填充后的总长度上限。
+
+    返回:
+        list[list[int]]: 每批包含的原始下标。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches, batch = [], []
+    for i in order:
+        # 从长到短排列，批内最长的就是第一项
+        longest = lengths[batch[0]] if batch else lengths[i]
+        if batch and (len(batch) >= batch_size or longest * (len(batch) + 1) > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def rerank(reranker, query, contexts, select_num, batch_size=RERANK_BATCH_SIZE):
+    """
+    使用重排序模型重排序，并取指定的前几个内容。(问题, 文本) 对按长度排序后分批计算得分，再按原来的顺序对应回去。
+
+    参数:
+        reranker: get_reranker() 返回的模型。
+        query (str): 问题。
+        contexts (list[str]): 候选文本。
+        select_num (int): 返回的文本数。
+        batch_size (int): 每批最多的 (问题, 文本) 对数。
+
+    返回:
+        list[str]: 得分最高的 select_num 个文本，按得分降序。
+    """
+    if not contexts:
+        return []
+    merge = [[query, context] for context in contexts]
+    scores = np.empty(len(merge), dtype=np.float64)
+    for batch in length_sorted_batches([len(query) + len(context) for context in contexts], batch_size):
+        batch_scores = reranker.compute_score([merge[i] for i in batch], batch_size=len(batch))
+        # FlagReranker 只有一对输入时返回单个分数
+        scores[batch] = np.atleast_1d(batch_scores)
+    sorted_indices = np.argsort(scores)[::-1]
+    return [contexts[i] for i in sorted_indices[:select_num]]
+
+
+class OnnxReranker:
+    """
+    用 onnxruntime 在 CPU 上运行 export_onnx_int8() 导出的动态 int8 量化模型，接口与 FlagReranker.compute_score 相同。
+    int8 矩阵乘法比 float32 快，模型文件和内存占用约为原来的四分之一，得分与原模型的排序基本一致。
+    """
+
+    def __init__(self, model_dir: str, max_length: int = RERANK_MAX_LENGTH, threads: int = None):
+        """
+        参数:
+            model_dir (str): 包含 model.onnx 和分词器文件的目录。
+            max_length (int): (问题, 文本) 对截断后的最大 token 数。
+            threads (int): onnxruntime 的算子内线程数，默认为 CPU 核数。
+        """
+        from transformers import AutoTokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, 'model.onnx'), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+    def compute_score(self, pairs, batch_size: int = RERANK_BATCH_SIZE):
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            inputs = self.tokenizer(
+                [query for query, _ in batch], [passage for _, passage in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors='np',
+            )
+            feeds = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+            scores.extend(self.session.run(None, feeds)[0].reshape(-1).tolist())
+        return scores
+
+
+def export_onnx_int8(model_name_or_dir: str = rerank_model_name, output_dir: str = rerank_onnx_dir):
+    """
+    把 HuggingFace 格式的重排模型导出为 ONNX，再用 onnxruntime 做动态 int8 量化，分词器保存在同一个目录中。
+    需要 torch、transformers 和 onnxruntime，只在导出时使用。
+
+    参数:
+        model_name_or_dir (str): HuggingFace 模型名或本地目录。
+        output_dir (str): 输出目录，量化后的模型为其中的 model.onnx。
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name_or_dir).eval()
+    sample = tokenizer([['问题', '文本']], padding=True, return_tensors='pt')
+    float_path = os.path.join(output_dir, 'model-float32.onnx')
+    torch.onnx.export(
+        model, (sample['input_ids'], sample['attention_mask']), float_path,
+        input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'},
+                      'logits': {0: 'batch'}},
+        opset_version=17,
+    )
+    quantize_dynamic(float_path, os.path.join(output_dir, 'model.onnx'), weight_type=QuantType.QInt8)
+    os.remove(float_path)
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f'ONNX int8 rerank model saved to {output_dir}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'export-onnx':
+        print(__doc__)
+        sys.exit(1)
+    export_onnx_int8(sys.argv[2] if len(sys.argv) > 2 else rerank_model_name)
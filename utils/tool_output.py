@@ -0,0 +1,208 @@
+import json
+import re
+import threading
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken 随 langchain-openai 安装，没有时按字符数估算 token 数
+    tiktoken = None
+
+# 发回给 LLM 的工具结果最多保留的字符数，超过时截掉后面的行并附上说明
+DEFAULT_MAX_CHARS = 6000
+
+# "2024-05-15 03:24:00.000000-04:00" -> 日期时间、小数秒、时区偏移
+_TIMESTAMP = re.compile(r"^(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})(\.\d+)?([+-]\d{2}:\d{2})?$")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 编码表需要联网下载，离线环境中同样退回到估算
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    统计文本的 token 数。安装了 tiktoken 时精确计算，否则按"ASCII 约 4 个字符一个 token、其它字符一个字符一个 token"估算。
+
+    参数:
+        text (str): 文本。
+
+    返回:
+        int: token 数。
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def _cell(value, offsets: set, nested: bool = False) -> str:
+    """
+    把一个单元格转换为文本：时间去掉全零的小数秒并记录时区偏移，列表用分号连接，
+    嵌套的字典只保留值、字段之间用逗号分隔（与表头 legs[flight_id,flight_no,...] 的字段一一对应）。
+    时间中含有空格，所以字段之间不能用空格分隔；嵌套值中原有的逗号和分号替换为 /，保证按分隔符切分时不会错位。
+    """
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        return ",".join(_cell(item, offsets, nested=True) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return "; ".join(_cell(item, offsets, nested) for item in value)
+    text = str(value)
+    match = _TIMESTAMP.match(text)
+    if match:
+        moment, fraction, offset = match.groups()
+        if fraction and fraction.strip(".0"):
+            moment += fraction
+        if offset:
+            offsets.add(offset)
+            # 先用占位符标出时区，等所有行处理完再决定是统一写在表头还是保留在每个时间后面
+            return f"{moment}\x00{offset}"
+        return moment
+    text = text.replace("|", "/").replace("\n", " ")
+    if nested:
+        text = text.replace(",", "/").replace(";", "/")
+    return text
+
+
+def _header(column: str, values: list) -> str:
+    """
+    列名；字典列或元素是字典的列表列，在列名后面用方括号注明字典的字段，例如 legs[flight_id,flight_no,...]。
+    字段取自这一列第一个非空的值。
+    """
+    for value in values:
+        if value in (None, "") or (isinstance(value, (list, tuple, dict)) and not value):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = value[0]
+        if isinstance(value, dict):
+            return f"{column}[{','.join(value)}]"
+        break
+    return column
+
+
+def encode_rows(rows: list[dict], drop_columns=(), max_chars: int = DEFAULT_MAX_CHARS) -> str:
+    """
+    把字典列表编码为紧凑的表格文本：第一行是列名，之后每行是一条记录，列之间用 | 分隔。
+    - drop_columns 中的列以及所有行都为空的列不输出；
+    - 所有时间的时区相同时只在表头说明一次；
+    - 超过 max_chars 时只保留前面的行，并说明省略了多少条。
+
+    参数:
+        rows (list[dict]): 工具返回的记录。
+        drop_columns: 不需要发给 LLM 的列。
+        max_chars (int): 表格最多保留的字符数。
+
+    返回:
+        str: 表格文本。
+    """
+    if not rows:
+        return "没有找到匹配的结果。"
+    # 列取所有行的键的并集（按第一次出现的顺序），合并的或结构不一致的结果中只出现在后面几行的列也会输出
+    columns = [column for column in dict.fromkeys(key for row in rows for key in row) if column not in drop_columns]
+    columns = [column for column in columns if any(row.get(column) not in (None, "") for row in rows)]
+    offsets = set()
+    lines = ["|".join(_cell(row.get(column), offsets) for column in columns) for row in rows]
+    note = ""
+    if len(offsets) == 1:
+        note = f"，时间均为 UTC{offsets.pop()}"
+        lines = [re.sub(r"\x00[+-]\d{2}:\d{2}", "", line) for line in lines]
+    else:
+        lines = [line.replace("\x00", "") for line in lines]
+
+    header = "|".join(_header(column, [row.get(column) for row in rows]) for column in columns)
+    budget = max_chars - len(header)
+    shown = 0
+    for line in lines:
+        budget -= len(line) + 1
+        if budget < 0 and shown:
+            break
+        shown += 1
+    text = [f"共 {len(rows)} 条{note}", header, *lines[:shown]]
+    if shown < len(rows):
+        text.append(f"（结果过长，省略了后面 {len(rows) - shown} 条，请缩小搜索条件或减少每次返回的数量）")
+    return "\n".join(text)
+
+
+def compact_result(result, drop_columns=(), max_chars: int = DEFAULT_MAX_CHARS) -> str:
+    """
+    把工具的返回值转换为发给 LLM 的紧凑文本。字典列表编码为表格；字典中的字典列表字段编码为表格，其它字段写成 "键: 值"；
+    其它类型的返回值原样转换为字符串。
+
+    参数:
+        result: 工具的返回值。
+        drop_columns: 不需要发给 LLM 的列。
+        max_chars (int): 表格最多保留的字符数。
+
+    返回:
+        str: 紧凑文本。
+    """
+    if isinstance(result, list) and all(isinstance(row, dict) for row in result):
+        return encode_rows(result, drop_columns, max_chars)
+    if isinstance(result, dict):
+        parts = []
+        for key, value in result.items():
+            if isinstance(value, list) and all(isinstance(row, dict) for row in value):
+                parts.append(f"{key}:\n{encode_rows(value, drop_columns, max_chars)}")
+            else:
+                parts.append(f"{key}: {'' if value is None else value}")
+        return "\n".join(parts)
+    return result if isinstance(result, str) else str(result)
+
+
+class ToolOutputStats:
+    """工具结果压缩前后的 token 数统计：按轮累计（end_turn() 取出并清零），同时保留进程内的总计。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turn = {}
+        self._total = {}
+
+    def record(self, tool_name: str, result, content: str):
+        """
+        记录一次工具调用。压缩前的大小按 ToolNode 原来的序列化方式（json.dumps）计算。
+
+        参数:
+            tool_name (str): 工具名。
+            result: 工具的原始返回值。
+            content (str): 压缩后发给 LLM 的文本。
+        """
+        original = count_tokens(json.dumps(result, ensure_ascii=False, default=str))
+        compact = count_tokens(content)
+        with self._lock:
+            for stats in (self._turn, self._total):
+                calls, before, after = stats.get(tool_name, (0, 0, 0))
+                stats[tool_name] = (calls + 1, before + original, after + compact)
+
+    @staticmethod
+    def _summary(stats: dict) -> dict:
+        before = sum(item[1] for item in stats.values())
+        after = sum(item[2] for item in stats.values())
+        return {
+            "calls": sum(item[0] for item in stats.values()),
+            "tokens_before": before,
+            "tokens_after": after,
+            "tokens_saved": before - after,
+            "by_tool": {name: {"calls": calls, "tokens_saved": b - a} for name, (calls, b, a) in stats.items()},
+        }
+
+    def end_turn(self) -> dict:
+        """返回本轮（上次调用 end_turn 之后）的统计并清零。"""
+        with self._lock:
+            turn, self._turn = self._turn, {}
+        return self._summary(turn)
+
+    def snapshot(self) -> dict:
+        """返回进程内的总计。"""
+        with self._lock:
+            return self._summary(dict(self._total))
+
+
+tool_output_stats = ToolOutputStats()
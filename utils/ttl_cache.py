@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    线程安全的 LRU + TTL 缓存：
+    - 超过 maxsize 时淘汰最久没有被访问的条目；
+    - 每个条目写入 ttl 秒后过期，过期的条目在下一次访问时被删除；
+    - 记录命中、未命中、过期、淘汰和主动失效的次数，通过 stats() 查看。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        """在持有锁的情况下查找未过期的值，找不到时返回 _MISSING。"""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return _MISSING
+        return value
+
+    def get(self, key, default=None):
+        """
+        读取缓存，并计入命中率统计。
+
+        参数:
+            key: 缓存键。
+            default: 没有命中时返回的值。
+
+        返回:
+            缓存的值，没有命中或已过期时返回 default。
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def peek(self, key, default=None):
+        """与 get 相同，但不计入命中率统计、也不更新 LRU 顺序，用于路由判断这类只想知道缓存是否有效的场景。"""
+        with self._lock:
+            value = self._lookup(key)
+            return default if value is _MISSING else value
+
+    def set(self, key, value):
+        """
+        写入缓存，超过容量时淘汰最久没有被访问的条目。
+
+        参数:
+            key: 缓存键。
+            value: 缓存的值。
+        """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        删除一个条目，数据被修改后调用，下次读取时重新加载。
+
+        参数:
+            key: 缓存键。
+        """
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """清空缓存（统计信息保留）。"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        返回缓存的统计信息。
+
+        返回:
+            dict: 命中次数、未命中次数、命中率、过期/淘汰/主动失效次数以及当前条目数。
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._data),
+            }
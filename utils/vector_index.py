@@ -0,0 +1,419 @@
+import heapq
+import json
+import os
+import uuid
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # 可选依赖，没有安装时不能使用 HNSWIndex
+    hnswlib = None
+
+META = "index.json"
+# 精确检索每次打分的文档行数。峰值内存约为 查询数 * 块行数 * 4 字节的得分，加上 int8 存储时一块向量转成 float32 的副本
+DEFAULT_CHUNK_ROWS = 4096
+# 精确检索支持的向量存储格式
+QUANTIZATIONS = ("float32", "int8")
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个位置，按得分降序排列。argpartition 只做部分排序，再对这 k 个排序。"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(-scores[top])]
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """_top_k 的批量版本：对得分矩阵的每一行沿 axis=1 取前 k 个位置，按得分降序排列。"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+class VectorIndex:
+    """
+    向量索引的接口，按点积（向量已归一化时即余弦相似度）检索最相似的文档。每个后端实现：
+    - build(vectors)：由向量矩阵（第 i 行对应第 i 个文档）建立索引；
+    - search(query, k)：返回 (文档下标数组, 得分数组)，按得分降序；
+    - search_batch(queries, k)：一次检索多个查询，返回每行对应一个查询的 (下标矩阵, 得分矩阵)；
+    - save(directory) / load(directory)：把索引保存到目录中、从目录读回。目录中的 index.json 记录后端名和参数，
+      load_index() 据此选择后端。
+    """
+
+    name = ""
+
+    def build(self, vectors: np.ndarray) -> "VectorIndex":
+        raise NotImplementedError
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def search_batch(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # 默认逐个查询，能一次处理多个查询的后端覆盖这个方法
+        results = [self.search(query, k) for query in np.asarray(queries, dtype=np.float32)]
+        k = min([len(ids) for ids, _ in results] or [0])
+        return (np.array([ids[:k] for ids, _ in results], dtype=np.int64).reshape(len(results), k),
+                np.array([scores[:k] for _, scores in results], dtype=np.float32).reshape(len(results), k))
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _params(self) -> dict:
+        """保存到 index.json 中的后端参数。"""
+        return {}
+
+    def _save_data(self, directory: str):
+        raise NotImplementedError
+
+    def _load_data(self, directory: str, meta: dict):
+        raise NotImplementedError
+
+    def save(self, directory: str, fingerprint: str = ""):
+        """
+        保存索引。数据文件写完之后才写 index.json（先写临时文件再原子替换），读到 index.json 时数据一定是完整的。
+
+        参数:
+            directory (str): 保存的目录。
+            fingerprint (str): 建立索引所用数据的标识（例如所有文档内容哈希的哈希），load_or_build 据此判断索引是否过期。
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._save_data(directory)
+        meta = {"backend": self.name, "size": len(self), "fingerprint": fingerprint, "params": self._params()}
+        tmp = os.path.join(directory, f"{META}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(directory, META))
+
+    @classmethod
+    def load(cls, directory: str, meta: dict = None) -> "VectorIndex":
+        if meta is None:
+            meta = read_meta(directory)
+        index = cls(**meta["params"])
+        index._load_data(directory, meta)
+        return index
+
+
+class ExactIndex(VectorIndex):
+    """
+    精确检索：查询向量与所有文档向量做点积，再取前 k 个。默认后端。
+    - 向量以 float32 保存，或者量化为 int8（每行一个缩放系数，内存是 float32 的四分之一，相似度的误差很小）；
+    - 保存后读回时内存映射，不需要把整个矩阵读入内存，由操作系统按需换入换出；
+    - 每次只对 chunk_rows 行打分，每块取前 k 个后与目前最好的 k 个合并，峰值内存只与块大小和 k 有关，不随文档数增长。
+    """
+
+    name = "exact"
+
+    def __init__(self, quantize: str = "float32", chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        """
+        参数:
+            quantize (str): 向量的存储格式，"float32" 或 "int8"。
+            chunk_rows (int): 每次打分的文档行数。
+        """
+        if quantize not in QUANTIZATIONS:
+            raise ValueError(f"不支持的向量存储格式: {quantize}，可选: {', '.join(QUANTIZATIONS)}")
+        self.quantize = quantize
+        self.chunk_rows = chunk_rows
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._scales = None  # int8 存储时每一行的缩放系数：原向量 ≈ int8 向量 * 缩放系数
+
+    def build(self, vectors: np.ndarray) -> "ExactIndex":
+        # 已经是 float32 的矩阵（包括内存映射的矩阵）不会被复制
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.quantize == "float32":
+            self._vectors = vectors
+            return self
+        self._vectors = np.empty(vectors.shape, dtype=np.int8)
+        self._scales = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), self.chunk_rows):
+            chunk = np.asarray(vectors[start:start + self.chunk_rows])
+            # 对称量化：每一行绝对值最大的分量映射到 127
+            scales = np.abs(chunk).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            self._vectors[start:start + len(chunk)] = np.rint(chunk / scales[:, None])
+            self._scales[start:start + len(chunk)] = scales
+        return self
+
+    def _chunks(self):
+        for start in range(0, len(self._vectors), self.chunk_rows):
+            yield start, min(start + self.chunk_rows, len(self._vectors))
+
+    def _chunk_scores(self, queries: np.ndarray, start: int, end: int) -> np.ndarray:
+        """queries（每行一个查询）与第 start 到 end 行文档的得分矩阵。"""
+        chunk = self._vectors[start:end]
+        if self._scales is None:
+            return queries @ chunk.T
+        return (queries @ chunk.astype(np.float32).T) * self._scales[start:end]
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query, dtype=np.float32)[None, :]
+        # 小顶堆，保存目前最好的 k 个 (得分, 下标)，堆顶是其中得分最低的
+        heap = []
+        for start, end in self._chunks():
+            scores = self._chunk_scores(query, start, end)[0]
+            for i in _top_k(scores, k):
+                item = (float(scores[i]), start + int(i))
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        best = sorted(heap, reverse=True)
+        return np.array([i for _, i in best], dtype=np.int64), np.array([s for s, _ in best], dtype=np.float32)
+
+    def search_batch(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # 每一块所有查询一次矩阵乘法，沿 axis=1 取前 k 个，再与目前每个查询最好的 k 个合并
+        queries = np.asarray(queries, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start, end in self._chunks():
+            scores = self._chunk_scores(queries, start, end)
+            top = _top_k_rows(scores, k)
+            candidate_ids = np.concatenate([best_ids, top + start], axis=1)
+            candidate_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            keep = _top_k_rows(candidate_scores, k)
+            best_ids = np.take_along_axis(candidate_ids, keep, axis=1)
+            best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+        return best_ids, best_scores
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def _params(self) -> dict:
+        return {"quantize": self.quantize, "chunk_rows": self.chunk_rows}
+
+    def _save_data(self, directory: str):
+        np.save(os.path.join(directory, "vectors.npy"), self._vectors)
+        if self._scales is not None:
+            np.save(os.path.join(directory, "scales.npy"), self._scales)
+
+    def _load_data(self, directory: str, meta: dict):
+        self._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        if self.quantize == "int8":
+            self._scales = np.load(os.path.join(directory, "scales.npy"))
+
+
+class IVFIndex(VectorIndex):
+    """
+    倒排文件索引（IVF），纯 NumPy 实现：用球面 k-means 把文档向量分成 nlist 个簇，查询时只计算与查询最相近的
+    nprobe 个簇中的文档。同一个簇的向量在内存中连续存放，每个簇只需要一次矩阵乘法。
+    nprobe 越大召回率越高、速度越慢；nprobe = nlist 时与精确检索结果相同。
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, iterations: int = 10, seed: int = 0):
+        """
+        参数:
+            nlist (int): 簇的个数，0 表示按文档数自动选择（约为文档数的平方根）。
+            nprobe (int): 查询时检查的簇数。
+            iterations (int): k-means 的迭代次数。
+            seed (int): 选择初始簇中心的随机种子。
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self._centroids = np.empty((0, 0), dtype=np.float32)
+        self._vectors = np.empty((0, 0), dtype=np.float32)  # 按簇重新排列后的向量
+        self._ids = np.empty(0, dtype=np.int64)  # 重新排列后每一行对应的原始下标
+        self._offsets = np.zeros(1, dtype=np.int64)  # 第 i 个簇占 [offsets[i], offsets[i + 1]) 行
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        # 分块计算，避免文档很多时一次生成 n * nlist 的大矩阵
+        return np.concatenate([
+            np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1) for i in range(0, len(vectors), chunk)
+        ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+    def build(self, vectors: np.ndarray) -> "IVFIndex":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        if n == 0:
+            # 没有文档时不做聚类，查询直接返回空结果
+            dim = vectors.shape[1] if vectors.ndim == 2 else 0
+            self._centroids = np.empty((0, dim), dtype=np.float32)
+            self._vectors = np.empty((0, dim), dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+            self._offsets = np.zeros(1, dtype=np.int64)
+            return self
+        nlist = min(self.nlist or max(1, int(np.sqrt(n))), n)
+        rnd = np.random.default_rng(self.seed)
+        centroids = vectors[rnd.choice(n, nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assign = self._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # 空簇重新随机选一个文档作为中心
+            sums[empty] = vectors[rnd.choice(n, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        assign = self._assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        self.nlist = nlist
+        self._centroids = centroids.astype(np.float32)
+        self._vectors = vectors[order]
+        self._ids = order.astype(np.int64)
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        return self
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query, dtype=np.float32)
+        if not len(self._ids):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        probes = _top_k(self._centroids @ query, self.nprobe)
+        # 每个簇是连续的一段行，按段切片计算，不需要先把选中的向量拷贝到一起
+        spans = [(self._offsets[i], self._offsets[i + 1]) for i in probes]
+        scores = np.concatenate([self._vectors[start:end] @ query for start, end in spans])
+        ids = np.concatenate([self._ids[start:end] for start, end in spans])
+        top = _top_k(scores, k)
+        return ids[top], scores[top]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _params(self) -> dict:
+        return {"nlist": self.nlist, "nprobe": self.nprobe, "iterations": self.iterations, "seed": self.seed}
+
+    def _save_data(self, directory: str):
+        np.savez(os.path.join(directory, "ivf.npz"), centroids=self._centroids, vectors=self._vectors,
+                 ids=self._ids, offsets=self._offsets)
+
+    def _load_data(self, directory: str, meta: dict):
+        with np.load(os.path.join(directory, "ivf.npz")) as data:
+            self._centroids = data["centroids"]
+            self._vectors = data["vectors"]
+            self._ids = data["ids"]
+            self._offsets = data["offsets"]
+
+
+class HNSWIndex(VectorIndex):
+    """
+    基于 hnswlib 的 HNSW 图索引（可选依赖：pip install hnswlib）。查询时间随文档数近似对数增长，
+    ef 越大召回率越高、速度越慢；M 和 ef_construction 影响建索引的时间和图的质量。
+    """
+
+    name = "hnsw"
+
+    def __init__(self, m: int = 16, ef_construction: int = 200, ef: int = 64, dim: int = 0):
+        if hnswlib is None:
+            raise ImportError("HNSWIndex 需要安装 hnswlib：pip install hnswlib")
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.dim = dim
+        self._index = None
+        self._size = 0
+
+    def build(self, vectors: np.ndarray) -> "HNSWIndex":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.dim = vectors.shape[1]
+        self._size = len(vectors)
+        self._index = hnswlib.Index(space="ip", dim=self.dim)
+        self._index.init_index(max_elements=max(self._size, 1), ef_construction=self.ef_construction, M=self.m)
+        if self._size:
+            self._index.add_items(vectors, np.arange(self._size))
+        self._index.set_ef(self.ef)
+        return self
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, self._size)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # ef 必须不小于 k
+        self._index.set_ef(max(self.ef, k))
+        labels, distances = self._index.knn_query(np.asarray(query, dtype=np.float32), k=k)
+        # 内积空间中 hnswlib 返回的距离是 1 - 点积
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+    def search_batch(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, self._size)
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+        self._index.set_ef(max(self.ef, k))
+        # hnswlib 一次调用检索所有查询，内部多线程并行
+        labels, distances = self._index.knn_query(queries, k=k)
+        return labels.astype(np.int64), 1.0 - distances
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _params(self) -> dict:
+        return {"m": self.m, "ef_construction": self.ef_construction, "ef": self.ef, "dim": self.dim}
+
+    def _save_data(self, directory: str):
+        self._index.save_index(os.path.join(directory, "hnsw.bin"))
+
+    def _load_data(self, directory: str, meta: dict):
+        self._size = meta["size"]
+        self._index = hnswlib.Index(space="ip", dim=self.dim)
+        self._index.load_index(os.path.join(directory, "hnsw.bin"), max_elements=max(self._size, 1))
+        self._index.set_ef(self.ef)
+
+
+# 后端名 -> 索引类
+INDEX_BACKENDS = {cls.name: cls for cls in (ExactIndex, IVFIndex, HNSWIndex)}
+
+
+def create_index(backend: str = "exact", **params) -> VectorIndex:
+    """
+    创建指定后端的空索引。
+
+    参数:
+        backend (str): "exact"、"ivf" 或 "hnsw"。
+        **params: 后端的参数，例如 IVFIndex 的 nlist、nprobe。
+
+    返回:
+        VectorIndex: 还没有 build 的索引。
+    """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"未知的向量索引后端: {backend}，可选: {', '.join(INDEX_BACKENDS)}")
+    return INDEX_BACKENDS[backend](**params)
+
+
+def read_meta(directory: str) -> dict:
+    with open(os.path.join(directory, META), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_index(directory: str) -> VectorIndex:
+    """按 index.json 中记录的后端读回 save() 保存的索引。"""
+    meta = read_meta(directory)
+    return INDEX_BACKENDS[meta["backend"]].load(directory, meta)
+
+
+def load_or_build(backend: str, directory: str, vectors: np.ndarray, fingerprint: str, **params) -> VectorIndex:
+    """
+    目录中保存的索引是同一个后端、且 fingerprint 相同时直接读回，否则用 vectors 重新建立并保存。
+    float32 的精确检索直接使用传入的（通常已经是内存映射的）向量，不读写目录。
+
+    参数:
+        backend (str): 后端名。
+        directory (str): 保存索引的目录。
+        vectors (np.ndarray): 文档向量矩阵，索引过期时用来重新建立。
+        fingerprint (str): 文档数据的标识。
+        **params: 后端的参数，与保存时的参数不同时同样重新建立。
+
+    返回:
+        VectorIndex: 可以查询的索引。
+    """
+    if backend == ExactIndex.name and params.get("quantize", "float32") == "float32":
+        return ExactIndex(**params).build(vectors)
+    try:
+        meta = read_meta(directory)
+        if (meta["backend"] == backend and meta["fingerprint"] == fingerprint
+                and all(meta["params"].get(name) == value for name, value in params.items())):
+            return INDEX_BACKENDS[backend].load(directory, meta)
+    except (OSError, ValueError, KeyError):
+        # 没有保存过或已损坏，重新建立
+        pass
+    index = create_index(backend, **params).build(vectors)
+    index.save(directory, fingerprint)
+    return index